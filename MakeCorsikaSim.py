@@ -11,6 +11,7 @@ SimulationMaker class can be used for generating the submission stings and sh ex
     made via the combinations of file and energies 
 
 Submitter class can be used to spawns subprocesses for multiple instances instead of multiple job submissions.
+    AsyncSubmitter class does the same with an asyncio event loop (--backend async).
 
 The args values can be used to specify the desired configuration for the simulation.
 
@@ -30,6 +31,15 @@ import numpy as np
 from utils.FileWriter import FileWriter
 from utils.SimulationMaker import SimulationMaker
 from utils.Submitter import Submitter
+from utils.AsyncSubmitter import AsyncSubmitter
+from utils.JobJournal import JobJournal
+from utils.StageOut import StageOut
+from utils.ShowerCatalog import ShowerCatalog
+from utils.JobOrdering import JobOrdering
+from utils.RuntimePredictor import RuntimePredictor
+from utils.WalltimeGuard import WalltimeGuard
+from utils.JobTimeouts import JobTimeouts
+from utils.FailureClassifier import FailureClassifier
 
 
 def __checkInputs(args):
@@ -40,6 +50,7 @@ def __checkInputs(args):
         primary is in the keys of the pimIdDict
         check if the corsika given is correct
         maybe a warning if seed value is over 900_000_000
+        showersPerRun is at least 1 and the number of simulations is a multiple of it
 
     seedValue = int((runNumber + self.primIdDict[self.primary]*1_000_000) % 900_000_001)
     """
@@ -65,6 +76,14 @@ def __checkInputs(args):
             \nCheck them, please!"
         )
 
+    if args.showersPerRun < 1:
+        sys.exit("The showersPerRun MUST be at least 1!!")
+
+    if (args.endNumber - args.startNumber) % args.showersPerRun:
+        sys.exit(
+            "The number of simulations (endNumber - startNumber) MUST be a multiple of showersPerRun!!"
+        )
+
     if args.primIdDict[args.primary] * 1_000_000 > 900_000_001:
         import warnings
 
@@ -75,6 +94,14 @@ def __checkInputs(args):
     return
 
 
+def classifyKey(key):
+    """
+    Returns the stage and the energy of a simulation key ({energy}_{runNumber}),
+    as needed by the WalltimeGuard and the JobTimeouts
+    """
+    return "corsika", float(key.split("_")[0])
+
+
 def mainCorsikaSim(args):
     """
     Some Documentation of the main function for the Corsika Simulator
@@ -126,8 +153,34 @@ def mainCorsikaSim(args):
             "start": args.zenithStart,  # Lower limit of azimuth (do not change unless you know what you are doing)
             "end": args.zenithEnd,
         },  # Upper limit of azimuth (do not change unless you know what you are doing)
+        showersPerRun=args.showersPerRun,
+        scratchDir=args.scratchDir,
     )
 
+    # The journal of the jobs, used to resume without scanning the data directories
+    journal = None
+    if args.journal:
+        journal = JobJournal(args.journal)
+
+    # Moves the simulations from the scratch to the data directory in the background.
+    # With launchMode script the move is done by the temporary sh file itself
+    stageOut = None
+    if args.scratchDir and args.launchMode == "direct":
+        stageOut = StageOut(maxWorkers=args.stageOutWorkers)
+
+    # The catalog of the produced showers, used by MakeDetectorResponse.py -catalog to select its inputs
+    catalog = None
+    if args.catalog:
+        catalog = ShowerCatalog(args.catalog, checksum=args.checksum)
+
+    # The order in which the energy bins are simulated, the most expensive first cuts the tail of the allocation
+    if args.costFile:
+        ordering = JobOrdering.fromFile(
+            args.costFile, policy=args.ordering, costExponent=args.costExponent
+        )
+    else:
+        ordering = JobOrdering(policy=args.ordering, costExponent=args.costExponent)
+
     simMaker = SimulationMaker(
         startNumber=args.startNumber,
         endNumber=args.endNumber,
@@ -135,19 +188,95 @@ def mainCorsikaSim(args):
         fW=fW,  # The fileWriter class
         pathCorsika=args.pathCorsika,
         corsikaExe=args.corsikaExe,
+        journal=journal,
+        launchMode=args.launchMode,
+        writeInp=args.writeInp,
+        stageOut=stageOut,
+        catalog=catalog,
+        ordering=ordering,
     )
 
+    # Only the simulations that can be completed before the end of the Slurm allocation are started.
+    # Their runtime is predicted from the simulations recorded in the journal
+    predictor = None
+    if journal is not None:
+        predictor = RuntimePredictor(args.journal, filters={"primary_": args.primary})
+    walltimeGuard = WalltimeGuard.fromSlurm(
+        remainingTime=args.remainingTime,
+        predictor=predictor,
+        classify=classifyKey,
+        margin=args.walltimeMargin,
+    )
+    # A simulation running longer than its timeout is killed and started again up to --maxRetries times
+    jobTimeouts = JobTimeouts(
+        default=args.timeout,
+        predictor=predictor if args.timeoutFactor > 0 else None,
+        classify=classifyKey,
+        factor=args.timeoutFactor,
+    )
+    # A simulation failing transiently (e.g. an LSDF hiccup) is started again after --retryBackoff seconds,
+    # the others are listed in {logDirProcesses}/dead_letters.jsonl
+    failureClassifier = FailureClassifier(retryClasses=args.retryClasses)
+
+    if args.backend == "async":
+        # Runs all the simulations in a single asyncio event loop
+        asyncSubmitter = AsyncSubmitter(
+            MakeKeySubString=simMaker.generator,
+            logDir=args.logDirProcesses,
+            parallel_sim=args.parallelSim,
+            logMode=args.logMode,
+            journal=journal,
+            callbacks=[simMaker.processCompleted],
+            stageOut=stageOut,
+            walltimeGuard=walltimeGuard,
+            interruptCallbacks=[simMaker.processInterrupted],
+            jobTimeouts=jobTimeouts,
+            maxRetries=args.maxRetries,
+            failureClassifier=failureClassifier,
+            retryBackoff=args.retryBackoff,
+        )
+        simMaker.isRetrying = asyncSubmitter.isRetrying
+        asyncSubmitter.run()
+        if stageOut is not None:
+            stageOut.close()
+        if catalog is not None:
+            catalog.close()
+        if args.longProfiles:
+            simMaker.extractLongProfiles()
+        return
+
     submitter = Submitter(
         MakeKeySubString=simMaker.generator,
         logDir=args.logDirProcesses,
         parallel_sim=args.parallelSim,
+        waitMode=args.waitMode,
+        logMode=args.logMode,
+        journal=journal,
+        callbacks=[simMaker.processCompleted],
+        stageOut=stageOut,
+        walltimeGuard=walltimeGuard,
+        interruptCallbacks=[simMaker.processInterrupted],
+        jobTimeouts=jobTimeouts,
+        maxRetries=args.maxRetries,
+        failureClassifier=failureClassifier,
+        retryBackoff=args.retryBackoff,
     )
+    # A failed simulation that is started again is still running for the SimulationMaker
+    simMaker.isRetrying = submitter.isRetrying
 
     # Starts the spawn of the simulations
     submitter.startProcesses()
     # Loops over the running processes and checks if any process is complete.
     # If so, it will spawn the next one
     submitter.checkRunningProcesses()
+    if stageOut is not None:
+        stageOut.close()
+    # Writes the showers of the files still read by the catalog (after the stage-out, which submits them)
+    if catalog is not None:
+        catalog.close()
+    # Converts the .long files of every energy bin into a single numpy file
+    if args.longProfiles:
+        simMaker.extractLongProfiles()
 
 
 if __name__ == "__main__":
@@ -242,6 +371,14 @@ if __name__ == "__main__":
         help="Upper limit of azimuth (do not change unless you know what you are doing)",
     )
 
+    parser.add_argument(
+        "--showersPerRun",
+        type=int,
+        default=1,
+        help="Number of showers simulated by a single Corsika run and stored in one DAT file. \
+            The run numbers move by this value (e.g. 5 gives DAT500000, DAT500005, ...) default: 1",
+    )
+
     parser.add_argument(
         "--logDirProcesses",
         type=str,
@@ -254,6 +391,152 @@ if __name__ == "__main__":
         default=100,
         help="Number of parallel simulation processes",
     )
+    parser.add_argument(
+        "--waitMode",
+        type=str,
+        default="event",
+        choices=["event", "poll"],
+        help="event: a new simulation starts as soon as one exits, poll: checks every 10 s (old behaviour)",
+    )
+    parser.add_argument(
+        "--logMode",
+        type=str,
+        default="file",
+        choices=["file", "pipe"],
+        help="file: processes write directly into their log files, pipe: output is buffered in memory (old behaviour)",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="submitter",
+        choices=["submitter", "async"],
+        help="submitter: uses the Submitter class, async: uses the AsyncSubmitter class with an asyncio event loop",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Maximum time in seconds of a single simulation, its process group is killed once exceeded. \
+            It is used if the runtime cannot be predicted from the --journal (default: no limit)",
+    )
+    parser.add_argument(
+        "--launchMode",
+        type=str,
+        default="script",
+        choices=["direct", "script"],
+        help="direct: Corsika is started directly with the steering card in stdin, \
+            script: an inp and a temporary sh file are written for every simulation (default: script)",
+    )
+    parser.add_argument(
+        "--writeInp",
+        action="store_true",
+        help="Writes the inp files also with --launchMode direct (e.g. for auditing) default: False",
+    )
+    parser.add_argument(
+        "--journal",
+        type=str,
+        default="",
+        help="SQLite file (on a local disk) where the state of every simulation is recorded. \
+            A resubmission resumes from it instead of listing the data directories (default: no journal)",
+    )
+    parser.add_argument(
+        "--scratchDir",
+        type=str,
+        default="",
+        help="Node-local directory (e.g. $TMPDIR or /dev/shm) where Corsika writes its output. \
+            The files are moved to the data directory once completed (default: the temp directory)",
+    )
+    parser.add_argument(
+        "--stageOutWorkers",
+        type=int,
+        default=4,
+        help="Number of threads moving the files from --scratchDir to the data directory, \
+            only used with --launchMode direct (default: 4)",
+    )
+    parser.add_argument(
+        "--catalog",
+        type=str,
+        default="",
+        help="SQLite file (on a local disk) where the showers of every completed simulation are added. \
+            It is used by MakeDetectorResponse.py -catalog to select the inputs (default: no catalog)",
+    )
+    parser.add_argument(
+        "--checksum",
+        type=str,
+        default="adler32",
+        choices=["adler32", "crc32", "none"],
+        help="Checksum of the files stored in the --catalog (default: adler32)",
+    )
+    parser.add_argument(
+        "--longProfiles",
+        action="store_true",
+        help="Once all simulations are completed, the .long files of every energy bin are converted \
+            into a single numpy file {dirSimulations}/long/{energy}.npy (default: False)",
+    )
+    parser.add_argument(
+        "--ordering",
+        type=str,
+        default="ascending",
+        choices=JobOrdering.policies,
+        help="Order of the energy bins: lpt starts the most expensive bins first, \
+            interleave takes one simulation of every bin in turn, ascending walks the bins from the lowest energy (default: ascending)",
+    )
+    parser.add_argument(
+        "--costFile",
+        type=str,
+        default="",
+        help='json file with the cost of a single simulation per energy bin, e.g. {"5.0": 300, "5.1": 380} \
+            (default: the cost model of --costExponent)',
+    )
+    parser.add_argument(
+        "--costExponent",
+        type=float,
+        default=1.0,
+        help="The cost of a simulation in a bin without --costFile is 10**(costExponent * energy) (default: 1.0)",
+    )
+    parser.add_argument(
+        "--remainingTime",
+        type=str,
+        default="",
+        help="Remaining time of the allocation in the Slurm format, e.g. 0-01:30:00 (for local tests). \
+            By default it is read from $SLURM_JOB_END_TIME or squeue, outside Slurm there is no limit",
+    )
+    parser.add_argument(
+        "--walltimeMargin",
+        type=float,
+        default=300,
+        help="Seconds kept free at the end of the allocation. No simulation is started whose runtime, \
+            predicted from the --journal, does not fit before it (default: 300)",
+    )
+    parser.add_argument(
+        "--timeoutFactor",
+        type=float,
+        default=3.0,
+        help="The timeout of a simulation is timeoutFactor times its runtime predicted from the --journal \
+            (at least 600 s), 0 disables the predicted timeouts and only --timeout is used (default: 3)",
+    )
+    parser.add_argument(
+        "--maxRetries",
+        type=int,
+        default=1,
+        help="How many times a timed out or transiently failed simulation is started again in the same submission. \
+            Its seeds are the same, thus only hangs not caused by the shower itself are cured (default: 1)",
+    )
+    parser.add_argument(
+        "--retryClasses",
+        type=str,
+        nargs="*",
+        default=["filesystem"],
+        choices=FailureClassifier.classes,
+        help="The classes of failures that are retried, the class is found from the exit code \
+            and the end of the log files (default: filesystem)",
+    )
+    parser.add_argument(
+        "--retryBackoff",
+        type=float,
+        default=60,
+        help="Seconds before the first retry of a failed simulation, doubled at every attempt (default: 60)",
+    )
 
     mainCorsikaSim(args=parser.parse_args())
 
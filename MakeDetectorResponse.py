@@ -21,7 +21,21 @@ import numpy as np
 
 from utils.Submitter import Submitter
 from utils.MultiProcesses import MultiProcesses
+from utils.ChainExecutor import ChainExecutor
+from utils.DagScheduler import DagScheduler, Task
+from utils.ResourceClasses import ResourcePool
+from utils.JobJournal import JobJournal
+from utils.StageOut import StageOut
 from utils.DetectorSimulator import DetectorSimulator
+from utils.CorsikaReader import CorsikaReader
+from utils.ShowerCatalog import ShowerCatalog
+from utils.JobOrdering import JobOrdering
+from utils.RuntimePredictor import RuntimePredictor
+from utils.WalltimeGuard import WalltimeGuard
+from utils.JobTimeouts import JobTimeouts
+from utils.FailureClassifier import FailureClassifier
+from utils.WarmWorker import WarmWorker
+from utils.FileCache import FileCache
 
 
 def make_parser():
@@ -49,6 +63,7 @@ def make_parser():
             It will create here a new folder: 'detector_response'.\
             Output folder name. The output file(s) will be <output>/generates/(topsimulator|detector)/[TopSimulator|Detector]_DETECTOR_corsika_icetop.MCDATASET.RUN.i3.bz2 \
             for level 0s, <output>/filtered/Level[1|2]_DETECTOR_corsika_icetop.MCDATASET.RUN.i3.bz2, for level 1 and 2, Level3_DETECTOR_DATASET_Run.RUN.i3.bz2 for level3 \
+            (.i3.bz2 by default, see -intermediateCodec and -finalCodec). \
             The condor files will be saved in the realtive condor folders",
     )
     ############################# General Requirement #####################################
@@ -134,6 +149,259 @@ def make_parser():
         default=100,
         help="Number of parallel simulation processes",
     )
+    parser.add_argument(
+        "-logMode",
+        type=str,
+        default="file",
+        choices=["file", "pipe"],
+        help="file: processes write directly into their log files, pipe: output is buffered in memory (old behaviour)",
+    )
+    parser.add_argument(
+        "-executor",
+        type=str,
+        default="multiprocess",
+        choices=["dag", "flat", "multiprocess"],
+        help="dag: every stage is a task and ready stages of any run are started as soon as a slot is free,\
+            flat: the stages of all runs are driven by this process, which only spawns the shell scripts,\
+            multiprocess: one forked process per run that spawns the shell scripts [default: multiprocess]",
+    )
+    parser.add_argument(
+        "-gpuDevices",
+        type=str,
+        default=os.environ.get("CUDA_VISIBLE_DEVICES", ""),
+        help="Comma separated list of the GPUs used by clsim, one clsim process per GPU (e.g. 0,1,2,3). \
+            Any name can be used to fake devices. Only used by -executor dag [default: $CUDA_VISIBLE_DEVICES]",
+    )
+    parser.add_argument(
+        "-totalMemory",
+        type=float,
+        default=None,
+        help="Memory in GB that can be used by all running stages together. Only used by -executor dag [default: no limit]",
+    )
+    parser.add_argument(
+        "-resourceConfig",
+        type=str,
+        default="",
+        help="json file with the resource classes of the stages (see utils/ResourceClasses.py). \
+            If given, -gpuDevices is ignored. Only used by -executor dag",
+    )
+    parser.add_argument(
+        "-journal",
+        type=str,
+        default="",
+        help="SQLite file (on a local disk) where the state of every stage is recorded. \
+            Stages done according to it are skipped without checking their inputs. Not used by -executor multiprocess",
+    )
+    parser.add_argument(
+        "-validateInputs",
+        type=str,
+        default="quick",
+        choices=["quick", "full", "none"],
+        help="quick: skips the corsika files that do not end with RUNE (only the last record is read), \
+            full: checks the sequence of all sub-blocks, none: uses every DAT file [default: quick]",
+    )
+    parser.add_argument(
+        "-catalog",
+        type=str,
+        default="",
+        help="SQLite shower catalog written by MakeCorsikaSim.py --catalog. \
+            If given, the inputs are taken from it instead of listing -inDirectory [default: no catalog]",
+    )
+    parser.add_argument(
+        "-updateCatalog",
+        action="store_true",
+        help="Adds the files of -inDirectory which are not in the -catalog yet (e.g. produced without it, \
+            or the files that are not valid for a catalog written before they were listed)",
+    )
+    parser.add_argument(
+        "-zenithMin",
+        type=float,
+        default=None,
+        help="Only the runs with a shower of zenith >= zenithMin (degrees) are simulated. Needs -catalog",
+    )
+    parser.add_argument(
+        "-zenithMax",
+        type=float,
+        default=None,
+        help="Only the runs with a shower of zenith <= zenithMax (degrees) are simulated. Needs -catalog",
+    )
+    parser.add_argument(
+        "-primaryId",
+        type=int,
+        default=None,
+        help="Only the runs with this Corsika primary (e.g. 14 proton, 5626 iron) are simulated. Needs -catalog",
+    )
+    parser.add_argument(
+        "-ordering",
+        type=str,
+        default="ascending",
+        choices=JobOrdering.policies,
+        help="Order of the energy bins: lpt starts the most expensive bins first, \
+            interleave takes one run of every bin in turn, ascending walks the bins from the lowest energy [default: ascending]",
+    )
+    parser.add_argument(
+        "-costFile",
+        type=str,
+        default="",
+        help='json file with the cost of a single run per energy bin, e.g. {"5.0": 300, "5.1": 350} \
+            [default: the cost model of -costExponent]',
+    )
+    parser.add_argument(
+        "-costExponent",
+        type=float,
+        default=1.0,
+        help="The cost of a run in a bin without -costFile is 10**(costExponent * energy) [default: 1.0]",
+    )
+    parser.add_argument(
+        "-scratchDir",
+        type=str,
+        default="",
+        help="Node-local directory (e.g. $TMPDIR or /dev/shm) where the temp files of the stages are written. \
+            With -executor dag they are moved to the data folders in the background [default: the temp folders]",
+    )
+    parser.add_argument(
+        "-warmSocket",
+        type=str,
+        default="",
+        help="Unix socket of a WarmWorker started in the icetray environment (see detectorResponse.sh). \
+            The python scripts of the stages are run by it, thus icetray is not imported by every stage [default: not used]",
+    )
+    parser.add_argument(
+        "-stageOutWorkers",
+        type=int,
+        default=4,
+        help="Number of threads moving the files from -scratchDir to the data folders. Only used by -executor dag [default: 4]",
+    )
+    parser.add_argument(
+        "-remainingTime",
+        type=str,
+        default="",
+        help="Remaining time of the allocation in the Slurm format, e.g. 0-01:30:00 (for local tests). \
+            By default it is read from $SLURM_JOB_END_TIME or squeue, outside Slurm there is no limit",
+    )
+    parser.add_argument(
+        "-walltimeMargin",
+        type=float,
+        default=300,
+        help="Seconds kept free at the end of the allocation. No stage is started whose runtime, \
+            predicted from the -journal, does not fit before it. Not used by -executor multiprocess [default: 300]",
+    )
+    parser.add_argument(
+        "-timeouts",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Timeouts in seconds of the stages, e.g. -timeouts clsim=36000 detector=7200. \
+            The process group of a stage running longer is killed. Not used by -executor multiprocess [default: none]",
+    )
+    parser.add_argument(
+        "-timeout",
+        type=float,
+        default=None,
+        help="Timeout in seconds of the stages that are neither in -timeouts nor predicted [default: no limit]",
+    )
+    parser.add_argument(
+        "-timeoutFactor",
+        type=float,
+        default=3.0,
+        help="The timeout of a stage not in -timeouts is timeoutFactor times its runtime predicted from the -journal \
+            (at least 600 s), 0 disables the predicted timeouts [default: 3]",
+    )
+    parser.add_argument(
+        "-maxRetries",
+        type=int,
+        default=1,
+        help="How many times a timed out or transiently failed stage is started again in the same submission [default: 1]",
+    )
+    parser.add_argument(
+        "-retryClasses",
+        type=str,
+        nargs="*",
+        default=["filesystem"],
+        choices=FailureClassifier.classes,
+        help="The classes of failures that are retried, the class is found from the exit code \
+            and the end of the .err file. Not used by -executor multiprocess [default: filesystem]",
+    )
+    parser.add_argument(
+        "-retryBackoff",
+        type=float,
+        default=60,
+        help="Seconds before the first retry of a failed stage, doubled at every attempt [default: 60]",
+    )
+    parser.add_argument(
+        "-batchSize",
+        type=int,
+        default=1,
+        help="Maximum number of runs of the same stage and energy bin run by a single python process, \
+            thus icetray is imported once per batch. Only used by -executor dag [default: 1, no batches]",
+    )
+    parser.add_argument(
+        "-batchStages",
+        type=str,
+        nargs="*",
+        default=["detector", "lv1", "lv2"],
+        choices=["polyplopia", "clsim", "detector", "lv1", "lv2", "lv3"],
+        help="The stages that are batched with -batchSize [default: detector lv1 lv2]",
+    )
+    parser.add_argument(
+        "-cacheDir",
+        type=str,
+        default="",
+        help="Node-local directory (e.g. /dev/shm/horekaCache or $TMPDIR/horekaCache) where the GCD file is cached, \
+            shared by all the jobs of the node. The photon tables are not cached, see -cachePhotonFiles [default: not cached]",
+    )
+    parser.add_argument(
+        "-cachePhotonFiles",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Files of --photonDirectory (relative paths, e.g. the splines used by the L1/L2 scripts) that are cached \
+            in -cacheDir too. The scripts then read a directory that only holds these files [default: none]",
+    )
+    parser.add_argument(
+        "-cacheSize",
+        type=float,
+        default=20,
+        help="Maximum size of the cache in GB, the least recently used files are removed beyond it [default: 20]",
+    )
+    parser.add_argument(
+        "-inputDecoding",
+        type=str,
+        default="file",
+        choices=["file", "fifo"],
+        help="How the bz2 corsika files are given to icetopshowergenerator.py. file: decompressed in the -scratchDir \
+            (or $TMPDIR) before the script, fifo: streamed through a named pipe while the script reads it. \
+            The decompressed file is removed once the script is over [default: file]",
+    )
+    parser.add_argument(
+        "-decodeThreads",
+        type=int,
+        default=4,
+        help="Threads used to decompress a bz2 corsika file if lbzip2 or pbzip2 is installed [default: 4]",
+    )
+    parser.add_argument(
+        "-intermediateCodec",
+        type=str,
+        default="bz2",
+        choices=list(DetectorSimulator.CODECS.keys()),
+        help="Compression of the outputs used only as input of the next stage. bz2 is slow to write and to read, \
+            zst (needs an icetray built with zstd) and gz are faster, none is the fastest but the largest [default: bz2]",
+    )
+    parser.add_argument(
+        "-finalCodec",
+        type=str,
+        default="bz2",
+        choices=list(DetectorSimulator.CODECS.keys()),
+        help="Compression of the outputs of the last stage that is run, the deliverables [default: bz2]",
+    )
+    parser.add_argument(
+        "-outputCodecs",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Compression of the outputs of single stages, e.g. -outputCodecs clsim=bz2 detector=zst. \
+            It overrides -intermediateCodec and -finalCodec [default: none]",
+    )
     ##################################################################
     parser.add_argument(
         "--photonDirectory",
@@ -192,6 +460,37 @@ def make_parser():
     return parser.parse_args()
 
 
+def make_resourcePool(args):
+    """
+    Makes the resource classes of the stages for the DagScheduler.
+    By default all stages share parallelSim cores,
+    while clsim runs once per GPU given in -gpuDevices (on the cpu if no GPU is given).
+    """
+    if args.resourceConfig:
+        return ResourcePool.fromFile(
+            args.resourceConfig,
+            totalCores=args.parallelSim,
+            totalMemory=args.totalMemory,
+        )
+
+    resourceClasses = {"cpu": {"slots": args.parallelSim, "cores": 1}}
+    stageClasses = {}
+    gpuDevices = [device for device in args.gpuDevices.split(",") if device]
+    if gpuDevices:
+        resourceClasses["gpu"] = {
+            "slots": len(gpuDevices),
+            "cores": 1,
+            "devices": gpuDevices,
+        }
+        stageClasses["clsim"] = "gpu"
+    return ResourcePool(
+        resourceClasses=resourceClasses,
+        stageClasses=stageClasses,
+        totalCores=args.parallelSim,
+        totalMemory=args.totalMemory,
+    )
+
+
 def generatorFake():
     """
     This is a fake generator that is used to in the submitter class to run the simulation in a single process.
@@ -210,6 +509,14 @@ class ProcessRunner:
         inDirectory: the directory where the data corsika files are located
         doFiltering: if True, the data will be filtered with the lv3 trigger filtering
         extraOptions: a dictionary with the extra options that will be passed to the submitter class # TODO: check if this is needed
+        validateInputs: "quick" checks that every corsika file ends with RUNE (only its last record is read),
+                        "full" checks all sub-blocks, "none" does not check the files (see utils/CorsikaReader.py)
+        catalog: the ShowerCatalog with the corsika files. If given the input directories are not listed
+                 and the files in it are not validated again (default None)
+        selection: dictionary with the conditions of ShowerCatalog.select (e.g. zenithMax), needs the catalog
+        ordering: the JobOrdering of the energy bins (default None, ascending energies)
+        journal: the JobJournal, the stages done according to it are skipped by stageChain (default None).
+                 The DagScheduler checks it itself
     """
 
     def __init__(
@@ -220,6 +527,11 @@ class ProcessRunner:
         inDirectory,
         doFiltering,
         extraOptions={},
+        validateInputs="quick",
+        catalog=None,
+        selection={},
+        ordering=None,
+        journal=None,
     ):
         self.detectorSim = detectorSim
         self.submitter = submitter
@@ -227,6 +539,15 @@ class ProcessRunner:
         self.inDirectory = inDirectory
         self.doFiltering = doFiltering
         self.extraOptions = extraOptions
+        self.validateInputs = validateInputs
+        self.catalog = catalog
+        self.selection = selection
+        self.ordering = ordering
+        if self.ordering is None:
+            self.ordering = JobOrdering(policy="ascending")
+        self.journal = journal
+        # The output file of every prepared stage by its key, for the temp files of the killed stages (see processInterrupted)
+        self.outputFiles = {}
 
     def generatorKeys(self):
         """
@@ -238,146 +559,311 @@ class ProcessRunner:
         procnum is the index of the run in the set of given inputs, so the first run that will be processed has procnum 1, no matter what the runid is, the last is my example would be 667
 
         some of the scripts (like icetopshowergenerator) take the base seed, nproc and proxcnum and calculate the actual used seed by combining those three numbers
+
+        A DAT file can hold several showers (MakeCorsikaSim.py --showersPerRun).
+        All of them are processed by the same job: the runID is the run number of the file
+        and the showers keep their Corsika event numbers (EVTNR 1, 2, ...), thus every (runID, event) stays unique.
+        Files next to the DAT files (e.g. DAT500000.long) are not inputs and are skipped,
+        as well as the corsika files that are not complete (e.g. truncated), see isValidInput.
+        Compressed corsika files (DAT500000.bz2) are inputs too, they are decompressed by the first stage
+        (see -inputDecoding) and are not validated.
+        With a catalog the files are taken from it without listing the directory and only the selected ones are yielded.
+        The catalog also lists the files that are not valid, thus nproc and procnum are still counted
+        over all files of the energy bin and the seeds do not change.
+        """
+        # loop over all energies (in the order of the JobOrdering) and yield the key and the arguments for the run_processes function
+        binKeys = {energy: self.binKeys(energy) for energy in self.energies}
+        yield from self.ordering.order(binKeys)
+
+    def binKeys(self, energy):
         """
-        # loop over all energies and yield the key and the arguments for the run_processes function
-        for energy in self.energies:
-            inDir = f"{self.inDirectory}/{energy}/"
+        This generator yields the key and the arguments of every corsika file in a single energy bin (see generatorKeys)
+        """
+        inDir = f"{self.inDirectory}/{energy}/"
+        selected = None
+        if self.catalog is not None:
+            # the catalog knows all files in the directory (also the ones that are not valid), already sorted
+            fileList = self.catalog.fileNames(energy)
+            selected = self.catalog.select(
+                energyMin=energy, energyMax=energy, **self.selection
+            )
+        else:
             # list all files in the directory and sort them
             fileList = sorted(
-                [f for f in os.listdir(inDir) if os.path.isfile(os.path.join(inDir, f))]
+                [
+                    f
+                    for f in os.listdir(inDir)
+                    if os.path.isfile(os.path.join(inDir, f))
+                ]
             )
-            # nproc is the number of files simulated per energy bin obtained by listing all files in the direcory and getting the len of it
-            nproc = len(fileList)
-            # loop over all files in the directory
-            for index, corsikaFile in enumerate(fileList):
-                if corsikaFile.endswith(".bz2"):
+        # nproc is the number of files simulated per energy bin obtained by listing all files in the direcory and getting the len of it
+        nproc = len(fileList)
+        # loop over all files in the directory
+        for index, corsikaFile in enumerate(fileList):
+            # The compressed corsika files (DAT500000.bz2) are decompressed by the first stage
+            compressed = corsikaFile.endswith(".bz2")
+            datName = corsikaFile[: -len(".bz2")] if compressed else corsikaFile
+            if not datName.startswith("DAT") or "." in datName:
+                continue
+            if selected is not None:
+                # The files in the catalog are already validated
+                if datName not in selected:
                     continue
-                runID = int(corsikaFile.partition("DAT")[-1][-5:])
-                runname = str(corsikaFile.partition("DAT")[-1])
-                procnum = index + 1
-                keyArgs = [energy, inDir + corsikaFile, runname, nproc, procnum, runID]
-                yield (f"{energy}_{runname}", keyArgs)
+            elif not compressed and not self.isValidInput(inDir + corsikaFile):
+                # The compressed files can not be read without decompressing them
+                continue
+            runID = int(datName.partition("DAT")[-1][-5:])
+            runname = str(datName.partition("DAT")[-1])
+            procnum = index + 1
+            keyArgs = [energy, inDir + corsikaFile, runname, nproc, procnum, runID]
+            yield (f"{energy}_{runname}", keyArgs)
 
-    def run_processes(self, energy, corsikaFile, runname, nproc, procnum, runID):
+    def isValidInput(self, corsikaFile):
+        """
+        Checks if the corsika file is complete according to validateInputs.
+        A warning with the reason is shown for the files that are not.
+        """
+        if self.validateInputs == "none":
+            return True
+        reader = CorsikaReader(corsikaFile)
+        if self.validateInputs == "full":
+            isValid = reader.validate()
+        else:
+            isValid = reader.isComplete()
+        reader.close()
+        if not isValid:
+            import warnings
+
+            warnings.warn(f"\nSkipping {corsikaFile}: {reader.error}")
+        return isValid
+
+    def stageTasks(self, energy, corsikaFile, runname, nproc, procnum, runID):
         """
         This functions can be edited and can be used for running all processes needed that can ebe found in DetectorSimulator
         If your function is not available, add it to the class and run it here.
+        It returns the list of tasks of a single run, in an order that respects their dependencies.
+        Each task depends on the task that produces its input file
+        (e.g. run_lv1 on run_detector and run_polyplopia on run_ITShowerGenerator and run_corsikaBg).
         """
+        tasks = []
+        # The attributes of the run recorded in the journal for the RuntimePredictor
+        # The primary of a compressed corsika file is not known without decompressing it
+        primary = None
+        if not corsikaFile.endswith(".bz2"):
+            reader = CorsikaReader(corsikaFile)
+            primary = reader.primary()
+            reader.close()
+        attributes = {
+            "energy": float(energy),
+            "primary": primary,
+            "numbSamples": self.detectorSim.NumbSamples,
+            "detector": self.detectorSim.detector,
+        }
+
+        def addTask(stage, prepare, dependencies=[]):
+            key = f"{energy}_{runname}_{stage}"
+
+            def prepareTask():
+                exeFile, outputFile = prepare()
+                if exeFile is not None:
+                    self.outputFiles[key] = outputFile
+                return exeFile, outputFile
+
+            task = Task(
+                key=key,
+                stage=stage,
+                prepare=prepareTask,
+                dependencies=[d for d in dependencies if d is not None],
+                attributes=attributes,
+            )
+            tasks.append(task)
+            return task
+
+        def inputOf(task):
+            # The input of a stage is the output of the previous one or the corsika file itself
+            return corsikaFile if task is None else task.outputFile
+
+        # The task which produces the input file for the next stage
+        inputTask = None
         ##################################### ITShowerGenerator ##########################################
         if self.extraOptions.get("doITSG"):
-            exeFile, ITSGFile = self.detectorSim.run_ITShowerGenerator(
-                energy=energy,
-                runname=runname,
-                inputFile=corsikaFile,
-                nproc=nproc,
-                procnum=procnum,
-                runID=runID,
-            )
-            if exeFile is not None:
-                print(energy, runname, "run_ITShowerGenerator")
-                self.executeFile(key=f"{energy}_{runname}_ITSG", exeFile=exeFile)
-            inputFile = ITSGFile
+
+            def prepareITSG():
+                return self.detectorSim.run_ITShowerGenerator(
+                    energy=energy,
+                    runname=runname,
+                    inputFile=corsikaFile,
+                    nproc=nproc,
+                    procnum=procnum,
+                    runID=runID,
+                )
+
+            inputTask = addTask("ITSG", prepareITSG)
         if self.extraOptions.get("doInIceBg"):
             ####################################### corsika #################################################
-            exeFile, corsikaBgFile = self.detectorSim.run_corsikaBg(
-                energy=energy,
-                runname=runname,
-                nproc=nproc,
-                procnum=procnum,
-                CORSIKA_samples=100,
-            )
-            if exeFile is not None:
-                print(energy, runname, "run_CorsikaBg")
-                self.executeFile(key=f"{energy}_{runname}_CorsikaBg", exeFile=exeFile)
+            def prepareCorsikaBg():
+                return self.detectorSim.run_corsikaBg(
+                    energy=energy,
+                    runname=runname,
+                    nproc=nproc,
+                    procnum=procnum,
+                    CORSIKA_samples=100,
+                )
+
+            corsikaBgTask = addTask("CorsikaBg", prepareCorsikaBg)
 
             ####################################### polyplopia #############################################
-            exeFile, polyplopiaFile = self.detectorSim.run_polyplopia(
-                energy=energy,
-                runname=runname,
-                inputFile=inputFile,
-                backgroundfile=corsikaBgFile,  # "corsika_bg.i3.bz2",
-                MCTreeName="I3MCTree",
-                OutputMCTreeName="I3MCTree",
-                mctype="corsika",
-                TimeWindow=40,
-                log_level="INFO",
-                extraOptions="",
+            def preparePolyplopia(inputTask=inputTask):
+                return self.detectorSim.run_polyplopia(
+                    energy=energy,
+                    runname=runname,
+                    inputFile=inputOf(inputTask),
+                    backgroundfile=corsikaBgTask.outputFile,  # "corsika_bg.i3.bz2",
+                    MCTreeName="I3MCTree",
+                    OutputMCTreeName="I3MCTree",
+                    mctype="corsika",
+                    TimeWindow=40,
+                    log_level="INFO",
+                    extraOptions="",
+                )
+
+            inputTask = addTask(
+                "polyplopia", preparePolyplopia, [inputTask, corsikaBgTask]
             )
-            if exeFile is not None:
-                print(energy, runname, "run_polyplopia")
-                self.executeFile(key=f"{energy}_{runname}_polyplopia", exeFile=exeFile)
-            inputFile = polyplopiaFile
 
         if self.extraOptions.get("doCLSIM"):
             ####################################### clsim ########################################
-            exeFile, clsimFile = self.detectorSim.run_clsim(
-                energy=energy,
-                runname=runname,
-                inputFile=inputFile,
-                nproc=nproc,
-                procnum=procnum,
-                oversize=5,
-                efficiency=1.0,
-                icemodel="spice_3.2.1",
-            )
-            if exeFile is not None:
-                print(energy, runname, "run_clsim")
-                self.executeFile(key=f"{energy}_{runname}_clsim", exeFile=exeFile)
-            inputFile = clsimFile
+            def prepareCLSIM(inputTask=inputTask):
+                return self.detectorSim.run_clsim(
+                    energy=energy,
+                    runname=runname,
+                    inputFile=inputOf(inputTask),
+                    nproc=nproc,
+                    procnum=procnum,
+                    oversize=5,
+                    efficiency=1.0,
+                    icemodel="spice_3.2.1",
+                )
+
+            inputTask = addTask("clsim", prepareCLSIM, [inputTask])
         ################################# detector ##############################################
         if self.extraOptions.get("doDET"):
-            exeFile, DETFile = self.detectorSim.run_detector(
-                energy=energy,
-                runname=runname,
-                inputFile=inputFile,
-                nproc=nproc,
-                procnum=procnum,
-                runID=runID,
-                doFiltering=self.doFiltering,
-                mcprescale=1,
-                mctype="CORSIKA",
-            )
-            if exeFile is not None:
-                print(energy, runname, "run_detector")
-                self.executeFile(key=f"{energy}_{runname}_detector", exeFile=exeFile)
+
+            def prepareDET(inputTask=inputTask):
+                return self.detectorSim.run_detector(
+                    energy=energy,
+                    runname=runname,
+                    inputFile=inputOf(inputTask),
+                    nproc=nproc,
+                    procnum=procnum,
+                    runID=runID,
+                    doFiltering=self.doFiltering,
+                    mcprescale=1,
+                    mctype="CORSIKA",
+                )
+
+            inputTask = addTask("detector", prepareDET, [inputTask])
         ################################### LV1 ############################################
         if self.extraOptions.get("doLV1"):
-            exeFile, LV1File = self.detectorSim.run_lv1(
-                energy=energy,
-                runname=runname,
-                DETFile=DETFile,
-            )
-            if exeFile is not None:
-                print(energy, runname, "run_lv1")
-                self.executeFile(key=f"{energy}_{runname}_lv1", exeFile=exeFile)
+
+            def prepareLV1(inputTask=inputTask):
+                return self.detectorSim.run_lv1(
+                    energy=energy,
+                    runname=runname,
+                    DETFile=inputOf(inputTask),
+                )
+
+            inputTask = addTask("lv1", prepareLV1, [inputTask])
         ################################## LV2 #############################################
         if self.extraOptions.get("doLV2"):
-            exeFile, LV2File = self.detectorSim.run_lv2(
-                energy=energy,
-                runname=runname,
-                LV1File=LV1File,
-                extraOptions=self.extraOptions.get("lv2"),
-            )
-            if exeFile is not None:
-                print(energy, runname, "run_lv2")
-                self.executeFile(key=f"{energy}_{runname}_lv2", exeFile=exeFile)
+
+            def prepareLV2(inputTask=inputTask):
+                return self.detectorSim.run_lv2(
+                    energy=energy,
+                    runname=runname,
+                    LV1File=inputOf(inputTask),
+                    extraOptions=self.extraOptions.get("lv2"),
+                )
+
+            inputTask = addTask("lv2", prepareLV2, [inputTask])
         #################################### LV3 ###########################################
         if self.extraOptions.get("doLV3"):
-            exeFile, LV3File = self.detectorSim.run_lv3(
-                energy=energy,
-                runname=runname,
-                LV2File=LV2File,
-                runID=runID,
-                extraOptions=self.extraOptions.get("lv3"),
-                domeff=1.0,
-            )
-            if exeFile is not None:
-                print(energy, runname, "run_lv3")
-                self.executeFile(key=f"{energy}_{runname}_lv3", exeFile=exeFile)
+
+            def prepareLV3(inputTask=inputTask):
+                return self.detectorSim.run_lv3(
+                    energy=energy,
+                    runname=runname,
+                    LV2File=inputOf(inputTask),
+                    runID=runID,
+                    extraOptions=self.extraOptions.get("lv3"),
+                    domeff=1.0,
+                )
+
+            inputTask = addTask("lv3", prepareLV3, [inputTask])
         ###############################################################################
 
+        return tasks
+
+    def stageChain(self, energy, corsikaFile, runname, nproc, procnum, runID):
+        """
+        It yields the key and the executable file of every stage of a single run that has to be executed.
+        The next stage is only prepared once the generator is resumed,
+        thus the caller MUST resume it only after the previous stage is completed.
+        The stages done according to the journal are skipped, as in the DagScheduler.
+        """
+        for task in self.stageTasks(
+            energy, corsikaFile, runname, nproc, procnum, runID
+        ):
+            if (self.journal is not None) and self.journal.isDone(task.key):
+                task.outputFile = self.journal.outputFile(task.key)
+                continue
+            exeFile, task.outputFile = task.prepare()
+            if exeFile is None:
+                if self.journal is not None:
+                    self.journal.markDone(task.key, task.outputFile)
+                continue
+            if self.journal is not None:
+                self.journal.markPlanned(
+                    task.key, task.outputFile, dict(task.attributes, stage=task.stage)
+                )
+            print(energy, runname, task.stage)
+            yield (task.key, exeFile)
         return
 
+    def run_processes(self, energy, corsikaFile, runname, nproc, procnum, runID):
+        """
+        Runs all the stages of a single run one after the other.
+        It is the function executed by the MultiProcesses class.
+        """
+        for key, exeFile in self.stageChain(
+            energy, corsikaFile, runname, nproc, procnum, runID
+        ):
+            self.executeFile(key=key, exeFile=exeFile)
+        return
+
+    def processInterrupted(self, key):
+        """
+        This function can be given as interrupt callback to the Submitter.
+        Once a stage is killed (e.g. at the end of the allocation or by its timeout) or given up,
+        its temp file is removed by DetectorSimulator.removeTempFiles at the end of the submission.
+        """
+        if key in self.outputFiles.keys():
+            self.detectorSim.discardOutput(self.outputFiles[key])
+
+    def generatorTasks(self):
+        """
+        This generator is used to generate the keys and the tasks of every run for the DagScheduler class.
+        """
+        for key, keyArgs in self.generatorKeys():
+            yield (key, self.stageTasks(*keyArgs))
+
+    def generatorChains(self):
+        """
+        This generator is used to generate the keys and stage chains for the ChainExecutor class.
+        """
+        for key, keyArgs in self.generatorKeys():
+            yield (key, self.stageChain(*keyArgs))
+
     def executeFile(self, key, exeFile):
         """
         This function executes the sh file that was created by the DetectorSimulator class.
@@ -388,6 +874,54 @@ class ProcessRunner:
         return
 
 
+def make_ordering(args):
+    """
+    Makes the JobOrdering of the energy bins from the arguments
+    """
+    if args.costFile:
+        return JobOrdering.fromFile(
+            args.costFile, policy=args.ordering, costExponent=args.costExponent
+        )
+    return JobOrdering(policy=args.ordering, costExponent=args.costExponent)
+
+
+def make_outputCodecs(args):
+    """
+    Returns the codec of the output of every stage for the DetectorSimulator.
+    The last stage that is run writes the deliverables with -finalCodec,
+    the others the intermediate products with -intermediateCodec, unless they are given in -outputCodecs.
+    The outputs of earlier submissions are used with whatever codec they were written (see DetectorSimulator.existingOutput).
+    """
+    stages = [
+        ("ITSG", args.doITSG),
+        ("CorsikaBg", args.doInIceBg),
+        ("polyplopia", args.doInIceBg),
+        ("clsim", args.doCLSIM),
+        ("detector", args.doDET),
+        ("lv1", args.doLV1),
+        ("lv2", args.doLV2),
+        ("lv3", args.doLV3),
+    ]
+    outputCodecs = {stage: args.intermediateCodec for stage, _ in stages}
+    finalStages = [stage for stage, isRun in stages if isRun]
+    if finalStages:
+        outputCodecs[finalStages[-1]] = args.finalCodec
+    for item in args.outputCodecs:
+        stage, _, codec = item.partition("=")
+        if codec not in DetectorSimulator.CODECS.keys():
+            raise SystemExit(f"Unknown codec {codec} of the stage {stage} in -outputCodecs")
+        outputCodecs[stage] = codec
+    return outputCodecs
+
+
+def classify_key(key):
+    """
+    Returns the stage and the energy of a stage key ({energy}_{runname}_{stage}),
+    as needed by the WalltimeGuard and the JobTimeouts
+    """
+    return key.rsplit("_", 1)[-1], float(key.split("_")[0])
+
+
 def mainLoop(args):
     """
     This is the main loop of the program.
@@ -400,6 +934,10 @@ def mainLoop(args):
     ProcessRunner  is the class that runs the simulation. Can be modified to run the simulation in a different way.
 
     mutliProcessor is the class that runs the processes in parallel by calling all the functions one after the other.
+
+    ChainExecutor is the class that instead runs the stages of all runs from this process (-executor flat).
+
+    DagScheduler is the class that runs every stage as a task as soon as its input is ready (-executor dag).
     """
 
     # Define the energies that are going to be simulated.
@@ -413,6 +951,29 @@ def mainLoop(args):
         decimals=1,  # the rounding has to have one single decimal point for the folder.
     )
 
+    # Moves the outputs of the stages from the scratch to the data folders in the background.
+    # The other executors chain the stages, thus the sh files move the outputs themselves
+    stageOut = None
+    if args.scratchDir and args.executor == "dag":
+        stageOut = StageOut(maxWorkers=args.stageOutWorkers)
+
+    # The warm worker is only used if it answers, it may still be importing icetray
+    warmSocket = ""
+    if args.warmSocket:
+        if WarmWorker.waitAvailable(args.warmSocket):
+            warmSocket = args.warmSocket
+        else:
+            import warnings
+
+            warnings.warn(
+                f"\nNo WarmWorker answers on {args.warmSocket}, every stage starts its own python"
+            )
+
+    # The GCD file (and the -cachePhotonFiles) is read by every stage, thus it is copied once per node
+    fileCache = None
+    if args.cacheDir:
+        fileCache = FileCache(args.cacheDir, maxBytes=args.cacheSize * 1024**3)
+
     # The class that creates all the sh files with the python scripts that are needed to run the simulation.
     detectorSim = DetectorSimulator(
         pythonPath=args.pythonPath,
@@ -428,6 +989,14 @@ def mainLoop(args):
         detector=args.detector,  # "IC86"
         GCD=args.GCD,
         photonDirectory=args.photonDirectory,
+        scratchDir=args.scratchDir,
+        stageOut=stageOut,
+        warmSocket=warmSocket,
+        fileCache=fileCache,
+        cachedPhotonFiles=args.cachePhotonFiles,
+        inputDecoding=args.inputDecoding,
+        decodeThreads=args.decodeThreads,
+        outputCodecs=make_outputCodecs(args),
     )
 
     # The class that spawns the python processes by calling multiple python scipts at the same time.
@@ -435,8 +1004,21 @@ def mainLoop(args):
         MakeKeySubString=generatorFake,
         logDir=args.logDirProcesses,
         parallel_sim=args.parallelSim,
+        logMode=args.logMode,
     )
 
+    # The catalog of the corsika files, used to select the inputs without listing the directories
+    catalog = None
+    if args.catalog:
+        catalog = ShowerCatalog(args.catalog)
+        if args.updateCatalog:
+            catalog.scanDirectory(args.inDirectory, energies)
+
+    # The journal of the stages, used to resume without checking every file
+    journal = None
+    if args.journal and args.executor != "multiprocess":
+        journal = JobJournal(args.journal)
+
     # The class that runs the simulation. Can be modified to run the simulation in a different way.
     processRun = ProcessRunner(
         detectorSim=detectorSim,
@@ -444,6 +1026,15 @@ def mainLoop(args):
         energies=energies,
         inDirectory=args.inDirectory,
         doFiltering=args.doFiltering,
+        validateInputs=args.validateInputs,
+        catalog=catalog,
+        selection={
+            "zenithMin": args.zenithMin,
+            "zenithMax": args.zenithMax,
+            "primary": args.primaryId,
+        },
+        ordering=make_ordering(args),
+        journal=journal,
         extraOptions={
             "doITSG": args.doITSG,
             "doInIceBg": args.doInIceBg,
@@ -455,6 +1046,80 @@ def mainLoop(args):
         },
     )
 
+    # Only the stages that can be completed before the end of the Slurm allocation are started.
+    # Their runtime is predicted from the stages recorded in the journal. The key is {energy}_{runname}_{stage}
+    predictor = None
+    if journal is not None:
+        predictor = RuntimePredictor(
+            args.journal, filters={"detector": detectorSim.detector}
+        )
+    walltimeGuard = WalltimeGuard.fromSlurm(
+        remainingTime=args.remainingTime,
+        predictor=predictor,
+        classify=classify_key,
+        margin=args.walltimeMargin,
+    )
+    # A stage running longer than its timeout is killed and started again up to -maxRetries times
+    jobTimeouts = JobTimeouts(
+        timeouts=JobTimeouts.parseTimeouts(args.timeouts),
+        default=args.timeout,
+        predictor=predictor if args.timeoutFactor > 0 else None,
+        classify=classify_key,
+        factor=args.timeoutFactor,
+    )
+    # A stage failing transiently (e.g. an LSDF hiccup) is started again after -retryBackoff seconds,
+    # the others are listed in {logDirProcesses}/dead_letters.jsonl and their dependents are not started
+    failureClassifier = FailureClassifier(retryClasses=args.retryClasses)
+
+    if args.executor == "dag":
+        # Starts every stage of any run as soon as the stage producing its input is completed.
+        dagScheduler = DagScheduler(
+            MakeKeyTasks=processRun.generatorTasks,
+            logDir=args.logDirProcesses,
+            parallel_sim=args.parallelSim,
+            logMode=args.logMode,
+            resourcePool=make_resourcePool(args),
+            journal=journal,
+            stageOut=stageOut,
+            walltimeGuard=walltimeGuard,
+            jobTimeouts=jobTimeouts,
+            maxRetries=args.maxRetries,
+            failureClassifier=failureClassifier,
+            retryBackoff=args.retryBackoff,
+            batchSize=args.batchSize,
+            batchStages=args.batchStages,
+            makeBatch=detectorSim.writeBatchFile,
+            interruptCallbacks=[processRun.processInterrupted],
+        )
+        dagScheduler.startProcesses()
+        dagScheduler.checkRunningProcesses()
+        if stageOut is not None:
+            stageOut.close()
+        # Removes the partial outputs of the stages killed by SIGTERM or by their timeout, or given up
+        detectorSim.removeTempFiles()
+        return
+
+    if args.executor == "flat":
+        # Advances the stages of every run in this process and only spawns the shell scripts.
+        chainExecutor = ChainExecutor(
+            MakeKeyChain=processRun.generatorChains,
+            logDir=args.logDirProcesses,
+            parallel_sim=args.parallelSim,
+            logMode=args.logMode,
+            journal=journal,
+            walltimeGuard=walltimeGuard,
+            jobTimeouts=jobTimeouts,
+            maxRetries=args.maxRetries,
+            failureClassifier=failureClassifier,
+            retryBackoff=args.retryBackoff,
+            interruptCallbacks=[processRun.processInterrupted],
+        )
+        chainExecutor.startProcesses()
+        chainExecutor.checkRunningProcesses()
+        # Removes the partial outputs of the stages killed by SIGTERM or by their timeout, or given up
+        detectorSim.removeTempFiles()
+        return
+
     # The class that runs the processes in parallel by calling all the functions one after the other.
     multiProcessor = MultiProcesses(
         keysGenerator=processRun.generatorKeys,
@@ -9,7 +9,8 @@ SCRIPT=/home/hk-project-pevradio/rn8463/simulations_scripts/MakeCorsikaSim.py
 cd /home/hk-project-pevradio/rn8463/corsika/corsika-77420/run/
 
 #TODO Make sure to change the parameters correctly. Documentation in the args of MakeCorsikaSim.py
-$PYTHON $SCRIPT \
+# exec replaces this shell, thus the python script receives the SIGTERM sent before the end of the allocation
+exec $PYTHON $SCRIPT \
                 --username rn8463 \
                 --primary 1 \
                 --dataset 14000.0 \
@@ -26,6 +27,8 @@ $PYTHON $SCRIPT \
                 --zenithStart 0.00000000 \
                 --zenithEnd 65.0000000 \
                 --logDirProcesses "/home/hk-project-pevradio/rn8463/logCorsikaGamma4/" \
-                --parallelSim 1
+                --parallelSim 1 \
+                --launchMode direct \
+                --ordering lpt
 
 # "/lsdf/kit/ikp/projects/IceCube/sim/gamma-sim/" \
\ No newline at end of file
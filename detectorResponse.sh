@@ -42,8 +42,26 @@ SCRIPT=/home/hk-project-pevradio/rn8463/simulations_scripts/MakeDetectorResponse
 
 
 ############### Filtered Lv1 and Lv2 #####################
+# Set USE_WARM_WORKER=1 to start a warm worker, which imports icetray once in the same environment.
+# The scripts of the stages are sent to it (-warmSocket) instead of starting a new python for each.
+# It stops by itself once this job (whose pid stays $$ after the exec) is over
+USE_WARM_WORKER=${USE_WARM_WORKER:-0}
+WARM_SOCKET=""
+if [ "$USE_WARM_WORKER" = "1" ]; then
+    WARM_SOCKET=${TMPDIR:-/tmp}/warmWorker_$$.sock
+    $environment2 $PYTHON $(dirname $SCRIPT)/utils/WarmWorker.py serve \
+                    --socket $WARM_SOCKET \
+                    --parentPid $$ \
+                    --preload icecube.icetray icecube.dataclasses icecube.dataio icecube.phys_services &
+fi
+
+# Set CACHE_DIR to a node-local directory (e.g. ${TMPDIR:-/tmp}/horekaCache) to cache the GCD file there (-cacheDir),
+# shared by all the jobs of the node. Empty reads it from CVMFS
+CACHE_DIR=${CACHE_DIR:-""}
+
 # $ENV $TRAY $PYTHON $SCRIPT \
-$environment2 $PYTHON $SCRIPT \
+# exec replaces this shell, thus the python script receives the SIGTERM sent before the end of the allocation
+exec $environment2 $PYTHON $SCRIPT \
                 -inDirectory "/hkfs/work/workspace/scratch/rn8463-gamma_simulations/corsika/data/" \
                 -outDirectory "/hkfs/work/workspace/scratch/rn8463-gamma_simulations/detector_response/" \
                 -pythonPath $PYTHON \
@@ -59,6 +77,10 @@ $environment2 $PYTHON $SCRIPT \
                 -energyStep 0.1 \
                 -logDirProcesses "/home/hk-project-pevradio/rn8463/log/logDetResponse5460lv2/" \
                 -parallelSim 1 \
+                -executor dag \
+                -ordering lpt \
+                -warmSocket "$WARM_SOCKET" \
+                -cacheDir "$CACHE_DIR" \
                 --photonDirectory "/cvmfs/icecube.opensciencegrid.org/data/photon-tables/" \
                 --NumbSamples 300 \
                 --NumbFrames 0 \
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Tests of the AsyncSubmitter with short real processes:
+the timeouts, the retries and the drain after SIGTERM are the same as with the Submitter.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import os
+import signal
+import threading
+import time
+import unittest
+
+from tests.test_Submitter import SubmitterTestCase, makeScript
+from utils.AsyncSubmitter import AsyncSubmitter
+from utils.FailureClassifier import FailureClassifier
+from utils.JobJournal import JobJournal
+from utils.JobTimeouts import JobTimeouts
+
+
+class AsyncSubmitterTestCase(SubmitterTestCase):
+    def runSubmitter(self, processes, **kwargs):
+        """
+        Runs all (key, processString) until they are completed and returns the AsyncSubmitter
+        """
+        submitter = AsyncSubmitter(
+            MakeKeySubString=lambda: iter(processes),
+            logDir=f"{self.baseDir}/logs",
+            callbacks=[self.processCompleted],
+            interruptCallbacks=[self.processInterrupted],
+            **kwargs,
+        )
+        submitter.run()
+        return submitter
+
+
+class TestAsyncSubmitter(AsyncSubmitterTestCase):
+    def test_completed(self):
+        submitter = self.runSubmitter(
+            [("true", "true"), ("false", "false"), ("sleep", "sleep 0.1")], parallel_sim=2
+        )
+        self.assertEqual(sorted(self.completed), [("false", 1), ("sleep", 0), ("true", 0)])
+        self.assertEqual(submitter.processDict, {})
+
+    def test_timeout(self):
+        start = time.monotonic()
+        self.runSubmitter(
+            [("hung", "sleep 30"), ("quick", "true")],
+            parallel_sim=2,
+            jobTimeouts=JobTimeouts(default=0.2),
+            maxRetries=1,
+        )
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(self.completed, [("quick", 0)])
+        # Started twice, then given up
+        self.assertEqual(self.interrupted, ["hung", "hung"])
+        self.assertEqual(self.deadLetters(), [("hung", "timeout")])
+
+    def test_retry(self):
+        flaky = self.makeFlaky()
+        self.runSubmitter(
+            [("flaky", flaky)],
+            failureClassifier=FailureClassifier(retryClasses=["filesystem"]),
+            maxRetries=1,
+            retryBackoff=0.1,
+        )
+        self.assertEqual(self.completed, [("flaky", 1), ("flaky", 0)])
+        self.assertEqual(self.deadLetters(), [])
+
+    def makeFlaky(self):
+        """
+        Writes a script that fails with a filesystem error the first time, then succeeds
+        """
+        marker = f"{self.baseDir}/flaky.marker"
+        return makeScript(
+            self.baseDir,
+            "flaky.sh",
+            f"if [ ! -e {marker} ]; then\n"
+            f"    touch {marker}\n"
+            "    echo 'Stale file handle' >&2\n"
+            "    exit 1\n"
+            "fi\n",
+        )
+
+    def test_drain(self):
+        journal = JobJournal(f"{self.baseDir}/journal.db")
+        timer = threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGTERM))
+        timer.start()
+        start = time.monotonic()
+        try:
+            self.runSubmitter(
+                [(f"sleep{index}", "sleep 30") for index in range(4)],
+                parallel_sim=2,
+                journal=journal,
+            )
+        finally:
+            timer.cancel()
+        self.assertLess(time.monotonic() - start, 10)
+        # The running processes are stopped and recorded as interrupted, the others are not started
+        self.assertEqual(sorted(self.interrupted), ["sleep0", "sleep1"])
+        self.assertEqual(self.completed, [])
+        self.assertEqual(journal.state("sleep0"), "interrupted")
+        self.assertIsNone(journal.state("sleep2"))
+        journal.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
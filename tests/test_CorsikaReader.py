@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Tests of the CorsikaReader on small synthetic Corsika files,
+with sub-blocks of 273 words (standard) and of 312 words (THINNING), with and without Fortran markers.
+They need numpy, they are skipped without it.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import os
+import tempfile
+import unittest
+
+try:
+    import numpy as np
+    from utils.CorsikaReader import CorsikaReader
+except ImportError:
+    np = None
+
+
+def writeCorsikaFile(
+    fileName,
+    runNumber=500001,
+    nShowers=2,
+    primary=14,
+    zenith=0.3,
+    subblockWords=273,
+    fortranMarkers=True,
+    particleBlocks=30,
+):
+    """
+    Writes a Corsika particle file with nShowers showers (RUNH, EVTH, particles, EVTE, ..., RUNE).
+    The words of the headers are numbered from 1 as in the Corsika manual.
+    The energy of the shower n is n * 1e5 GeV, it uses two random sequences with the seeds 111 n and 222 n.
+    """
+    subblocks = []
+
+    def addSubblock(name, words={}):
+        subblock = np.zeros(subblockWords, dtype=np.float32)
+        subblock[0] = np.frombuffer(name, dtype=np.float32)[0]
+        for word, value in words.items():
+            subblock[word - 1] = value
+        subblocks.append(subblock)
+
+    addSubblock(b"RUNH", {2: runNumber, 93: nShowers})
+    for event in range(1, nShowers + 1):
+        addSubblock(
+            b"EVTH",
+            {
+                2: event,
+                3: primary,
+                4: 1e5 * event,
+                11: zenith,
+                12: 1.2,
+                13: 2,
+                14: 111 * event,
+                17: 222 * event,
+                44: runNumber,
+            },
+        )
+        for _ in range(particleBlocks):
+            subblocks.append(np.ones(subblockWords, dtype=np.float32))
+        addSubblock(b"EVTE", {2: event})
+    addSubblock(b"RUNE", {2: runNumber, 3: nShowers})
+    while len(subblocks) % CorsikaReader.subblocksPerRecord:
+        subblocks.append(np.zeros(subblockWords, dtype=np.float32))
+
+    records = np.array(subblocks).reshape(-1, CorsikaReader.subblocksPerRecord * subblockWords)
+    marker = np.int32(records.shape[1] * 4).tobytes()
+    with open(fileName, "wb") as f:
+        for record in records:
+            if fortranMarkers:
+                f.write(marker)
+            f.write(record.tobytes())
+            if fortranMarkers:
+                f.write(marker)
+    return fileName
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestCorsikaReader(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.fileName = f"{self.tempDir.name}/DAT500001"
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def checkFile(self, subblockWords, fortranMarkers):
+        writeCorsikaFile(
+            self.fileName,
+            nShowers=3,
+            subblockWords=subblockWords,
+            fortranMarkers=fortranMarkers,
+        )
+        reader = CorsikaReader(self.fileName)
+        self.assertTrue(reader.isComplete(), reader.error)
+        self.assertTrue(reader.validate(), reader.error)
+        self.assertEqual(reader.subblockWords, subblockWords)
+        self.assertEqual(reader.fortranMarkers, fortranMarkers)
+        self.assertEqual(reader.primary(), 14)
+
+        table = reader.showerTable()
+        reader.close()
+        self.assertEqual(list(table["runNumber"]), [500001] * 3)
+        self.assertEqual(list(table["eventNumber"]), [1, 2, 3])
+        self.assertEqual(list(table["particleId"]), [14] * 3)
+        np.testing.assert_allclose(table["energy"], [1e5, 2e5, 3e5])
+        np.testing.assert_allclose(table["zenith"], [0.3] * 3)
+        # Only the seeds of the two sequences in use
+        self.assertEqual(list(table["seeds"][1]), [222, 444] + [0] * 8)
+
+    def test_273(self):
+        self.checkFile(273, fortranMarkers=True)
+
+    def test_312(self):
+        self.checkFile(312, fortranMarkers=True)
+
+    def test_273WithoutMarkers(self):
+        self.checkFile(273, fortranMarkers=False)
+
+    def test_312WithoutMarkers(self):
+        self.checkFile(312, fortranMarkers=False)
+
+    def test_truncated(self):
+        writeCorsikaFile(self.fileName, nShowers=3)
+        # A record is missing, as if Corsika was killed while writing
+        recordBytes = (CorsikaReader.subblocksPerRecord * 273 + 2) * 4
+        os.truncate(self.fileName, os.path.getsize(self.fileName) - recordBytes)
+        reader = CorsikaReader(self.fileName)
+        self.assertFalse(reader.isComplete())
+        self.assertFalse(reader.validate())
+        self.assertIn("RUNE", reader.error)
+
+        # Cut in the middle of a record
+        os.truncate(self.fileName, os.path.getsize(self.fileName) - 100)
+        reader = CorsikaReader(self.fileName)
+        self.assertFalse(reader.validate())
+        self.assertIn("truncated", reader.error)
+
+    def test_notCorsika(self):
+        with open(self.fileName, "wb") as f:
+            f.write(b"\0" * 4096)
+        reader = CorsikaReader(self.fileName)
+        self.assertFalse(reader.validate())
+        self.assertEqual(reader.error, "the file does not start with RUNH")
+        self.assertEqual(len(reader.showerTable()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
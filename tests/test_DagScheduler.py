@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Tests of the DagScheduler with small sh scripts as stages:
+the order of the dependent stages and the split of the ready stages into batches.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import json
+import unittest
+
+from tests.test_Submitter import SubmitterTestCase, makeScript
+from utils.DagScheduler import DagScheduler, Task
+
+
+class DagSchedulerTestCase(SubmitterTestCase):
+    """
+    Every stage appends its key to the order file and writes its output file, the failing stages exit with 1
+    """
+
+    stages = ["detector", "lv1", "lv2"]
+
+    def setUp(self):
+        super().setUp()
+        self.orderFile = f"{self.baseDir}/order"
+        self.prepared = []
+        self.batches = []
+
+    def makeRun(self, energy, runNumber, failing=[]):
+        """
+        Returns the tasks of the stages of a run, every stage depends on the previous one
+        """
+        tasks = []
+        for stage in self.stages:
+            key = f"{energy}_{runNumber}_{stage}"
+            exitCode = 1 if stage in failing else 0
+            tasks.append(
+                Task(
+                    key,
+                    stage,
+                    lambda key=key, exitCode=exitCode: self.prepare(key, exitCode),
+                    dependencies=tasks[-1:],
+                    attributes={"energy": energy},
+                )
+            )
+        return tasks
+
+    def prepare(self, key, exitCode):
+        self.prepared.append(key)
+        outputFile = f"{self.baseDir}/{key}.i3.bz2"
+        commands = f"echo {key} >> {self.orderFile}\n"
+        if exitCode == 0:
+            commands += f"touch {outputFile}\n"
+        exeFile = makeScript(self.baseDir, f"{key}.sh", commands + f"exit {exitCode}\n")
+        return exeFile, outputFile
+
+    def makeBatch(self, runs):
+        """
+        Writes a batch that runs the stages one after the other and appends their status (see BatchRunner)
+        """
+        self.batches.append([key for key, _, _ in runs])
+        batchName = f"batch{len(self.batches)}"
+        statusFile = f"{self.baseDir}/{batchName}.status"
+        commands = ""
+        for key, exeFile, _ in runs:
+            commands += (
+                f"{exeFile}\n"
+                f"printf '{{\"key\": \"%s\", \"exitCode\": %d, \"logFiles\": []}}\\n' {key} $? >> {statusFile}\n"
+            )
+        return makeScript(self.baseDir, f"{batchName}.sh", commands), statusFile
+
+    def runScheduler(self, runs, **kwargs):
+        """
+        Runs the tasks of all runs until they are completed and returns the DagScheduler
+        """
+        scheduler = DagScheduler(
+            MakeKeyTasks=lambda: iter([(tasks[0].key, tasks) for tasks in runs]),
+            logDir=f"{self.baseDir}/logs",
+            interruptCallbacks=[self.processInterrupted],
+            makeBatch=self.makeBatch,
+            **kwargs,
+        )
+        scheduler.addCallback(self.processCompleted)
+        scheduler.startProcesses()
+        scheduler.checkRunningProcesses()
+        return scheduler
+
+    def order(self):
+        with open(self.orderFile) as f:
+            return f.read().split()
+
+
+class TestDependencies(DagSchedulerTestCase):
+    def test_order(self):
+        runs = [self.makeRun(5.0, runNumber) for runNumber in range(500001, 500004)]
+        self.runScheduler(runs, parallel_sim=2)
+        order = self.order()
+        self.assertEqual(len(order), 9)
+        for runNumber in range(500001, 500004):
+            positions = [order.index(f"5.0_{runNumber}_{stage}") for stage in self.stages]
+            self.assertEqual(positions, sorted(positions))
+
+    def test_preparedOnceReady(self):
+        runs = [self.makeRun(5.0, 500001)]
+        self.runScheduler(runs, parallel_sim=1)
+        # The executable file of a stage is written only once the output of the previous one exists
+        self.assertEqual(self.prepared, [task.key for task in runs[0]])
+
+    def test_failedDependency(self):
+        runs = [self.makeRun(5.0, 500001, failing=["lv1"]), self.makeRun(5.0, 500002)]
+        self.runScheduler(runs, parallel_sim=2, maxRetries=0)
+        order = self.order()
+        # The dependents of a failed stage are never started, the other run is not affected
+        self.assertIn("5.0_500001_lv1", order)
+        self.assertNotIn("5.0_500001_lv2", order)
+        self.assertIn("5.0_500002_lv2", order)
+        self.assertIn(("5.0_500001_lv1", 1), self.completed)
+
+
+class TestBatches(DagSchedulerTestCase):
+    def test_split(self):
+        runs = [self.makeRun(5.0, runNumber) for runNumber in range(500001, 500006)]
+        runs.append(self.makeRun(5.1, 510001))
+        self.runScheduler(
+            runs, parallel_sim=1, batchSize=2, batchStages=["detector"]
+        )
+        # At most batchSize runs of the same energy bin per batch, the last run of 5.0 and the one of 5.1 run alone
+        self.assertEqual(
+            self.batches,
+            [
+                ["5.0_500001_detector", "5.0_500002_detector"],
+                ["5.0_500003_detector", "5.0_500004_detector"],
+            ],
+        )
+        # Every stage of every run is completed, also the ones started from a batch
+        self.assertEqual(len(self.order()), 3 * len(runs))
+        for tasks in runs:
+            positions = [self.order().index(task.key) for task in tasks]
+            self.assertEqual(positions, sorted(positions))
+
+    def test_failedInBatch(self):
+        runs = [
+            self.makeRun(5.0, 500001),
+            self.makeRun(5.0, 500002, failing=["detector"]),
+        ]
+        self.runScheduler(
+            runs, parallel_sim=1, batchSize=2, batchStages=["detector"], maxRetries=0
+        )
+        self.assertEqual(self.batches[0], ["5.0_500001_detector", "5.0_500002_detector"])
+        order = self.order()
+        # Only the run that failed in the batch is stopped
+        self.assertIn("5.0_500001_lv2", order)
+        self.assertNotIn("5.0_500002_lv1", order)
+        with open(f"{self.baseDir}/batch1.status") as f:
+            statuses = [json.loads(line) for line in f]
+        self.assertEqual([status["exitCode"] for status in statuses], [0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Tests of the exeFiles written by the DetectorSimulator for compressed (bz2) corsika inputs.
+The python script is replaced by a shell script that copies its input file to its output file,
+thus the exeFiles can be executed without IceTray.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import bz2
+import os
+import stat
+import subprocess
+import tempfile
+import unittest
+
+from utils.DetectorSimulator import DetectorSimulator
+
+# Copies the --inputfilelist to the --outputfile, like the icetopshowergenerator.py reads and writes them
+fakePython = """#!/bin/sh
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --inputfilelist) inputFile=$2 ;;
+        --outputfile) outputFile=$2 ;;
+    esac
+    shift
+done
+cat "$inputFile" > "$outputFile"
+"""
+
+
+class DetectorSimulatorTestCase(unittest.TestCase):
+    """
+    Writes the fake python script and a bz2 corsika input in a temporary directory
+    """
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.baseDir = self.tempDir.name
+        self.pythonPath = f"{self.baseDir}/python.sh"
+        with open(self.pythonPath, "w") as f:
+            f.write(fakePython)
+        os.chmod(self.pythonPath, os.stat(self.pythonPath).st_mode | stat.S_IEXEC)
+        self.inputFile = f"{self.baseDir}/DAT000007.bz2"
+        with bz2.open(self.inputFile, "wb") as f:
+            f.write(b"corsika showers")
+        self.decodedFile = f"{self.baseDir}/scratch/inputs/5.0/DAT000007"
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+
+class TestDecodeInputs(DetectorSimulatorTestCase):
+    def writeExeFile(self, inputDecoding):
+        detectorSim = DetectorSimulator(
+            pythonPath=self.pythonPath,
+            dataset=1,
+            MCdataset=2,
+            seed=3,
+            year=2012,
+            doLv3=False,
+            i3build=self.baseDir,
+            outDirectory=f"{self.baseDir}/out",
+            scratchDir=f"{self.baseDir}/scratch",
+            inputDecoding=inputDecoding,
+        )
+        exeFile, outputFile = detectorSim.run_ITShowerGenerator(
+            energy=5.0,
+            runname="000007",
+            inputFile=self.inputFile,
+            nproc=1,
+            procnum=1,
+            runID=7,
+        )
+        with open(exeFile) as f:
+            return exeFile, outputFile, f.read()
+
+    def test_fifo(self):
+        exeFile, outputFile, commands = self.writeExeFile("fifo")
+        self.assertIn(f"mkfifo {self.decodedFile}\n", commands)
+        self.assertIn(f"{self.inputFile} > {self.decodedFile} &\ndecoder=$!\n", commands)
+        self.assertIn(
+            f"trap 'kill $decoder 2> /dev/null || true; rm -f {self.decodedFile}' EXIT\n", commands
+        )
+        self.assertIn(f"--inputfilelist {self.decodedFile} ", commands)
+        # The decompression is checked before the output is moved
+        self.assertLess(commands.index("wait $decoder\n"), commands.index("mv "))
+
+        subprocess.run([exeFile], check=True)
+        with open(outputFile, "rb") as f:
+            self.assertEqual(f.read(), b"corsika showers")
+        self.assertFalse(os.path.exists(self.decodedFile))
+
+    def test_file(self):
+        exeFile, outputFile, commands = self.writeExeFile("file")
+        self.assertIn(f"trap 'rm -f {self.decodedFile}' EXIT\n", commands)
+        self.assertIn(f"{self.inputFile} > {self.decodedFile}\n", commands)
+        self.assertNotIn("mkfifo", commands)
+        self.assertIn(f"--inputfilelist {self.decodedFile} ", commands)
+
+        subprocess.run([exeFile], check=True)
+        with open(outputFile, "rb") as f:
+            self.assertEqual(f.read(), b"corsika showers")
+        self.assertFalse(os.path.exists(self.decodedFile))
+
+    def test_failedDecompression(self):
+        # A truncated input makes the exeFile fail, thus its output is not moved
+        with open(self.inputFile, "r+b") as f:
+            f.truncate(20)
+        exeFile, outputFile, _ = self.writeExeFile("fifo")
+        process = subprocess.run([exeFile], stderr=subprocess.DEVNULL)
+        self.assertNotEqual(process.returncode, 0)
+        self.assertFalse(os.path.exists(outputFile))
+        self.assertFalse(os.path.exists(self.decodedFile))
+
+
+class TestRemoveTempFiles(DetectorSimulatorTestCase):
+    def test_onlyDiscarded(self):
+        detectorSim = DetectorSimulator(
+            pythonPath=self.pythonPath,
+            dataset=1,
+            MCdataset=2,
+            seed=3,
+            year=2012,
+            doLv3=False,
+            i3build=self.baseDir,
+            outDirectory=f"{self.baseDir}/out",
+            scratchDir=f"{self.baseDir}/scratch",
+        )
+        tempFiles = {}
+        for runname in ["000007", "000008"]:
+            _, dataFile = detectorSim.run_ITShowerGenerator(
+                energy=5.0,
+                runname=runname,
+                inputFile=self.inputFile,
+                nproc=2,
+                procnum=int(runname) - 6,
+                runID=int(runname),
+            )
+            # The partial outputs of the scripts
+            tempFiles[dataFile] = detectorSim.tempFiles[dataFile]
+            with open(tempFiles[dataFile], "w") as f:
+                f.write("partial")
+        killed, completed = sorted(tempFiles.keys())
+        open(self.decodedFile, "w").close()
+
+        detectorSim.discardOutput(killed)
+        detectorSim.removeTempFiles()
+        self.assertFalse(os.path.exists(tempFiles[killed]))
+        self.assertFalse(os.path.exists(self.decodedFile))
+        # The temp files of the other scripts are not touched
+        self.assertTrue(os.path.exists(tempFiles[completed]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Tests of the JobJournal: the states recorded by one submission are the ones the next submission resumes from.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import os
+import tempfile
+import unittest
+
+from tests.test_DagScheduler import DagSchedulerTestCase
+from utils.JobJournal import JobJournal
+
+
+class TestStates(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.journalFile = f"{self.tempDir.name}/journal.db"
+        self.outputFile = f"{self.tempDir.name}/DAT500001"
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def reopen(self, journal):
+        """
+        Closes the journal and opens it again, as the next submission does
+        """
+        journal.close()
+        return JobJournal(self.journalFile)
+
+    def test_resume(self):
+        journal = JobJournal(self.journalFile)
+        for key in ["done", "failed", "running", "interrupted", "timedout"]:
+            journal.markPlanned(key, self.outputFile)
+            journal.markRunning(key)
+        open(self.outputFile, "w").close()
+        journal.markCompleted("done", 0)
+        journal.markCompleted("failed", 1)
+        journal.markInterrupted("interrupted")
+        journal.markTimedOut("timedout")
+
+        journal = self.reopen(journal)
+        self.assertTrue(journal.isDone("done"))
+        self.assertEqual(journal.outputFile("done"), self.outputFile)
+        # The others are started again, also the one still running when the submission was killed
+        for key, state in [
+            ("failed", "failed"),
+            ("running", "running"),
+            ("interrupted", "interrupted"),
+            ("timedout", "timedout"),
+        ]:
+            self.assertEqual(journal.state(key), state)
+            self.assertFalse(journal.isDone(key))
+        self.assertIsNone(journal.state("unknown"))
+        journal.close()
+
+    def test_missingOutput(self):
+        journal = JobJournal(self.journalFile)
+        journal.markPlanned("lost", self.outputFile)
+        journal.markRunning("lost")
+        # Succeeded but its output file does not exist
+        journal.markCompleted("lost", 0)
+        self.assertEqual(journal.state("lost"), "failed")
+
+        journal.markDone("moved", self.outputFile)
+        open(self.outputFile, "w").close()
+        journal = self.reopen(journal)
+        self.assertTrue(journal.isDone("moved"))
+        os.remove(self.outputFile)
+        # The output was removed after the journal was written
+        self.assertFalse(journal.isDone("moved"))
+        journal.close()
+
+    def test_stagingOut(self):
+        journal = JobJournal(self.journalFile)
+        journal.markPlanned("moving", self.outputFile)
+        journal.markRunning("moving")
+        # The output file is not in the data directory until it is moved
+        journal.markCompleted("moving", 0, stagingOut=True)
+        self.assertEqual(journal.state("moving"), "stagingout")
+        self.assertFalse(journal.isDone("moving"))
+
+        journal = self.reopen(journal)
+        self.assertFalse(journal.isDone("moving"))
+        open(self.outputFile, "w").close()
+        journal.markDone("moving", self.outputFile)
+        self.assertTrue(journal.isDone("moving"))
+        journal.close()
+
+
+class TestResumeScheduler(DagSchedulerTestCase):
+    def runScheduler(self, runs, **kwargs):
+        """
+        Runs the DagScheduler with a new connection to the journal, as a new submission
+        """
+        journal = JobJournal(f"{self.baseDir}/journal.db")
+        try:
+            return super().runScheduler(runs, journal=journal, **kwargs)
+        finally:
+            journal.close()
+
+    def test_skipsDone(self):
+        self.runScheduler([self.makeRun(5.0, 500001, failing=["lv1"])], maxRetries=0)
+        self.assertEqual(self.order(), ["5.0_500001_detector", "5.0_500001_lv1"])
+
+        self.prepared = []
+        self.runScheduler([self.makeRun(5.0, 500001)], maxRetries=0)
+        # The done stage is neither prepared nor started again, the failed one and its dependents are
+        self.assertEqual(self.prepared, ["5.0_500001_lv1", "5.0_500001_lv2"])
+        self.assertEqual(
+            self.order(),
+            ["5.0_500001_detector", "5.0_500001_lv1", "5.0_500001_lv1", "5.0_500001_lv2"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tests of the LongProfileExtractor on small .long files written in the format of Corsika.
+They need numpy, they are skipped without it.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import os
+import tempfile
+import unittest
+
+from tests.test_CorsikaReader import np
+
+if np is not None:
+    from utils.LongProfileExtractor import LongProfileExtractor
+
+
+def writeLongFile(fileName, nShowers=2, nSteps=5, truncateLast=False):
+    """
+    Writes the particle distribution, the energy deposit and the Gaisser-Hillas fit of every shower.
+    The particles of the step i of the shower s are s * species + i, the P3 (Xmax) of the fit is 600 + s.
+    If truncateLast is True, the particle distribution of the last shower ends after two steps.
+    """
+    with open(fileName, "w") as f:
+        for shower in range(1, nShowers + 1):
+            f.write(
+                f" LONGITUDINAL DISTRIBUTION IN   {nSteps} VERTICAL STEPS OF  10. G/CM**2 FOR SHOWER      {shower}\n"
+                " DEPTH     GAMMAS   POSITRONS   ELECTRONS         MU+         MU-"
+                "     HADRONS     CHARGED      NUCLEI   CHERENKOV\n"
+            )
+            steps = nSteps
+            if truncateLast and shower == nShowers:
+                steps = 2
+            for step in range(steps):
+                values = np.arange(9) * shower + step
+                f.write(f"{10.0 * step + 5:7.1f}" + "".join(f" {value:11.5E}" for value in values) + "\n")
+            if steps < nSteps:
+                return
+            f.write(
+                f" LONGITUDINAL ENERGY DEPOSIT IN   {nSteps} VERTICAL STEPS OF  10. G/CM**2 FOR SHOWER      {shower}\n"
+                " DEPTH       GAMMA    EM IONIZ     EM CUT    MU IONIZ      MU CUT"
+                "  HADR IONIZ    HADR CUT   NEUTRINO         SUM\n"
+            )
+            for step in range(nSteps):
+                f.write(f"{10.0 * step + 5:7.1f}" + " 0.00000E+00" * 9 + "\n")
+            f.write(
+                " FIT OF THE HILLAS CURVE   N(T) = P1 * ((T-P2)/(P3-P2))**((P3-P2)/(P4+P5*T+P6*T**2))"
+                " * EXP((P3-T)/(P4+P5*T+P6*T**2))\n"
+                " TO LONGITUDINAL DISTRIBUTION OF     ALL CHARGED  PARTICLES\n"
+                f" PARAMETERS         =   1.2345E+05 -5.0000E+01  {600 + shower:.4E}  6.0000E+01 -1.0000E-02  1.0000E-05\n"
+                " CHI**2/DOF         =   1.2300E+00\n"
+                " AV. DEVIATION IN % =   4.5000E+00\n\n"
+            )
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestLongProfileExtractor(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.longDir = self.tempDir.name
+        self.outputFile = f"{self.tempDir.name}/5.0.npy"
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def test_extractDirectory(self):
+        writeLongFile(f"{self.longDir}/DAT500001.long", nShowers=2)
+        writeLongFile(f"{self.longDir}/DAT500002.long", nShowers=1, nSteps=3)
+        # Not a profile of this bin
+        writeLongFile(f"{self.longDir}/other.long", nShowers=1)
+
+        nShowers = LongProfileExtractor().extractDirectory(self.longDir, self.outputFile)
+        self.assertEqual(nShowers, 3)
+        self.assertFalse(os.path.exists(f"{self.outputFile}.part.npy"))
+        profiles = LongProfileExtractor.load(self.outputFile)
+        self.assertEqual(list(profiles["runNumber"]), [500001, 500001, 500002])
+        self.assertEqual(list(profiles["showerNumber"]), [1, 2, 1])
+        self.assertEqual(list(profiles["nSteps"]), [5, 5, 3])
+        np.testing.assert_allclose(profiles["depth"][0], [5, 15, 25, 35, 45])
+        # The particle distribution, not the energy deposit written after it
+        np.testing.assert_allclose(profiles["particles"][1, 4], np.arange(9) * 2 + 4)
+        # The missing steps of the shorter profile are zeros
+        np.testing.assert_allclose(profiles["particles"][2, 3:], 0)
+        np.testing.assert_allclose(profiles["ghParameters"][:, 2], [601, 602, 601])
+        np.testing.assert_allclose(profiles["chi2"], 1.23)
+
+    def test_maxSteps(self):
+        writeLongFile(f"{self.longDir}/DAT500001.long", nShowers=1)
+        LongProfileExtractor(maxSteps=2).extractBin(
+            [f"{self.longDir}/DAT500001.long"], self.outputFile
+        )
+        profiles = LongProfileExtractor.load(self.outputFile)
+        self.assertEqual(profiles["depth"].shape, (1, 2))
+        self.assertEqual(list(profiles["nSteps"]), [2])
+
+    def test_truncated(self):
+        writeLongFile(f"{self.longDir}/DAT500001.long", nShowers=3, truncateLast=True)
+        extractor = LongProfileExtractor()
+        self.assertEqual(len(list(extractor.parseFile(f"{self.longDir}/DAT500001.long"))), 2)
+        extractor.extractBin([f"{self.longDir}/DAT500001.long"], self.outputFile)
+        # The row of the truncated profile is left empty
+        profiles = LongProfileExtractor.load(self.outputFile)
+        self.assertEqual(list(profiles["nSteps"]), [5, 5, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
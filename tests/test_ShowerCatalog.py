@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Tests of the ShowerCatalog on small synthetic Corsika files (see test_CorsikaReader.writeCorsikaFile).
+They need numpy, they are skipped without it.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import os
+import pathlib
+import tempfile
+import unittest
+
+from tests.test_CorsikaReader import np, writeCorsikaFile
+
+if np is not None:
+    from utils.ShowerCatalog import ShowerCatalog
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestShowerCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.dataDir = f"{self.tempDir.name}/data"
+        self.catalogFile = f"{self.tempDir.name}/catalog.db"
+        # Proton showers at 20 degrees in 5.0, iron showers at 40 degrees in 5.1
+        self.writeFile(5.0, 500001, primary=14, zenith=np.radians(20))
+        self.writeFile(5.0, 500002, primary=14, zenith=np.radians(20))
+        self.writeFile(5.1, 510001, primary=5626, zenith=np.radians(40))
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def writeFile(self, energyBin, runNumber, **kwargs):
+        energyDir = f"{self.dataDir}/{energyBin}"
+        pathlib.Path(energyDir).mkdir(parents=True, exist_ok=True)
+        return writeCorsikaFile(
+            f"{energyDir}/DAT{runNumber}", runNumber=runNumber, particleBlocks=2, **kwargs
+        )
+
+    def test_select(self):
+        catalog = ShowerCatalog(self.catalogFile)
+        catalog.scanDirectory(self.dataDir, [5.0, 5.1])
+        self.assertEqual(
+            catalog.select(), {"DAT500001", "DAT500002", "DAT510001"}
+        )
+        self.assertEqual(catalog.select(energyMin=5.1), {"DAT510001"})
+        self.assertEqual(catalog.select(energyMax=5.0), {"DAT500001", "DAT500002"})
+        self.assertEqual(catalog.select(zenithMin=30), {"DAT510001"})
+        self.assertEqual(catalog.select(zenithMax=30, primary=14), {"DAT500001", "DAT500002"})
+        self.assertEqual(catalog.select(energyMin=5.1, primary=14), set())
+        catalog.close()
+
+    def test_submitFile(self):
+        catalog = ShowerCatalog(self.catalogFile)
+        catalog.submitFile(f"{self.dataDir}/5.1/DAT510001", 5.1)
+        # The showers are written by the main thread once the file is read
+        catalog.close()
+        catalog = ShowerCatalog(self.catalogFile)
+        self.assertEqual(catalog.select(primary=5626), {"DAT510001"})
+        catalog.close()
+
+    def test_files(self):
+        # A truncated Corsika file and a compressed file are listed, but they have no showers
+        truncated = self.writeFile(5.0, 500003)
+        os.truncate(truncated, os.path.getsize(truncated) - 100)
+        open(f"{self.dataDir}/5.0/DAT500004.bz2", "w").close()
+        catalog = ShowerCatalog(self.catalogFile)
+        catalog.scanDirectory(self.dataDir, [5.0, 5.1])
+        self.assertEqual(catalog.select(energyMax=5.0), {"DAT500001", "DAT500002"})
+        # The same names as by listing the directory, thus the runs are numbered the same way
+        self.assertEqual(catalog.fileNames(5.0), sorted(os.listdir(f"{self.dataDir}/5.0")))
+        self.assertEqual(catalog.fileNames(5.1), ["DAT510001"])
+        catalog.close()
+
+    def test_replaced(self):
+        catalog = ShowerCatalog(self.catalogFile)
+        fileName = f"{self.dataDir}/5.0/DAT500001"
+        self.assertEqual(catalog.addFile(fileName, 5.0), 2)
+        # The file is simulated again with other showers
+        self.writeFile(5.0, 500001, nShowers=3, primary=402)
+        self.assertEqual(catalog.addFile(fileName, 5.0), 3)
+        self.assertEqual(catalog.select(primary=14), set())
+        self.assertEqual(catalog.select(primary=402), {"DAT500001"})
+        catalog.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
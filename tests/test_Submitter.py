@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Tests of the Submitter with short real processes (true, false, sleep and small sh scripts).
+They only need the standard library, thus they also run with the python of the icetray environment (3.7):
+    python3.7 -m unittest discover -s tests -t .
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import json
+import os
+import signal
+import stat
+import tempfile
+import time
+import unittest
+
+from utils.FailureClassifier import FailureClassifier
+from utils.JobTimeouts import JobTimeouts
+from utils.Submitter import Submitter
+
+
+def makeScript(directory, name, commands):
+    """
+    Writes an executable sh script, the processStrings are split on spaces thus they can not hold shell code
+    """
+    scriptFile = f"{directory}/{name}"
+    with open(scriptFile, "w") as f:
+        f.write("#!/bin/sh\n" + commands)
+    os.chmod(scriptFile, os.stat(scriptFile).st_mode | stat.S_IEXEC)
+    return scriptFile
+
+
+class SubmitterTestCase(unittest.TestCase):
+    """
+    Runs the Submitter in a temporary log directory and restores the signal handlers it installs
+    """
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.baseDir = self.tempDir.name
+        self.completed = []
+        self.interrupted = []
+
+    def tearDown(self):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.set_wakeup_fd(-1)
+        self.tempDir.cleanup()
+
+    def processCompleted(self, key, returncode):
+        self.completed.append((key, returncode))
+
+    def processInterrupted(self, key):
+        self.interrupted.append(key)
+
+    def deadLetters(self):
+        """
+        Returns the (key, failureClass) of the processes given up
+        """
+        deadLetterFile = f"{self.baseDir}/logs/dead_letters.jsonl"
+        if not os.path.isfile(deadLetterFile):
+            return []
+        with open(deadLetterFile) as f:
+            return [(entry["key"], entry["failureClass"]) for entry in map(json.loads, f)]
+
+    def runSubmitter(self, processes, **kwargs):
+        """
+        Runs all (key, processString) until they are completed and returns the Submitter
+        """
+        submitter = Submitter(
+            MakeKeySubString=lambda: iter(processes),
+            logDir=f"{self.baseDir}/logs",
+            callbacks=[self.processCompleted],
+            interruptCallbacks=[self.processInterrupted],
+            **kwargs,
+        )
+        submitter.startProcesses()
+        submitter.checkRunningProcesses()
+        return submitter
+
+
+class TestReapProcess(SubmitterTestCase):
+    def test_returncodes(self):
+        killed = makeScript(self.baseDir, "killed.sh", "kill -9 $$\n")
+        exitCode = makeScript(self.baseDir, "exit3.sh", "exit 3\n")
+        submitter = self.runSubmitter(
+            [("true", "true"), ("false", "false"), ("exit3", exitCode), ("killed", killed)],
+            parallel_sim=4,
+        )
+        # Same returncodes as Popen, a process killed by a signal gets minus the signal number
+        self.assertEqual(
+            sorted(self.completed),
+            [("exit3", 3), ("false", 1), ("killed", -signal.SIGKILL), ("true", 0)],
+        )
+        self.assertEqual(submitter.processDict, {})
+
+    def test_usage(self):
+        submitter = Submitter(
+            MakeKeySubString=lambda: iter([("sleep", "sleep 0.2")]),
+            logDir=f"{self.baseDir}/logs",
+        )
+        submitter.startSingleProcess()
+        while not submitter.reapProcess("sleep"):
+            submitter.waitForCompletion(timeout=1)
+        self.assertEqual(submitter.processDict["sleep"].returncode, 0)
+        # The resource usage comes from wait4
+        usage = submitter.usageDict["sleep"]
+        self.assertGreaterEqual(usage["wallTime"], 0.2)
+        self.assertGreater(usage["maxRss"], 0)
+        # Popen does not wait for the reaped process again
+        self.assertEqual(submitter.processDict["sleep"].wait(), 0)
+        submitter.deleteSingleProcess("sleep")
+
+
+
+class TestEventMode(SubmitterTestCase):
+    def test_completionOrder(self):
+        start = time.monotonic()
+        self.runSubmitter(
+            [("slow", "sleep 0.6"), ("fast", "sleep 0.1"), ("next", "sleep 0.1")],
+            parallel_sim=2,
+            waitMode="event",
+        )
+        # The slot of the fast process is refilled as soon as it exits, not after the slow one
+        self.assertEqual(self.completed, [("fast", 0), ("next", 0), ("slow", 0)])
+        self.assertLess(time.monotonic() - start, 1.5)
+
+    def test_parallelLimit(self):
+        start = time.monotonic()
+        self.runSubmitter(
+            [(f"sleep{index}", "sleep 0.3") for index in range(4)],
+            parallel_sim=2,
+            waitMode="event",
+        )
+        self.assertEqual(len(self.completed), 4)
+        # Two rounds of two processes
+        self.assertGreaterEqual(time.monotonic() - start, 0.6)
+
+
+class TestTimeouts(SubmitterTestCase):
+    def test_killed(self):
+        start = time.monotonic()
+        submitter = self.runSubmitter(
+            [("hung", "sleep 30"), ("quick", "true")],
+            parallel_sim=2,
+            jobTimeouts=JobTimeouts(default=0.3),
+            maxRetries=0,
+        )
+        self.assertLess(time.monotonic() - start, 10)
+        # The timed out process is not completed, it is interrupted and given up
+        self.assertEqual(self.completed, [("quick", 0)])
+        self.assertEqual(self.interrupted, ["hung"])
+        self.assertEqual(self.deadLetters(), [("hung", "timeout")])
+        self.assertEqual(submitter.processDict, {})
+
+    def test_retried(self):
+        self.runSubmitter(
+            [("hung", "sleep 30")],
+            jobTimeouts=JobTimeouts(default=0.2),
+            maxRetries=1,
+        )
+        # Started twice, then given up
+        self.assertEqual(self.interrupted, ["hung", "hung"])
+        self.assertEqual(self.deadLetters(), [("hung", "timeout")])
+
+
+class TestRetries(SubmitterTestCase):
+    def failingScript(self, name, message, failures):
+        """
+        Writes a script that prints the message and fails the first failures times, then succeeds
+        """
+        return makeScript(
+            self.baseDir,
+            name,
+            f"echo x >> {self.baseDir}/{name}.attempts\n"
+            f"if [ $(wc -l < {self.baseDir}/{name}.attempts) -le {failures} ]; then\n"
+            f"    echo '{message}' >&2\n"
+            "    exit 1\n"
+            "fi\n",
+        )
+
+    def attempts(self, name):
+        with open(f"{self.baseDir}/{name}.attempts") as f:
+            return len(f.readlines())
+
+    def test_transient(self):
+        flaky = self.failingScript("flaky.sh", "Stale file handle", 1)
+        start = time.monotonic()
+        self.runSubmitter(
+            [("flaky", flaky)],
+            failureClassifier=FailureClassifier(retryClasses=["filesystem"]),
+            maxRetries=1,
+            retryBackoff=0.3,
+        )
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        self.assertEqual(self.completed, [("flaky", 1), ("flaky", 0)])
+        self.assertEqual(self.attempts("flaky.sh"), 2)
+        self.assertEqual(self.deadLetters(), [])
+
+    def test_backoff(self):
+        broken = self.failingScript("broken.sh", "Input/output error", 10)
+        start = time.monotonic()
+        self.runSubmitter(
+            [("broken", broken)],
+            failureClassifier=FailureClassifier(retryClasses=["filesystem"]),
+            maxRetries=2,
+            retryBackoff=0.2,
+        )
+        # The delay is doubled at every attempt: 0.2 + 0.4 s
+        self.assertGreaterEqual(time.monotonic() - start, 0.6)
+        self.assertEqual(self.attempts("broken.sh"), 3)
+        self.assertEqual(self.deadLetters(), [("broken", "filesystem")])
+        # The given up process is interrupted, thus its partial outputs are removed
+        self.assertEqual(self.interrupted, ["broken"])
+
+    def test_notTransient(self):
+        crash = self.failingScript("crash.sh", "Segmentation fault", 10)
+        self.runSubmitter(
+            [("crash", crash)],
+            failureClassifier=FailureClassifier(retryClasses=["filesystem"]),
+            maxRetries=2,
+            retryBackoff=0.1,
+        )
+        self.assertEqual(self.completed, [("crash", 1)])
+        self.assertEqual(self.attempts("crash.sh"), 1)
+        self.assertEqual(self.deadLetters(), [("crash", "crash")])
+
+
+if __name__ == "__main__":
+    unittest.main()
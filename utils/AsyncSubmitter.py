@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+
+"""
+This class can be used instead of the Submitter class to spawn subprocesses
+for multiple instances instead of multiple job submissions.
+All processes, their log files and timeouts are handled by a single asyncio event loop,
+thus there is no polling and no additional thread or process per running job.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import asyncio
+import collections
+import os
+import pathlib
+import signal
+import sys
+
+from utils.FailureClassifier import FailureClassifier
+from utils.ProcessSpec import ProcessSpec
+
+
+class AsyncSubmitter:
+    """
+    Classed used for calling multiple scripts in a single submission (eg. on the Horeka cluster)
+    with an asyncio event loop. It takes the same generator as the Submitter class
+    and stops, times out and retries the processes in the same way.
+    """
+
+    def __init__(
+        self,
+        MakeKeySubString,
+        logDir,
+        parallel_sim=50,
+        logMode="file",
+        timeout=None,
+        callbacks=[],
+        journal=None,
+        stageOut=None,
+        walltimeGuard=None,
+        interruptCallbacks=[],
+        jobTimeouts=None,
+        maxRetries=0,
+        failureClassifier=None,
+        retryBackoff=60,
+        deadLetterFile=None,
+    ):
+        """
+        Parameters:
+        key_processString_generator: is a function that yields the key and process string needed for the simulation
+        logDir: Directory where log files are stored
+        parallelRunningSims: number of parallel processes that wants to be executed
+        logMode: "file" the process writes its stdout and stderr directly into the log files,
+                 "pipe" the output is streamed into the log files by the event loop
+        timeout: maximum time in seconds a single process can run before it is killed
+                 (default None, no limit), only used without jobTimeouts
+        callbacks: list of functions called as callback(key, returncode) when a process is completed
+        journal: the JobJournal where the processes are marked as running and completed (default None)
+        stageOut: the StageOut whose completed moves are collected as soon as they are completed (default None)
+        walltimeGuard: the WalltimeGuard which decides if a new process can still be completed
+                       before the end of the allocation (default None, no limit)
+        interruptCallbacks: list of functions called as callback(key) when a process is stopped
+                            (by SIGTERM or by its timeout) or given up
+        jobTimeouts: the JobTimeouts which gives the timeout of every process (default None, the timeout above)
+        maxRetries: how many times a timed out or transiently failed process is started again (default 0)
+        failureClassifier: the FailureClassifier which decides if a failed process is started again (default None)
+        retryBackoff: seconds before the first retry of a failed process, doubled at every attempt (default 60)
+        deadLetterFile: the file where the processes given up are listed (default {logDir}/dead_letters.jsonl)
+        returnCodes: Dictionary where the return code of all completed processes are stored
+        """
+        self.key_processString_generator = MakeKeySubString()
+        self.logDir = logDir
+        self.parallelRunningSims = parallel_sim
+        self.logMode = logMode
+        self.timeout = timeout
+        self.callbacks = list(callbacks)
+        self.journal = journal
+        self.stageOut = stageOut
+        self.walltimeGuard = walltimeGuard
+        self.interruptCallbacks = list(interruptCallbacks)
+        self.jobTimeouts = jobTimeouts
+        self.maxRetries = maxRetries
+        self.failureClassifier = failureClassifier
+        self.retryBackoff = retryBackoff
+        self.deadLetterFile = deadLetterFile or f"{logDir}/dead_letters.jsonl"
+        self.returnCodes = {}
+        # The running processes, their process group is stopped after SIGTERM
+        self.processDict = {}
+        # The keys of the processes stopped after SIGTERM
+        self.interruptedKeys = set()
+        # The keys of the processes waiting to be started again
+        self.retryingKeys = set()
+        # How many times every process was started
+        self.attempts = collections.Counter()
+        # Set by SIGTERM or SIGINT, no new process is started from then on
+        self.terminating = False
+        # Seconds between SIGTERM and SIGKILL of a process group
+        self.killTimeout = 10
+        # Creates the log directory if it does not exist yet
+        pathlib.Path(f"{self.logDir}").mkdir(parents=True, exist_ok=True)
+
+    def run(self):
+        """
+        It is the only function to be called.
+        It runs the event loop until all processes yielded by the generator are completed.
+        """
+        print("Start Process")
+        asyncio.run(self.runProcesses())
+        return
+
+    async def runProcesses(self):
+        """
+        Takes a new key and processString from the generator as soon as one of the
+        parallelRunningSims slots of the semaphore is free and starts it as a task.
+        Waits until all tasks are completed.
+        SIGTERM (e.g. sbatch --signal=B:TERM@300) and SIGINT stop the running processes (see signalReceived).
+        """
+        loop = asyncio.get_running_loop()
+        if sys.version_info < (3, 12) and hasattr(asyncio, "PidfdChildWatcher"):
+            # The default child watcher before python 3.12 starts one thread per process
+            watcher = asyncio.PidfdChildWatcher()
+            watcher.attach_loop(loop)
+            asyncio.get_event_loop_policy().set_child_watcher(watcher)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.signalReceived)
+        if self.stageOut is not None:
+            # The callbacks of the moves (e.g. the catalog) are executed as soon as the moves are completed
+            loop.add_reader(self.stageOut.fileno(), self.stageOut.collect)
+        # Wakes up the processes waiting for a retry once the termination is requested
+        self.wakeup = asyncio.Event()
+
+        semaphore = asyncio.Semaphore(self.parallelRunningSims)
+        runningTasks = set()
+        try:
+            while True:
+                await semaphore.acquire()
+                key, processString = self.nextAdmitted()
+                if (key is None) or (processString is None):
+                    semaphore.release()
+                    break
+                task = asyncio.create_task(self.runJob(key, processString, semaphore))
+                runningTasks.add(task)
+                task.add_done_callback(runningTasks.discard)
+
+            if runningTasks:
+                await asyncio.gather(*runningTasks)
+        finally:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(signum)
+            if self.stageOut is not None:
+                loop.remove_reader(self.stageOut.fileno())
+        return
+
+    def signalReceived(self):
+        """
+        Handler of SIGTERM and SIGINT. No new process is started from now on.
+        The process group of every running process gets SIGTERM, those still running after killTimeout seconds get SIGKILL.
+        The killed ones are recorded as interrupted in the journal (thus they are started again by the next submission).
+        """
+        if self.terminating:
+            return
+        print("Termination requested: the running processes are stopped")
+        self.terminating = True
+        self.wakeup.set()
+        for key in list(self.processDict.keys()):
+            self.interruptedKeys.add(key)
+            self.signalProcess(key, signal.SIGTERM)
+        asyncio.get_running_loop().call_later(self.killTimeout, self.killInterrupted)
+
+    def killInterrupted(self):
+        """
+        Sends SIGKILL to the process groups still running killTimeout seconds after SIGTERM
+        """
+        for key in list(self.processDict.keys()):
+            if key in self.interruptedKeys:
+                self.signalProcess(key, signal.SIGKILL)
+
+    def signalProcess(self, key, signum):
+        """
+        Sends the signal to the process group of the process (the process and all its children)
+
+        Parameters:
+        key: the key of the process
+        signum: the signal
+        """
+        try:
+            os.killpg(self.processDict[key].pid, signum)
+        except (ProcessLookupError, PermissionError):
+            # The process group does not exist anymore
+            pass
+
+    def isDraining(self):
+        """
+        Checks if no new process can be started,
+        because of SIGTERM or because the allocation is about to end
+        """
+        if self.terminating:
+            return True
+        return (self.walltimeGuard is not None) and self.walltimeGuard.expired()
+
+    def nextAdmitted(self):
+        """
+        Returns the next key and processString of the generator which can be completed before the end of the allocation.
+        The others are skipped, they stay planned in the journal and are started again by the next submission.
+        Returns (None, None) if there are no more or the allocation is about to end.
+        """
+        while not self.isDraining():
+            key, processString = next(self.key_processString_generator, (None, None))
+            if (key is None) or self.admits(key):
+                return key, processString
+        return None, None
+
+    def admits(self, key):
+        """
+        Checks if the process can be completed before the end of the allocation
+        """
+        if (self.walltimeGuard is None) or self.walltimeGuard.admits(key):
+            return True
+        print(f"Not enough time left in the allocation for {key}, it is skipped")
+        return False
+
+    def isRetrying(self, key):
+        """
+        Checks if the process waits to be started again
+        """
+        return key in self.retryingKeys
+
+    async def runJob(self, key, processString, semaphore):
+        """
+        Runs the process in a slot of the semaphore until it is completed, given up or interrupted.
+        A timed out or transiently failed process is started again after its delay,
+        its slot is given to the next process of the generator in the meantime.
+
+        Parameters:
+        key: the unique key of the process
+        processString: the string that is executed
+        semaphore: the semaphore of the running processes, one of its slots is held by the caller
+        """
+        try:
+            while True:
+                delay = await self.runSingleProcess(key, processString)
+                if delay is None:
+                    return
+                semaphore.release()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                await semaphore.acquire()
+                self.retryingKeys.discard(key)
+                if self.isDraining() or (not self.admits(key)):
+                    # It stays timed out or failed in the journal, thus the next submission starts it again
+                    print(f"The process {key} is not started again")
+                    return
+        finally:
+            semaphore.release()
+
+    async def runSingleProcess(self, key, processString):
+        """
+        Runs a single process and writes its output and errors to the chosen directory.
+        If the process runs longer than its timeout it is stopped together with its children.
+
+        Parameters:
+        key: the unique key of the process
+        processString: the string that is executed
+
+        Returns:
+        delay: the seconds after which the process is started again, None if it is completed, given up or interrupted
+        """
+        print("\n==================== New Process ====================")
+        if self.journal is not None:
+            self.journal.markRunning(key)
+        self.attempts[key] += 1
+        timeout = self.timeout
+        if self.jobTimeouts is not None:
+            timeout = self.jobTimeouts.timeout(key)
+        spec = processString if isinstance(processString, ProcessSpec) else None
+        stdoutFile = f"{self.logDir}/output_{key}.out"
+        if (spec is not None) and spec.stdoutFile:
+            stdoutFile = spec.stdoutFile
+        with open(stdoutFile, "wb") as out, open(
+            f"{self.logDir}/output_{key}.err", "wb"
+        ) as err:
+            if spec is not None:
+                # The ProcessSpec is started directly with its stdin data
+                process = await asyncio.create_subprocess_exec(
+                    *spec.split(),
+                    cwd=spec.cwd,
+                    stdin=(
+                        asyncio.subprocess.PIPE if spec.stdinData is not None else None
+                    ),
+                    stdout=out,
+                    stderr=err,
+                    start_new_session=True,
+                )
+                out.close()
+                err.close()
+                waiter = self.writeStdin(process, spec.stdinData)
+            elif self.logMode == "pipe":
+                process = await asyncio.create_subprocess_exec(
+                    *processString.split(),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True,
+                )
+                waiter = asyncio.gather(
+                    self.streamLog(process.stdout, out),
+                    self.streamLog(process.stderr, err),
+                    process.wait(),
+                )
+            else:
+                # The log files are only kept open by the process itself
+                process = await asyncio.create_subprocess_exec(
+                    *processString.split(),
+                    stdout=out,
+                    stderr=err,
+                    start_new_session=True,
+                )
+                out.close()
+                err.close()
+                waiter = process.wait()
+            self.processDict[key] = process
+
+            timedOut = False
+            waiter = asyncio.ensure_future(waiter)
+            try:
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter), timeout)
+                except asyncio.TimeoutError:
+                    timedOut = True
+                    print(f"The process {key} exceeded the timeout of {timeout} s")
+                    # The process runs in its own session, thus its whole process group is stopped
+                    self.signalProcess(key, signal.SIGTERM)
+                    try:
+                        await asyncio.wait_for(asyncio.shield(waiter), self.killTimeout)
+                    except asyncio.TimeoutError:
+                        self.signalProcess(key, signal.SIGKILL)
+                        await waiter
+            finally:
+                if process.returncode is None:
+                    # The event loop is stopped (e.g. by an exception), the process group is not left behind
+                    self.signalProcess(key, signal.SIGKILL)
+                self.processDict.pop(key, None)
+
+        if (key in self.interruptedKeys) and (process.returncode != 0):
+            print(f"Interrupted {key}")
+            self.attempts.pop(key, None)
+            if self.journal is not None:
+                self.journal.markInterrupted(key)
+            for callback in self.interruptCallbacks:
+                callback(key)
+            return None
+        if timedOut:
+            return self.timedOutProcess(key)
+
+        if (spec is not None) and (spec.finalize is not None):
+            spec.finalize(process.returncode)
+        self.returnCodes[key] = process.returncode
+        delay = None
+        failureClass = None
+        if (process.returncode != 0) and (self.failureClassifier is not None):
+            failureClass, delay = self.processFailed(
+                key, process.returncode, self.logFiles(key, spec)
+            )
+        else:
+            self.attempts.pop(key, None)
+        if self.journal is not None:
+            self.journal.markCompleted(key, process.returncode, None, failureClass)
+        for callback in self.callbacks:
+            callback(key, process.returncode)
+        return delay
+
+    def timedOutProcess(self, key):
+        """
+        Records the process stopped by its timeout in the journal and calls the interruptCallbacks.
+        It is started again if it has not used all its retries,
+        otherwise it is given up and written to the dead-letter list.
+        Its finalize function (ProcessSpec) and the callbacks are not called.
+
+        Returns:
+        delay: 0 if the process is started again, None if it is given up
+        """
+        if self.journal is not None:
+            self.journal.markTimedOut(key)
+        for callback in self.interruptCallbacks:
+            callback(key)
+        if self.attempts[key] <= self.maxRetries:
+            print(f"The process {key} is started again (attempt {self.attempts[key] + 1})")
+            self.retryingKeys.add(key)
+            return 0
+        print(f"The process {key} timed out {self.attempts[key]} times, it is given up")
+        self.attempts.pop(key, None)
+        FailureClassifier.addDeadLetter(
+            self.deadLetterFile, key, None, "timeout", "exceeded its timeout"
+        )
+        return None
+
+    def processFailed(self, key, returncode, logFiles):
+        """
+        Classifies the failure of the process from its exit code and the tail of its log files.
+        A transient failure is started again after retryBackoff * 2**(attempt - 1) seconds,
+        as long as the process has not used all its retries.
+        Otherwise the process is given up and written to the dead-letter list.
+
+        Returns:
+        failureClass: the class of the failure
+        delay: the seconds after which the process is started again, None if it is given up
+        """
+        failureClass = self.failureClassifier.classify(returncode, logFiles)
+        print(f"The process {key} failed with exit code {returncode} ({failureClass})")
+        if self.failureClassifier.isTransient(failureClass) and (
+            self.attempts[key] <= self.maxRetries
+        ):
+            delay = self.retryBackoff * 2 ** (self.attempts[key] - 1)
+            print(f"The process {key} is started again in {delay:.0f} s (attempt {self.attempts[key] + 1})")
+            self.retryingKeys.add(key)
+            return failureClass, delay
+        self.attempts.pop(key, None)
+        FailureClassifier.addDeadLetter(
+            self.deadLetterFile,
+            key,
+            returncode,
+            failureClass,
+            FailureClassifier.lastLine(logFiles),
+        )
+        for callback in self.interruptCallbacks:
+            callback(key)
+        return failureClass, None
+
+    def logFiles(self, key, spec=None):
+        """
+        Returns the log files of the process, its .err file first
+        """
+        stdoutFile = f"{self.logDir}/output_{key}.out"
+        if (spec is not None) and spec.stdoutFile:
+            stdoutFile = spec.stdoutFile
+        return [f"{self.logDir}/output_{key}.err", stdoutFile]
+
+    async def writeStdin(self, process, stdinData):
+        """
+        Writes the data to the stdin of the process, closes it and waits for the process.
+
+        Parameters:
+        process: the asyncio process
+        stdinData: the bytes to be written (None if the process has no stdin pipe)
+        """
+        if stdinData is not None:
+            try:
+                process.stdin.write(stdinData)
+                await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # The process exited before reading its input
+                pass
+            process.stdin.close()
+        return await process.wait()
+
+    async def streamLog(self, stream, logFile, chunkSize=65536):
+        """
+        Copies the output of a process chunk by chunk into the log file,
+        thus only a single chunk per stream is kept in memory.
+
+        Parameters:
+        stream: the asyncio stream of the process (stdout or stderr)
+        logFile: the open log file
+        chunkSize: the maximum size of a chunk in bytes
+        """
+        while True:
+            chunk = await stream.read(chunkSize)
+            if not chunk:
+                break
+            logFile.write(chunk)
+        return
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+This script runs the python scripts of several runs of the same stage (e.g. detector.py, SimulationFiltering.py)
+one after the other in a single python process.
+The framework (icetray) is imported only once, instead of once per run,
+which dominates the runtime of short stages like level1 and level2.
+
+It is executed by the batch file written by DetectorSimulator.writeBatchFile with the python of icetray:
+    python BatchRunner.py manifest.json manifest.status
+
+The manifest is a json list with an entry for every run:
+    key: the key of the run (e.g. 5.0_500001_lv1)
+    script: the python script
+    arguments: its arguments
+    logsFile: the stdout and stderr of the script are written to {logsFile}.out and {logsFile}.err
+    tempFile: the output file written by the script
+    dataFile: where the tempFile is moved once the script is completed (None if it is moved by someone else)
+
+Once a run is over, a json line with its key, exit code and accounting is appended to the status file.
+A failing run does not stop the following ones. The exit code is 0 only if all runs succeeded.
+It MUST NOT import anything from this repository, since it runs with the python of icetray.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import json
+import os
+import resource
+import runpy
+import shutil
+import sys
+import time
+import traceback
+
+
+class BatchRunner:
+    """
+    Runs the scripts of the manifest in this process.
+
+    Parameters:
+        manifestFile: the json file with the runs
+        statusFile: the file where the status of every completed run is appended
+    """
+
+    def __init__(self, manifestFile, statusFile):
+        with open(manifestFile) as f:
+            self.entries = json.load(f)
+        self.statusFile = statusFile
+
+    @staticmethod
+    def readStatus(statusFile):
+        """
+        Returns a dictionary with the key of every completed run and its status
+        (exitCode, wallTime, cpuTime, maxRss, logFiles). The runs that did not complete are missing.
+        """
+        statuses = {}
+        try:
+            with open(statusFile) as f:
+                for line in f:
+                    if line.strip():
+                        status = json.loads(line)
+                        statuses[status["key"]] = status
+        except FileNotFoundError:
+            pass
+        return statuses
+
+    def runAll(self):
+        """
+        Runs all entries of the manifest and returns the exit code of the batch
+        """
+        exitCode = 0
+        for entry in self.entries:
+            if self.runEntry(entry) != 0:
+                exitCode = 1
+        return exitCode
+
+    def runEntry(self, entry):
+        """
+        Runs the script of a single entry with its stdout and stderr redirected to its log files.
+        If the script succeeded, its temp file is moved to the data file.
+        The cpuTime is the one of this process and of its children during the script,
+        the maxRss is the peak of this process so far, thus an upper limit.
+
+        Returns:
+            exitCode: the exit code of the script (1 if it raised an exception)
+        """
+        startTime = time.monotonic()
+        startCpu = self.cpuTime()
+        exitCode = self.runScript(entry)
+        if (exitCode == 0) and entry["dataFile"]:
+            try:
+                shutil.move(entry["tempFile"], entry["dataFile"])
+            except OSError as error:
+                with open(f"{entry['logsFile']}.err", "a") as f:
+                    f.write(f"Moving {entry['tempFile']} failed: {error}\n")
+                exitCode = 1
+        status = {
+            "key": entry["key"],
+            "exitCode": exitCode,
+            "wallTime": time.monotonic() - startTime,
+            "cpuTime": self.cpuTime() - startCpu,
+            "maxRss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # kB on Linux
+            "logFiles": [f"{entry['logsFile']}.err", f"{entry['logsFile']}.out"],
+        }
+        with open(self.statusFile, "a") as f:
+            f.write(json.dumps(status) + "\n")
+        return exitCode
+
+    @staticmethod
+    def cpuTime():
+        """
+        Returns the user + system time of this process and its children in seconds
+        """
+        usage = 0
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+            rusage = resource.getrusage(who)
+            usage += rusage.ru_utime + rusage.ru_stime
+        return usage
+
+    def runScript(self, entry):
+        """
+        Runs the script as __main__ with its arguments, as if it was called from the shell.
+        The file descriptors 1 and 2 are redirected, thus also the output of the C++ code ends in the log files.
+        """
+        sys.stdout.flush()
+        sys.stderr.flush()
+        savedFds = os.dup(1), os.dup(2)
+        savedArgv, savedPath = sys.argv, list(sys.path)
+        exitCode = 0
+        with open(f"{entry['logsFile']}.out", "wb") as out, open(
+            f"{entry['logsFile']}.err", "wb"
+        ) as err:
+            os.dup2(out.fileno(), 1)
+            os.dup2(err.fileno(), 2)
+            try:
+                sys.argv = [entry["script"]] + entry["arguments"]
+                sys.path.insert(0, os.path.dirname(os.path.abspath(entry["script"])))
+                runpy.run_path(entry["script"], run_name="__main__")
+            except SystemExit as error:
+                if isinstance(error.code, int):
+                    exitCode = error.code
+                elif error.code is not None:
+                    print(error.code, file=sys.stderr)
+                    exitCode = 1
+            except Exception:
+                traceback.print_exc()
+                exitCode = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os.dup2(savedFds[0], 1)
+                os.dup2(savedFds[1], 2)
+                os.close(savedFds[0])
+                os.close(savedFds[1])
+                sys.argv, sys.path[:] = savedArgv, savedPath
+        print(entry["key"], "exit code", exitCode)
+        return exitCode
+
+
+if __name__ == "__main__":
+    sys.exit(BatchRunner(sys.argv[1], sys.argv[2]).runAll())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+This class can be used to run chains of processes (e.g. the detector response stages of one run)
+for multiple instances in a single submission.
+The chains are advanced by the parent process itself, which only spawns the actual shell scripts.
+Thus, every running stage costs a single process instead of a forked copy of the parent plus the script.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+from utils.Submitter import Submitter
+
+
+class ChainExecutor(Submitter):
+    """
+    Classed used for running chains of scripts in a single submission (eg. on the Horeka cluster).
+    Each chain is a generator that yields the key and the process string of its next stage,
+    it is resumed only once its previous stage is completed.
+    """
+
+    def __init__(
+        self,
+        MakeKeyChain,
+        logDir,
+        parallel_sim=50,
+        waitMode="event",
+        logMode="file",
+        journal=None,
+        walltimeGuard=None,
+        interruptCallbacks=[],
+        jobTimeouts=None,
+        maxRetries=1,
+        failureClassifier=None,
+        retryBackoff=60,
+        deadLetterFile=None,
+    ):
+        """
+        Parameters:
+        MakeKeyChain: is a function that yields a key and a chain.
+                      The chain is a generator that yields the key and process string of every stage
+        logDir: Directory where log files are stored
+        parallelRunningSims: number of parallel processes that wants to be executed
+        waitMode: see Submitter
+        logMode: see Submitter
+        journal: see Submitter
+        walltimeGuard: see Submitter. A chain whose next stage cannot be completed in time is dropped
+        interruptCallbacks: see Submitter
+        jobTimeouts: see Submitter
+        maxRetries: see Submitter. The chain of a timed out or failed stage is resumed only once the stage is completed,
+                    it is dropped if the stage is given up
+        failureClassifier: see Submitter
+        retryBackoff: see Submitter
+        deadLetterFile: see Submitter
+        chainDict: Dictionary with the key of the running processes and the chain they belong to
+        pendingChains: chains whose stage is completed and have to be resumed
+        """
+        super().__init__(
+            MakeKeySubString=MakeKeyChain,
+            logDir=logDir,
+            parallel_sim=parallel_sim,
+            waitMode=waitMode,
+            logMode=logMode,
+            journal=journal,
+            walltimeGuard=walltimeGuard,
+            interruptCallbacks=interruptCallbacks,
+            jobTimeouts=jobTimeouts,
+            maxRetries=maxRetries,
+            failureClassifier=failureClassifier,
+            retryBackoff=retryBackoff,
+            deadLetterFile=deadLetterFile,
+        )
+        self.chainDict = {}
+        self.pendingChains = []
+
+    def startSingleProcess(self, key=None, processString=None):
+        """
+        It starts a single process.
+        If no key and processString are given,
+        it first resumes the chains whose previous stage is completed.
+        If all of them are completed, it takes new chains from the generator
+        until one of them yields a stage that needs to be executed.
+        Nothing is started after SIGTERM or once the allocation is about to end.
+        """
+        if self.isDraining():
+            return
+        if (key is not None) and (processString is not None):
+            return super().startSingleProcess(key, processString)
+
+        key, processString = self.popDueRetry()
+        if key is not None:
+            # The timed out or failed stage, its chain is still in the chainDict
+            return super().startSingleProcess(key, processString)
+
+        while self.pendingChains:
+            if self.advanceChain(self.pendingChains.pop()):
+                return
+
+        while True:
+            _, chain = next(self.key_processString_generator, (None, None))
+            if chain is None:
+                # No more chains in the generator
+                return
+            if self.advanceChain(chain):
+                return
+
+    def advanceChain(self, chain):
+        """
+        Resumes the chain and starts the next stage, if there is one.
+
+        Parameters:
+        chain: the generator of the stages
+
+        Returns:
+        True if a new process was started, False if the chain is completed
+        """
+        key, processString = next(chain, (None, None))
+        if (key is None) or (processString is None):
+            return False
+        if (self.walltimeGuard is not None) and not self.walltimeGuard.admits(key):
+            print(f"Not enough time left in the allocation for {key}, it is skipped")
+            return False
+        super().startSingleProcess(key, processString)
+        self.chainDict[key] = chain
+        return True
+
+    def communicateSingleProcess(self, key):
+        """
+        Once the process is completed, the chain it belongs to is resumed before
+        any new chain is taken from the generator (see startSingleProcess).
+        The chain of a timed out or failed stage is kept only while the stage waits for a retry.
+
+        Parameters:
+        key: the key of the process to communicate
+
+        Returns:
+        keyToLoop: The updated list of processes keys which has to be in loop
+        """
+        if (key in self.timedOutKeys) or (self.processDict[key].returncode != 0):
+            keyToLoop = super().communicateSingleProcess(key)
+            if not self.isRetrying(key) and (key not in self.processDict.keys()):
+                # The stage is given up, thus its chain too
+                self.chainDict.pop(key, None)
+            return keyToLoop
+        if key in self.chainDict.keys():
+            self.pendingChains.append(self.chainDict.pop(key))
+        return super().communicateSingleProcess(key)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+This class can be used to check that a Corsika particle file (DAT) is complete
+and to read the headers of its showers, without any IceCube software.
+The file is memory-mapped and only the sub-blocks that are needed are read.
+
+A Corsika record has 21 sub-blocks of 273 words (312 with THINNING) of 4 bytes.
+Every sub-block starts with its name (RUNH, EVTH, LONG, EVTE, RUNE) or with particle data.
+If Corsika was compiled with a Fortran compiler, every record is enclosed in two 4-byte markers with its length.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import os
+import numpy as np
+
+
+class CorsikaReader:
+    """
+    Reader of a Corsika particle file.
+        isComplete: checks quickly (first and last record only) that the file is complete
+        validate: checks the sequence of all sub-blocks (RUNH, EVTH ... EVTE, ..., RUNE)
+        showerTable: returns the header fields of every shower as a structured array
+        primary: returns the primary of the first shower
+
+    Parameters:
+        fileName: the Corsika particle file (e.g. data/5.0/DAT500000)
+        error: the reason why the file is not complete (empty if it is)
+    """
+
+    subblocksPerRecord = 21
+    # The names of the sub-blocks as they are read in a float32 word
+    RUNH = np.frombuffer(b"RUNH", dtype=np.int32)[0]
+    EVTH = np.frombuffer(b"EVTH", dtype=np.int32)[0]
+    EVTE = np.frombuffer(b"EVTE", dtype=np.int32)[0]
+    RUNE = np.frombuffer(b"RUNE", dtype=np.int32)[0]
+    # The maximum number of random sequences in the event header
+    maxSequences = 10
+
+    showerType = np.dtype(
+        [
+            ("runNumber", np.int32),
+            ("eventNumber", np.int32),
+            ("particleId", np.int32),
+            ("energy", np.float32),  # GeV
+            ("zenith", np.float32),  # rad
+            ("azimuth", np.float32),  # rad, in the Corsika frame
+            ("seeds", np.int32, (maxSequences,)),
+        ]
+    )
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.error = ""
+        self.data = None
+        self.fortranMarkers = False
+        self.subblockWords = 273
+
+    def open(self):
+        """
+        Memory-maps the file and finds out its layout (Fortran markers and sub-block length).
+
+        Returns:
+            True if the layout is valid, False otherwise (see error)
+        """
+        if self.data is not None:
+            return True
+        try:
+            fileSize = os.path.getsize(self.fileName)
+        except OSError as error:
+            self.error = str(error)
+            return False
+        if fileSize < 8 or fileSize % 4 != 0:
+            self.error = f"size {fileSize} is not a multiple of a word"
+            return False
+
+        data = np.memmap(self.fileName, dtype=np.float32, mode="r")
+        words = data[:2].view(np.int32)
+        for subblockWords in [273, 312]:
+            recordBytes = self.subblocksPerRecord * subblockWords * 4
+            if words[0] == recordBytes and words[1] == self.RUNH:
+                self.fortranMarkers = True
+                self.subblockWords = subblockWords
+                break
+        else:
+            if words[0] != self.RUNH:
+                self.error = "the file does not start with RUNH"
+                return False
+            self.fortranMarkers = False
+            # The second sub-block is the header of the first shower
+            self.subblockWords = 273
+            if (data.size > 312) and (data[273:274].view(np.int32)[0] != self.EVTH):
+                if data[312:313].view(np.int32)[0] == self.EVTH:
+                    self.subblockWords = 312
+
+        recordWords = self.recordWords()
+        if data.size % recordWords != 0:
+            self.error = f"size {fileSize} is not a multiple of the record length (truncated)"
+            return False
+        self.data = data.reshape(-1, recordWords)
+        return True
+
+    def recordWords(self):
+        """
+        Returns the number of words of a record, including the Fortran markers
+        """
+        return self.subblocksPerRecord * self.subblockWords + 2 * self.fortranMarkers
+
+    def subblockNames(self, records=slice(None)):
+        """
+        Returns the names (first word as int32) of all sub-blocks of the records.
+        Only the first word of every sub-block is read from the memory-mapped file.
+        """
+        offset = int(self.fortranMarkers)
+        names = self.data[
+            records,
+            offset : offset + self.subblocksPerRecord * self.subblockWords : self.subblockWords,
+        ]
+        return np.ascontiguousarray(names).reshape(-1).view(np.int32)
+
+    def readSubblocks(self, indices):
+        """
+        Returns the sub-blocks with the given indices (counted over the whole file)
+        as an array with shape (number of indices, subblockWords)
+        """
+        records, positions = np.divmod(np.asarray(indices), self.subblocksPerRecord)
+        columns = (
+            int(self.fortranMarkers)
+            + positions[:, None] * self.subblockWords
+            + np.arange(self.subblockWords)
+        )
+        return np.asarray(self.data[records[:, None], columns])
+
+    def checkMarkers(self, records=slice(None)):
+        """
+        Checks that the Fortran markers of the records hold the record length
+        """
+        if not self.fortranMarkers:
+            return True
+        recordBytes = (self.recordWords() - 2) * 4
+        markers = self.data[records][:, [0, -1]].view(np.int32)
+        if np.any(markers != recordBytes):
+            self.error = "wrong Fortran record markers"
+            return False
+        return True
+
+    def isComplete(self):
+        """
+        Quick check that only reads the first and the last record:
+        the file starts with RUNH and the last record holds RUNE, which is written when Corsika ends.
+        """
+        if not self.open():
+            return False
+        if not self.checkMarkers(slice(-1, None)):
+            return False
+        if not np.any(self.subblockNames(slice(-1, None)) == self.RUNE):
+            self.error = "RUNE is missing (Corsika did not end)"
+            return False
+        return True
+
+    def validate(self):
+        """
+        Full check of the file:
+        a single RUNH at the beginning, every EVTH followed by its EVTE,
+        a single RUNE in the last record after all showers
+        and as many showers as counted in RUNE.
+        """
+        if not self.open():
+            return False
+        if not self.checkMarkers():
+            return False
+        names = self.subblockNames()
+        runh = np.flatnonzero(names == self.RUNH)
+        evth = np.flatnonzero(names == self.EVTH)
+        evte = np.flatnonzero(names == self.EVTE)
+        rune = np.flatnonzero(names == self.RUNE)
+
+        if runh.size != 1 or runh[0] != 0:
+            self.error = "there MUST be a single RUNH at the beginning"
+        elif rune.size != 1:
+            self.error = "there MUST be a single RUNE"
+        elif rune[0] // self.subblocksPerRecord != self.data.shape[0] - 1:
+            self.error = "RUNE is not in the last record"
+        elif evth.size != evte.size:
+            self.error = f"{evth.size} EVTH but {evte.size} EVTE"
+        elif np.any(evth > evte) or np.any(evte[:-1] > evth[1:]):
+            self.error = "EVTH and EVTE are not alternating"
+        elif evte.size and evte[-1] > rune[0]:
+            self.error = "EVTE after RUNE"
+        elif np.any(self.readSubblocks(evth)[:, 1] != self.readSubblocks(evte)[:, 1]):
+            self.error = "the event numbers of EVTH and EVTE do not match"
+        elif int(self.readSubblocks(rune)[0, 2]) != evth.size:
+            self.error = f"RUNE counts {int(self.readSubblocks(rune)[0, 2])} showers but the file has {evth.size}"
+        else:
+            self.error = ""
+        return not self.error
+
+    def primary(self):
+        """
+        Returns the Corsika id of the primary of the first shower (e.g. 14 proton), reading only the first record.
+        Returns 0 if the first record has no shower header.
+        """
+        if not self.open():
+            return 0
+        evth = np.flatnonzero(self.subblockNames(slice(0, 1)) == self.EVTH)
+        if evth.size == 0:
+            return 0
+        return int(self.readSubblocks(evth[:1])[0, 2])
+
+    def showerTable(self):
+        """
+        Reads the header (EVTH) of every shower.
+
+        Returns:
+            a structured array with runNumber, eventNumber, particleId, energy, zenith, azimuth
+            and the seeds of the random sequences (0 if not used)
+        """
+        if not self.open():
+            return np.zeros(0, dtype=self.showerType)
+        # The words of the header are numbered from 1 in the Corsika manual
+        headers = self.readSubblocks(np.flatnonzero(self.subblockNames() == self.EVTH))
+
+        table = np.zeros(len(headers), dtype=self.showerType)
+        table["runNumber"] = headers[:, 43]
+        table["eventNumber"] = headers[:, 1]
+        table["particleId"] = headers[:, 2]
+        table["energy"] = headers[:, 3]
+        table["zenith"] = headers[:, 10]
+        table["azimuth"] = headers[:, 11]
+        # The seed of the sequence n is the word 14 + 3 (n - 1)
+        seeds = headers[:, 13 : 13 + 3 * self.maxSequences : 3].astype(np.int32)
+        numberSequences = headers[:, 12].astype(np.int32)
+        table["seeds"] = np.where(
+            np.arange(self.maxSequences) < numberSequences[:, None], seeds, 0
+        )
+        return table
+
+    def close(self):
+        """
+        Releases the memory map
+        """
+        self.data = None
@@ -0,0 +1,604 @@
+#!/usr/bin/env python3
+
+"""
+This class can be used to run the single stages of many runs (e.g. detector, level1, level2)
+as tasks with explicit dependencies in a single submission.
+Every task whose dependencies are completed is ready and can be started in any free slot,
+no matter which run it belongs to. Thus, stages of different runs interleave and the node stays busy.
+Ready tasks of the same stage and energy bin can be run as a batch by a single process (see utils/BatchRunner.py),
+their journal, output files and retries are still handled run by run.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import collections
+import time
+
+from utils.Submitter import Submitter
+from utils.ResourceClasses import ResourcePool
+from utils.FailureClassifier import FailureClassifier
+from utils.BatchRunner import BatchRunner
+
+
+class Task:
+    """
+    A single stage of a run.
+
+    Parameters:
+        key: the unique key of the task (used for the log files)
+        stage: the name of the stage (e.g. detector, lv1)
+        prepare: a function without arguments that writes the executable file of the stage.
+                 It returns the executable file (None if there is nothing to execute) and the output file.
+                 It is called only once all dependencies are completed,
+                 thus it can use the outputFile of its dependencies.
+        dependencies: the list of tasks that have to be completed before this one
+        attributes: dictionary with the attributes recorded in the journal (e.g. energy, primary, numbSamples, detector)
+    """
+
+    def __init__(self, key, stage, prepare, dependencies=[], attributes={}):
+        self.key = key
+        self.stage = stage
+        self.attributes = dict(attributes)
+        self.prepare = prepare
+        self.dependencies = list(dependencies)
+        self.dependents = []
+        self.missingDependencies = len(self.dependencies)
+        self.outputFile = None
+        # The attempts of the task, kept while its output file is moved (see DagScheduler.stagedOut)
+        self.attempts = 0
+        for dependency in self.dependencies:
+            dependency.dependents.append(self)
+
+
+class DagScheduler(Submitter):
+    """
+    Classed used for running the tasks of many runs in a single submission (eg. on the Horeka cluster).
+    New runs are only taken from the generator when no task of the runs already known can be started.
+    Every stage belongs to a resource class of the ResourcePool, which limits how many of them run at the same time.
+    """
+
+    def __init__(
+        self,
+        MakeKeyTasks,
+        logDir,
+        parallel_sim=50,
+        waitMode="event",
+        logMode="file",
+        journal=None,
+        resourcePool=None,
+        stageOut=None,
+        walltimeGuard=None,
+        interruptCallbacks=[],
+        jobTimeouts=None,
+        maxRetries=1,
+        failureClassifier=None,
+        retryBackoff=60,
+        deadLetterFile=None,
+        batchSize=1,
+        batchStages=[],
+        makeBatch=None,
+    ):
+        """
+        Parameters:
+        MakeKeyTasks: is a function that yields a key and the list of tasks of a run
+        logDir: Directory where log files are stored
+        parallelRunningSims: number of parallel processes that wants to be executed
+        waitMode: see Submitter
+        logMode: see Submitter
+        journal: see Submitter
+        resourcePool: the ResourcePool with the resource classes of the stages
+                      (default a single class with parallelRunningSims slots)
+        stageOut: the StageOut with the moves registered by the tasks (e.g. by the DetectorSimulator).
+                  A task is completed only once its output file is moved (default None)
+        walltimeGuard: see Submitter
+        interruptCallbacks: see Submitter
+        jobTimeouts: see Submitter
+        maxRetries: see Submitter. A timed out or transiently failed task is put back in front of the ready tasks
+                    (once its retry delay is over), the dependents of a failed task are never started
+        failureClassifier: see Submitter
+        retryBackoff: see Submitter
+        deadLetterFile: see Submitter
+        batchSize: the maximum number of runs of a stage in a batch (default 1, no batches)
+        batchStages: the stages whose tasks can be batched (e.g. detector, lv1, lv2)
+        makeBatch: a function that writes the executable file of a batch (e.g. DetectorSimulator.writeBatchFile).
+                   It gets the list of (key, exeFile, outputFile) of the runs
+                   and returns the executable file and the status file of the batch
+        readyTasks: the tasks whose dependencies are all completed
+        taskDict: Dictionary with the key of the running processes and their task
+        allocationDict: Dictionary with the key of the running processes and their resources
+        batchDict: Dictionary with the key of the running batches, their tasks and status file
+        """
+        super().__init__(
+            MakeKeySubString=MakeKeyTasks,
+            logDir=logDir,
+            parallel_sim=parallel_sim,
+            waitMode=waitMode,
+            logMode=logMode,
+            journal=journal,
+            stageOut=stageOut,
+            walltimeGuard=walltimeGuard,
+            interruptCallbacks=interruptCallbacks,
+            jobTimeouts=jobTimeouts,
+            maxRetries=maxRetries,
+            failureClassifier=failureClassifier,
+            retryBackoff=retryBackoff,
+            deadLetterFile=deadLetterFile,
+        )
+        self.resourcePool = resourcePool
+        if self.resourcePool is None:
+            self.resourcePool = ResourcePool(
+                resourceClasses={"cpu": {"slots": parallel_sim}},
+                totalCores=parallel_sim,
+            )
+        # Maximum number of ready tasks kept in memory while waiting for resources
+        self.maxReadyTasks = 2 * parallel_sim
+        self.readyTasks = collections.deque()
+        self.taskDict = {}
+        self.allocationDict = {}
+        # The timed out and failed tasks while they are communicated (see requeue)
+        self.failedTasks = {}
+        # The keys of the tasks whose output file is being moved, they are done once it is moved (see stagedOut)
+        self.stagingOutKeys = set()
+        self.batchSize = batchSize
+        self.batchStages = set(batchStages)
+        self.makeBatch = makeBatch
+        self.batchDict = {}
+
+    def startProcesses(self):
+        """
+        It is the first function to be called.
+        It starts as many processes as the resources allow.
+        """
+        print("Start Process")
+        self.handleSignals()
+        self.fillSlots()
+
+    def fillSlots(self):
+        """
+        Starts new processes until the resources or the tasks are exhausted
+        """
+        while self.startSingleProcess():
+            pass
+
+    def startSingleProcess(self, key=None, processString=None, env=None):
+        """
+        It starts a single process.
+        If no key and processString are given, it takes the next ready task with free resources.
+        If there is none, the tasks of the next run are taken from the generator.
+        Tasks that have nothing to execute (e.g. the output already exists) are completed immediately,
+        as well as the tasks that are done according to the journal.
+        Tasks that cannot be completed before the end of the allocation (see WalltimeGuard) are dropped
+        together with their dependents, the next submission starts them again.
+        A task of a batchStage is started together with the other ready tasks of the same stage and energy bin
+        (see batchRuns).
+
+        Returns:
+            True if a new process was started, False otherwise
+        """
+        if self.isDraining():
+            return False
+        if (key is not None) and (processString is not None):
+            super().startSingleProcess(key, processString, env=env)
+            return True
+
+        while True:
+            self.readyRetries()
+            task = self.nextReadyTask()
+            if task is None:
+                if len(self.readyTasks) < self.maxReadyTasks:
+                    _, tasks = next(self.key_processString_generator, (None, None))
+                    if tasks is not None:
+                        self.addTasks(tasks)
+                        continue
+                # Nothing else can be started, thus the batches that are not full are started as they are
+                task = self.nextReadyTask(fullBatches=False)
+                if task is None:
+                    # Waits for resources or no more runs in the generator
+                    return False
+
+            if (self.journal is not None) and self.journal.isDone(task.key):
+                task.outputFile = self.journal.outputFile(task.key)
+                self.completeTask(task)
+                continue
+
+            if (self.walltimeGuard is not None) and not self.walltimeGuard.admits(
+                task.key
+            ):
+                print(f"Not enough time left in the allocation for {task.key}, it is skipped")
+                continue
+
+            exeFile, task.outputFile = task.prepare()
+            if exeFile is None:
+                if self.journal is not None:
+                    self.journal.markDone(task.key, task.outputFile)
+                self.completeTask(task)
+                continue
+
+            if self.journal is not None:
+                self.journal.markPlanned(
+                    task.key, task.outputFile, dict(task.attributes, stage=task.stage)
+                )
+
+            runs = [(task, exeFile)]
+            if (task.stage in self.batchStages) and (self.batchSize > 1):
+                runs += self.batchRuns(task)
+
+            print(task.key, task.stage)
+            allocation = self.resourcePool.acquire(task.stage)
+            if len(runs) > 1:
+                self.startBatch(runs, allocation)
+                return True
+            super().startSingleProcess(
+                task.key, exeFile, env=self.resourcePool.environment(allocation)
+            )
+            self.taskDict[task.key] = task
+            self.allocationDict[task.key] = allocation
+            return True
+
+    def batchRuns(self, task):
+        """
+        Takes up to batchSize - 1 other ready tasks of the same stage and energy bin of the task and prepares them.
+        The ones that are already done are completed immediately.
+        With a WalltimeGuard only as many tasks are taken as can be completed one after the other.
+
+        Returns:
+            runs: the list of (task, exeFile) of the other tasks of the batch
+        """
+        runs = []
+        keys = [task.key]
+        for other in list(self.readyTasks):
+            if len(keys) >= self.batchSize:
+                break
+            if (other.stage != task.stage) or (
+                other.attributes.get("energy") != task.attributes.get("energy")
+            ):
+                continue
+            if (self.walltimeGuard is not None) and not self.walltimeGuard.admitsAll(
+                keys + [other.key]
+            ):
+                break
+            self.readyTasks.remove(other)
+
+            if (self.journal is not None) and self.journal.isDone(other.key):
+                other.outputFile = self.journal.outputFile(other.key)
+                self.completeTask(other)
+                continue
+            exeFile, other.outputFile = other.prepare()
+            if exeFile is None:
+                if self.journal is not None:
+                    self.journal.markDone(other.key, other.outputFile)
+                self.completeTask(other)
+                continue
+            if self.journal is not None:
+                self.journal.markPlanned(
+                    other.key,
+                    other.outputFile,
+                    dict(other.attributes, stage=other.stage),
+                )
+            runs.append((other, exeFile))
+            keys.append(other.key)
+        return runs
+
+    def startBatch(self, runs, allocation):
+        """
+        Starts the tasks as a single process.
+        The key of the batch is the key of its first task with the number of the other ones,
+        e.g. 5.0_500001+3_lv1, thus its stage and energy bin can still be found from it.
+        Its timeout is the one of a single task times the number of tasks.
+        The attempts and the journal are kept for every task, the batch itself is not recorded in the journal.
+
+        Parameters:
+        runs: the list of (task, exeFile) of the batch
+        allocation: the resources of the batch
+        """
+        tasks = [task for task, _ in runs]
+        batchFile, statusFile = self.makeBatch(
+            [(task.key, exeFile, task.outputFile) for task, exeFile in runs]
+        )
+        prefix, _, stage = tasks[0].key.rpartition("_")
+        key = f"{prefix}+{len(tasks) - 1}_{stage}"
+        print(key, "batch of", " ".join(task.key for task in tasks))
+        # Known as batch before it is started, thus it is not recorded in the journal (see isJournaled)
+        self.batchDict[key] = (tasks, statusFile)
+        super().startSingleProcess(
+            key, batchFile, env=self.resourcePool.environment(allocation)
+        )
+        if key in self.deadlines.keys():
+            timeout = self.deadlines[key] - self.startTimes[key]
+            self.deadlines[key] = self.startTimes[key] + len(tasks) * timeout
+        for task in tasks:
+            self.attempts[task.key] += 1
+            if self.journal is not None:
+                self.journal.markRunning(task.key)
+        self.allocationDict[key] = allocation
+
+    def isJournaled(self, key):
+        """
+        The batches are not recorded in the journal, their tasks are
+        """
+        return key not in self.batchDict.keys()
+
+    def processInterrupted(self, key):
+        """
+        Records the process killed by SIGTERM as interrupted (see Submitter.processInterrupted).
+        The tasks of a batch completed before the signal are communicated as usual (see communicateRun),
+        the others are recorded as interrupted one by one.
+
+        Parameters:
+        key: the key of the process
+        """
+        if key not in self.batchDict.keys():
+            super().processInterrupted(key)
+            return
+        tasks, statusFile = self.batchDict.pop(key)
+        self.resourcePool.release(self.allocationDict.pop(key))
+        statuses = BatchRunner.readStatus(statusFile)
+        for task in tasks:
+            status = statuses.get(task.key)
+            if (status is not None) and (status["exitCode"] == 0):
+                self.communicateRun(task, 0, status, status["logFiles"])
+            else:
+                self.attempts.pop(task.key, None)
+                super().processInterrupted(task.key)
+
+    def readyRetries(self):
+        """
+        Puts the tasks whose retry delay is over back in front of the ready tasks
+        """
+        while True:
+            key, task = self.popDueRetry()
+            if key is None:
+                return
+            self.readyTasks.appendleft(task)
+
+    def nextReadyTask(self, fullBatches=True):
+        """
+        Removes and returns the first ready task whose resource class has free resources.
+        If fullBatches is True, a task of a batchStage is only taken once batchSize tasks
+        of its stage and energy bin are ready, thus its batch is full.
+        Returns None if there is no such task.
+        """
+        for index, task in enumerate(self.readyTasks):
+            if fullBatches and self.waitsForBatch(task):
+                continue
+            if self.resourcePool.isAvailable(task.stage):
+                del self.readyTasks[index]
+                return task
+        return None
+
+    def waitsForBatch(self, task):
+        """
+        Checks if less than batchSize tasks of the stage and energy bin of the task are ready
+        """
+        if (task.stage not in self.batchStages) or (self.batchSize <= 1):
+            return False
+        ready = sum(
+            (other.stage == task.stage)
+            and (other.attributes.get("energy") == task.attributes.get("energy"))
+            for other in self.readyTasks
+        )
+        return ready < self.batchSize
+
+    def addTasks(self, tasks):
+        """
+        Adds the tasks without dependencies of a new run to the ready tasks
+        """
+        for task in tasks:
+            if task.missingDependencies == 0:
+                self.readyTasks.append(task)
+
+    def completeTask(self, task):
+        """
+        Marks the task as completed.
+        The dependents whose dependencies are all completed become ready.
+        They are put in front of the queue so that already started runs are completed first.
+        """
+        for dependent in task.dependents:
+            dependent.missingDependencies -= 1
+            if dependent.missingDependencies == 0:
+                self.readyTasks.appendleft(dependent)
+
+    def communicateSingleProcess(self, key):
+        """
+        Once the process is completed, its task is completed and its resources are released.
+        If a move of its output file was registered in the StageOut,
+        the task is completed only once the file is moved (see stagedOut).
+        Then as many new processes as the free resources allow are started.
+        A timed out or failed task is not completed, it is either started again (see requeue) or given up
+        together with its dependents.
+
+        Parameters:
+        key: the key of the process to communicate
+
+        Returns:
+        keyToLoop: The updated list of processes keys which has to be in loop
+        """
+        if key in self.batchDict.keys():
+            return self.communicateBatch(key)
+        if key in self.taskDict.keys():
+            task = self.taskDict.pop(key)
+            self.resourcePool.release(self.allocationDict.pop(key))
+            if (key in self.timedOutKeys) or (self.processDict[key].returncode != 0):
+                self.failedTasks[key] = task
+                if self.stageOut is not None:
+                    self.stageOut.registeredMoves.pop(task.outputFile, None)
+            else:
+                task.attempts = self.attempts.get(key, 1)
+                if self.submitStageOut(task):
+                    self.stagingOutKeys.add(key)
+                else:
+                    self.completeTask(task)
+        super().communicateSingleProcess(key)
+        self.failedTasks.pop(key, None)
+        self.fillSlots()
+        return list(self.processDict.keys())
+
+    def submitStageOut(self, task):
+        """
+        Submits the move of the output file of the task, if one was registered in the StageOut.
+        The task is completed once its output file is moved (see stagedOut)
+
+        Returns:
+            True if the move was submitted, False if there is nothing to move
+        """
+        if self.stageOut is None:
+            return False
+        return self.stageOut.submitRegistered(
+            task.outputFile, lambda error, task=task: self.stagedOut(task, error)
+        )
+
+    def waitsForStageOut(self, key):
+        """
+        Checks if the output file of the task is being moved, thus the journal does not record it as done yet
+        """
+        return key in self.stagingOutKeys
+
+    def requeue(self, key, processString, delay=0):
+        """
+        Puts the timed out or failed task in the retry queue.
+        Once the delay is over it is put back in front of the ready tasks and prepared again when resources are free
+        """
+        self.retryQueue.append((time.monotonic() + delay, key, self.failedTasks[key]))
+
+    def communicateBatch(self, key):
+        """
+        Once the process of a batch is completed, every task of it is handled
+        as if it was a process on its own (see communicateRun).
+        The tasks that were not reached because the batch was killed get the exit code and the log files of the batch.
+
+        Parameters:
+        key: the key of the batch
+
+        Returns:
+        keyToLoop: The updated list of processes keys which has to be in loop
+        """
+        tasks, statusFile = self.batchDict.pop(key)
+        self.resourcePool.release(self.allocationDict.pop(key))
+        returncode = self.processDict[key].wait()
+        timedOut = key in self.timedOutKeys
+        self.timedOutKeys.discard(key)
+        self.deadlines.pop(key, None)
+        self.processStrings.pop(key, None)
+        self.startTimes.pop(key, None)
+        self.attempts.pop(key, None)
+        self.usageDict.pop(key, None)
+
+        statuses = BatchRunner.readStatus(statusFile)
+        for task in tasks:
+            status = statuses.get(task.key)
+            if status is not None:
+                self.communicateRun(task, status["exitCode"], status, status["logFiles"])
+            elif timedOut:
+                self.communicateRun(task, None, None, self.logFiles(key))
+            else:
+                self.communicateRun(task, returncode or 1, None, self.logFiles(key))
+
+        self.deleteSingleProcess(key)
+        self.fillSlots()
+        return list(self.processDict.keys())
+
+    def communicateRun(self, task, returncode, usage, logFiles):
+        """
+        Handles a single task of a completed batch.
+        A successful task is completed (once its output is staged out),
+        a failed one is classified and retried or given up (see Submitter.processFailed),
+        as well as the one that was not reached before the batch exceeded its timeout.
+
+        Parameters:
+        task: the task
+        returncode: the exit code of its script, None if the batch timed out before it was completed
+        usage: its accounting (default None, unknown)
+        logFiles: its log files
+        """
+        if returncode == 0:
+            task.attempts = self.attempts.pop(task.key, 1)
+            stagingOut = self.submitStageOut(task)
+            if stagingOut:
+                self.stagingOutKeys.add(task.key)
+            if self.journal is not None:
+                self.journal.markCompleted(
+                    task.key, returncode, usage, stagingOut=stagingOut
+                )
+            if not stagingOut:
+                self.completeTask(task)
+            return
+
+        if self.stageOut is not None:
+            self.stageOut.registeredMoves.pop(task.outputFile, None)
+        self.failedTasks[task.key] = task
+        if returncode is None:
+            if self.journal is not None:
+                self.journal.markTimedOut(task.key)
+            for callback in self.interruptCallbacks:
+                callback(task.key)
+            if self.attempts[task.key] <= self.maxRetries:
+                print(f"The process {task.key} is started again (attempt {self.attempts[task.key] + 1})")
+                self.requeue(task.key, task)
+            else:
+                print(f"The process {task.key} timed out {self.attempts[task.key]} times, it is given up")
+                self.attempts.pop(task.key, None)
+                FailureClassifier.addDeadLetter(
+                    self.deadLetterFile, task.key, None, "timeout", "exceeded its timeout"
+                )
+        else:
+            failureClass = None
+            if self.failureClassifier is not None:
+                failureClass = self.processFailed(task.key, returncode, task, logFiles)
+            else:
+                self.attempts.pop(task.key, None)
+            if self.journal is not None:
+                self.journal.markCompleted(task.key, returncode, usage, failureClass)
+        self.failedTasks.pop(task.key, None)
+
+    def stagedOut(self, task, error):
+        """
+        Called by the StageOut once the output file of the task is moved.
+        The task is completed and the slots freed in the meantime are filled.
+        If the move failed, the output file is not in the data directory, thus the task is not completed
+        and its dependents are not started. It is handled as a filesystem failure (see stageOutFailed).
+
+        Parameters:
+        task: the task whose output file was moved
+        error: None if the move succeeded, otherwise the exception
+        """
+        self.stagingOutKeys.discard(task.key)
+        if error is not None:
+            self.stageOutFailed(task, error)
+        else:
+            if self.journal is not None:
+                self.journal.markDone(task.key, task.outputFile)
+            self.completeTask(task)
+        self.fillSlots()
+
+    def stageOutFailed(self, task, error):
+        """
+        Handles a task whose output file could not be moved to the data directory.
+        It is marked as failed in the journal and started again after retryBackoff * 2**(attempt - 1) seconds
+        if filesystem failures are retried and it has not used all its retries,
+        otherwise it is given up and written to the dead-letter list.
+
+        Parameters:
+        task: the task whose output file was not moved
+        error: the exception of the move
+        """
+        print(f"Moving the output of {task.key} failed: {error}")
+        if self.journal is not None:
+            self.journal.markFailed(task.key, "filesystem")
+        if (
+            (self.failureClassifier is not None)
+            and self.failureClassifier.isTransient("filesystem")
+            and (task.attempts <= self.maxRetries)
+        ):
+            self.attempts[task.key] = task.attempts
+            self.failedTasks[task.key] = task
+            delay = self.retryBackoff * 2 ** (task.attempts - 1)
+            print(f"The process {task.key} is started again in {delay:.0f} s (attempt {task.attempts + 1})")
+            self.requeue(task.key, task, delay)
+            self.failedTasks.pop(task.key, None)
+            return
+        FailureClassifier.addDeadLetter(
+            self.deadLetterFile, task.key, 0, "filesystem", f"Moving the output failed: {error}"
+        )
+        for callback in self.interruptCallbacks:
+            callback(task.key)
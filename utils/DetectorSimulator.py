@@ -3,9 +3,14 @@
 Some documentation 
 """
 
+import json
 import os
 import pathlib
+import shlex
+import shutil
 import stat
+import sys
+import tempfile
 
 
 class DetectorSimulator:
@@ -14,6 +19,9 @@ class DetectorSimulator:
     It also creates the folders and the executable file for the simulation script.
     """
 
+    # The extension of the i3 files written with every codec, the I3Writer compresses according to it
+    CODECS = {"bz2": ".i3.bz2", "zst": ".i3.zst", "gz": ".i3.gz", "none": ".i3"}
+
     def __init__(
         self,
         pythonPath,
@@ -29,6 +37,14 @@ class DetectorSimulator:
         detector="IC86",
         GCD="",
         photonDirectory="",
+        scratchDir="",
+        stageOut=None,
+        warmSocket="",
+        fileCache=None,
+        cachedPhotonFiles=[],
+        inputDecoding="file",
+        decodeThreads=4,
+        outputCodecs={},
     ):
         """
         Parameters:
@@ -45,6 +61,23 @@ class DetectorSimulator:
             detector: the detector to be simulated (default IC86)
             GCD: the path to the GCD file
             photonDirectory: on cobalt medison cluster is /cvmfs/icecube.opensciencegrid.org/data/photon-tables/
+            scratchDir: node-local directory ($TMPDIR, /dev/shm) where the temp files are written (default "", the temp folders in outDirectory)
+            stageOut: the StageOut which moves the temp files to the data folders once the script is completed.
+                      If None the script moves the file itself (default None)
+            warmSocket: the Unix socket of a WarmWorker. If given, the python scripts are run by the warm worker
+                        (with icetray already imported) instead of a new python process (default "", not used)
+            fileCache: the FileCache of the node. If given, the GCD file is copied once per node
+                       and the scripts read the cached copy (default None, read from its original path)
+            cachedPhotonFiles: the files of the photonDirectory (relative paths) that are cached too, then the scripts
+                               read the photon tables from a cached directory which ONLY holds these files.
+                               The whole photon-tables tree is never cached, it is too large (default [], not cached)
+            inputDecoding: how the bz2 corsika files are given to icetopshowergenerator.py (see decodeCommands).
+                           file: decompressed into node-local space before the script,
+                           fifo: streamed through a named pipe while the script reads it (default file)
+            decodeThreads: the threads used to decompress a bz2 file if lbzip2 or pbzip2 is available (default 4)
+            outputCodecs: dictionary with the codec (see CODECS) of the output of every stage
+                          (ITSG, CorsikaBg, polyplopia, clsim, detector, lv1, lv2, lv3), e.g. {"detector": "zst"}.
+                          The stages not in it write bz2 (default {})
         """
 
         self.pythonPath = pythonPath
@@ -57,8 +90,26 @@ class DetectorSimulator:
         self.i3build = i3build
         self.outDirectory = outDirectory
         self.detector = f"{detector}.{year}"
+        if fileCache is not None:
+            GCD = fileCache.get(GCD) if GCD else GCD
+            if photonDirectory and cachedPhotonFiles:
+                photonDirectory = fileCache.get(photonDirectory, cachedPhotonFiles)
         self.GCD = GCD
         self.photonDir = photonDirectory
+        self.scratchDir = scratchDir
+        self.stageOut = stageOut
+        self.warmSocket = warmSocket
+        self.inputDecoding = inputDecoding
+        self.decodeThreads = decodeThreads
+        self.outputCodecs = outputCodecs
+        # The decompressed input of every data file, removed by the exeFile itself or by removeTempFiles if it was killed
+        self.decodedFiles = {}
+        # The temp file written by the script of every data file (see removeTempFiles)
+        self.tempFiles = {}
+        # The data files whose script was killed or given up, thus their temp files are left (see discardOutput)
+        self.discardedFiles = set()
+        # The command of every exeFile (see writeBatchFile)
+        self.commands = {}
         self.Lv3GCD = ""
         if doLv3:
             self.Lv3GCD = self.GCD
@@ -97,7 +148,14 @@ class DetectorSimulator:
         return
 
     def writeSHexeFile(
-        self, exeFile, cmdPython, cmdOptions, cmdMoveFile, cmdSTART="", cmdEND=""
+        self,
+        exeFile,
+        cmdPython,
+        cmdOptions,
+        cmdMoveFile,
+        cmdSTART="",
+        cmdEND="",
+        logsFile="",
     ):
         """
         Writes the executable file and makes it executable.
@@ -105,6 +163,10 @@ class DetectorSimulator:
             runs the python script
             move the file from the temp to the data directory
             can remove the exeFile once completed (if the command is given)
+        The exeFile stops at the first failing command (set -e), thus the temp file of a failed script
+        is never moved to the data directory and the exit code of the script is the one of the python script.
+        The command is also kept, thus several runs of the same stage can be executed by a single python process
+        (see writeBatchFile).
         ----------------------------------------------------------------
         Parameters:
             exeFile: the name of the executable
@@ -115,13 +177,34 @@ class DetectorSimulator:
             cmdEND: is a command that can be used at the end.
                     E.G. removing the exeFile once its completed (default does nothing)
                     it could be useful to check if everything runs correctly
+            logsFile: the log files of the python script without extension.
+                      If given, the stdout and stderr of the script are written to {logsFile}.out and {logsFile}.err
+                      and the tail of the .err file is written to the stderr of the exeFile when the script fails,
+                      thus the Submitter can classify the failure (default "").
+                      It is needed to run the script in the WarmWorker
         """
+        self.commands[exeFile] = {
+            "cmdPython": cmdPython,
+            "cmdOptions": cmdOptions,
+            "cmdSTART": cmdSTART.strip(),
+            "cmdEND": cmdEND.strip(),
+            "logsFile": logsFile,
+        }
+        cmdLogs = ""
+        cmdFailure = ""
+        if logsFile:
+            cmdLogs = f" > {logsFile}.out 2> {logsFile}.err"
+            cmdFailure = f" || {{ status=$?; tail -n 50 {logsFile}.err >&2; exit $status; }}"
+            if self.warmSocket:
+                cmdPython = self.warmCommand(cmdPython, logsFile)
+                cmdLogs = ""
         with open(exeFile, "w") as file:
             file.write(r"#!/bin/sh")  # This shows that the file is an executable
             file.write(
                 "\n"
+                + "set -e\n"  # Stops at the first failing command
                 + f"{cmdSTART}\n"
-                + f"{cmdPython} {cmdOptions}\n"  # Execute python script with arguments
+                + f"{cmdPython} {cmdOptions}{cmdLogs}{cmdFailure}\n"  # Execute python script with arguments
                 + f"{cmdMoveFile}\n"
                 + f"{cmdEND}\n"
             )
@@ -130,6 +213,76 @@ class DetectorSimulator:
         st = os.stat(exeFile)
         os.chmod(exeFile, st.st_mode | stat.S_IEXEC)
 
+    def warmCommand(self, cmdPython, logsFile):
+        """
+        Returns the command that sends the python script to the WarmWorker (see utils/WarmWorker.py).
+        The client runs with the python of this process, which starts quickly since it does not import icetray.
+        The worker writes the log files of the script. If it cannot be reached, the client runs the script itself.
+        """
+        *pythonPath, script = cmdPython.split()
+        warmWorker = f"{os.path.dirname(os.path.abspath(__file__))}/WarmWorker.py"
+        return (
+            f"{sys.executable} {warmWorker} run --socket {self.warmSocket} --logsFile {logsFile} "
+            f"--fallback {shlex.quote(' '.join(pythonPath))} -- {script} "
+        )
+
+    def writeBatchFile(self, runs):
+        """
+        Writes the executable file that runs the scripts of several runs of the same stage one after the other
+        in a single python process (see utils/BatchRunner.py).
+        Thus, icetray is imported once for all of them instead of once per run.
+        The log files, the temp and the data file of every run are the same as with its own exeFile.
+        Without a StageOut the temp file of every completed run is moved by the BatchRunner,
+        otherwise the moves stay registered in the StageOut.
+        Only the runs whose exeFile has neither a cmdSTART nor a cmdEND can be batched.
+        ----------------------------------------------------------------
+        Parameters:
+            runs: list of (key, exeFile, dataFile) of the runs, as returned by the run_ functions
+        Return:
+            batchFile: the file that need to be executed
+            statusFile: the file where the exit code of every run is written (see BatchRunner.readStatus)
+        """
+        entries = []
+        for key, exeFile, dataFile in runs:
+            command = self.commands[exeFile]
+            if command["cmdSTART"] or command["cmdEND"]:
+                raise ValueError(f"{exeFile} runs other commands than the python script, it cannot be batched")
+            entries.append(
+                {
+                    "key": key,
+                    # The script is the last word of cmdPython, the ones before are the python path
+                    "script": command["cmdPython"].split()[-1],
+                    "arguments": shlex.split(command["cmdOptions"]),
+                    "logsFile": command["logsFile"],
+                    "tempFile": self.tempFiles[dataFile],
+                    "dataFile": dataFile if self.stageOut is None else None,
+                }
+            )
+
+        firstExeFile = runs[0][1]
+        batchFile = f"{os.path.splitext(firstExeFile)[0]}_batch{len(runs)}.sh"
+        manifestFile = f"{os.path.splitext(batchFile)[0]}.json"
+        statusFile = f"{os.path.splitext(batchFile)[0]}.status"
+        with open(manifestFile, "w") as file:
+            json.dump(entries, file, indent=1)
+        if os.path.isfile(statusFile):
+            os.remove(statusFile)
+
+        pythonPath = " ".join(self.commands[firstExeFile]["cmdPython"].split()[:-1])
+        batchRunner = f"{os.path.dirname(os.path.abspath(__file__))}/BatchRunner.py"
+        with open(batchFile, "w") as file:
+            file.write(r"#!/bin/sh")  # This shows that the file is an executable
+            file.write(
+                "\n"
+                + "set -e\n"  # Stops at the first failing command
+                + f"exec {pythonPath} {batchRunner} {manifestFile} {statusFile}\n"
+            )
+
+        # Make the file executable
+        st = os.stat(batchFile)
+        os.chmod(batchFile, st.st_mode | stat.S_IEXEC)
+        return batchFile, statusFile
+
     def make_folders(self, folder, energy):
         """
         It makes the data, temp, logs and inps folders and the energy subfolders in the path given.
@@ -140,9 +293,140 @@ class DetectorSimulator:
         """
         pathlib.Path(f"{folder}/data/{energy}/").mkdir(parents=True, exist_ok=True)
         pathlib.Path(f"{folder}/temp/{energy}/").mkdir(parents=True, exist_ok=True)
+        pathlib.Path(f"{self.tempFolder(folder)}/temp/{energy}/").mkdir(
+            parents=True, exist_ok=True
+        )
         pathlib.Path(f"{folder}/logs/{energy}/").mkdir(parents=True, exist_ok=True)
         pathlib.Path(f"{folder}/inps/{energy}/").mkdir(parents=True, exist_ok=True)
 
+    def tempFolder(self, folder):
+        """
+        Returns the folder in which the temp folder is located.
+        Without scratchDir it is the folder itself,
+        otherwise the same path relative to the outDirectory inside the scratchDir.
+        """
+        if not self.scratchDir:
+            return folder
+        return f"{self.scratchDir}/{os.path.relpath(folder, self.outDirectory)}"
+
+    def moveCommand(self, tempFile, dataFile):
+        """
+        Returns the command that moves the temp file to the data file at the end of the script.
+        With a StageOut the move is registered with the data file as key
+        and done in the background once the script is completed, thus no command is returned.
+        """
+        self.tempFiles[dataFile] = tempFile
+        if self.stageOut is None:
+            return f"mv {tempFile} {dataFile}"
+        self.stageOut.register(dataFile, tempFile, dataFile)
+        return ""
+
+    def extension(self, stage):
+        """
+        Returns the extension of the output files of the stage according to its codec
+        """
+        return self.CODECS[self.outputCodecs.get(stage, "bz2")]
+
+    def existingOutput(self, dataFile):
+        """
+        Returns the data file if it already exists, written with any codec
+        (e.g. by a previous submission with other outputCodecs), None if it does not exist.
+        Thus, the existing file is used as input of the next stage instead of simulating it again.
+        """
+        if os.path.isfile(dataFile):
+            return dataFile
+        for extension in self.CODECS.values():
+            if dataFile.endswith(extension):
+                name = dataFile[: -len(extension)]
+                break
+        else:
+            return None
+        for extension in self.CODECS.values():
+            if os.path.isfile(f"{name}{extension}"):
+                return f"{name}{extension}"
+        return None
+
+    def discardOutput(self, dataFile):
+        """
+        Records that the script writing the data file was killed (e.g. at the end of the allocation or by its timeout)
+        or given up, thus its temp file and its decompressed input are removed by removeTempFiles.
+        It can be given as interrupt callback to the Submitter through the key of the data file.
+        """
+        self.discardedFiles.add(dataFile)
+
+    def removeTempFiles(self):
+        """
+        Removes the temp files of the scripts that were killed before their end or given up (see discardOutput),
+        thus no partial file is left in the temp (or scratch) folders.
+        The temp files of the completed scripts are not touched, they were already moved to their data files.
+        It MUST be called once no script is running anymore and the StageOut is closed.
+        """
+        for dataFile in self.discardedFiles:
+            for fileName, description in [
+                (self.tempFiles.get(dataFile), "temp file"),
+                (self.decodedFiles.get(dataFile), "decompressed input"),
+            ]:
+                if fileName is None:
+                    continue
+                try:
+                    os.remove(fileName)
+                    print(f"Removed the {description} {fileName}")
+                except FileNotFoundError:
+                    # Not written yet or already removed by the exeFile
+                    pass
+        self.discardedFiles = set()
+
+    def decompressor(self):
+        """
+        Returns the command that decompresses a bz2 file to the stdout.
+        lbzip2 decompresses any bz2 file with several threads, pbzip2 only the ones compressed by pbzip2,
+        bzip2 (single thread) is used if none of them is available.
+        """
+        if shutil.which("lbzip2"):
+            return f"lbzip2 -dc -n {self.decodeThreads}"
+        if shutil.which("pbzip2"):
+            return f"pbzip2 -dc -p{self.decodeThreads}"
+        return "bzip2 -dc"
+
+    def decodeCommands(self, inputFile, energy, dataFile):
+        """
+        Returns the commands that decompress the bz2 input file for the python script.
+        The decompressed file is written in node-local space (the scratchDir or $TMPDIR) and it is removed
+        when the exeFile exits, also if the script failed (trap). With inputDecoding fifo it is a named pipe,
+        thus the script starts reading while the file is decompressed and no uncompressed copy is written.
+        Then the exeFile fails if the decompression failed, also if the script succeeded, before its output is moved.
+        ----------------------------------------------------------------
+        Parameters:
+            inputFile: the bz2 file
+            energy: the energy in log10 E/GeV
+            dataFile: the data file written by the script (see removeTempFiles)
+        Return:
+            cmdSTART: the commands to be executed before the python script
+            cmdCheck: the command to be executed after the python script, before its output is moved
+            decodedFile: the file to be read by the python script
+        """
+        decodeDir = f"{self.scratchDir or tempfile.gettempdir()}/inputs/{energy}"
+        pathlib.Path(decodeDir).mkdir(parents=True, exist_ok=True)
+        name, _, __ = os.path.basename(inputFile).partition(".bz2")
+        decodedFile = f"{decodeDir}/{name}"
+        self.decodedFiles[dataFile] = decodedFile
+
+        if self.inputDecoding == "fifo":
+            cmdSTART = (
+                f"rm -f {decodedFile} && mkfifo {decodedFile}\n"
+                + f"{self.decompressor()} {inputFile} > {decodedFile} &\n"
+                + "decoder=$!\n"
+                + f"trap 'kill $decoder 2> /dev/null || true; rm -f {decodedFile}' EXIT\n"
+            )
+            cmdCheck = "wait $decoder\n"
+        else:
+            cmdSTART = (
+                f"trap 'rm -f {decodedFile}' EXIT\n"
+                + f"{self.decompressor()} {inputFile} > {decodedFile}\n"
+            )
+            cmdCheck = ""
+        return cmdSTART, cmdCheck, decodedFile
+
     def get_radius(self, logE):
         """
         According to the IC standard simulations,
@@ -197,10 +481,10 @@ class DetectorSimulator:
         )
 
         ITSGdataFile = (
-            f"{outputFolder}/data/{energy}/{runname}.i3.bz2"  # Path and File name
+            f"{outputFolder}/data/{energy}/{runname}{self.extension('ITSG')}"  # Path and File name
         )
         tempFile = (
-            f"{outputFolder}/temp/{energy}/{runname}.i3.bz2"  # Path and File name
+            f"{self.tempFolder(outputFolder)}/temp/{energy}/{runname}{self.extension('ITSG')}"  # Path and File name
         )
         logsFile = (
             f"{outputFolder}/logs/{energy}/{runname}"  # ERR and OUT file destination
@@ -208,21 +492,19 @@ class DetectorSimulator:
         exeFile = f"{outputFolder}/inps/{energy}/{runname}.sh"  # Path where the input file needs to be written
 
         # Checks if the file already exist, in case so it returns None
-        if os.path.isfile(ITSGdataFile):
-            return None, ITSGdataFile
+        existingFile = self.existingOutput(ITSGdataFile)
+        if existingFile:
+            return None, existingFile
 
         # this function makes the data, temp, logs, inps directory
         self.make_folders(outputFolder, energy)
 
-        # TODO never checked if the untar of the bz2 file works
         if inputFile.endswith(".bz2"):
-            baseName = os.path.basename(inputFile)
-            name, _, __ = baseName.partition(".bz2")
-            pathTemp = f"{outputFolder}/temp/{energy}/"
-            cmdSTART = f"\nbzip2 -dc {inputFile} > {pathTemp}{name} \n"
-            inputFile = f"{pathTemp}/{name}"
+            cmdSTART, cmdCheck, inputFile = self.decodeCommands(
+                inputFile, energy, ITSGdataFile
+            )
         else:
-            cmdSTART = "\n"
+            cmdSTART, cmdCheck = "\n", ""
 
         # The python script that needs to be executed with its arguments
         cmdPython = f"{self.pythonPath} {self.i3build}/simprod-scripts/resources/scripts/icetopshowergenerator.py "
@@ -240,17 +522,22 @@ class DetectorSimulator:
             --y 0 \
             --no-PropagateMuons \
             --inputfilelist {inputFile} \
-            --outputfile {tempFile} > {logsFile}.out 2> {logsFile}.err \
+            --outputfile {tempFile} \
             "
         if extraOptions:
             cmdOptions += extraOptions
 
         # moves the file to its final location once everything is done
-        cmdMoveFile = f"mv {tempFile} {ITSGdataFile}"
+        cmdMoveFile = cmdCheck + self.moveCommand(tempFile, ITSGdataFile)
 
         # writes the sh file and makes it executable
         self.writeSHexeFile(
-            exeFile, cmdPython, cmdOptions, cmdMoveFile, cmdSTART=cmdSTART
+            exeFile,
+            cmdPython,
+            cmdOptions,
+            cmdMoveFile,
+            cmdSTART=cmdSTART,
+            logsFile=logsFile,
         )
 
         return exeFile, ITSGdataFile
@@ -270,10 +557,10 @@ class DetectorSimulator:
         outputFolder += f"/Corsika_{self.detector}_corsika_icetop.{self.MCdataset}/"
 
         CorsikaFile = (
-            f"{outputFolder}/data/{energy}/{runname}.i3.bz2"  # Path and File name
+            f"{outputFolder}/data/{energy}/{runname}{self.extension('CorsikaBg')}"  # Path and File name
         )
         tempFile = (
-            f"{outputFolder}/temp/{energy}/{runname}.i3.bz2"  # Path and File name
+            f"{self.tempFolder(outputFolder)}/temp/{energy}/{runname}{self.extension('CorsikaBg')}"  # Path and File name
         )
         logsFile = (
             f"{outputFolder}/logs/{energy}/{runname}"  # ERR and OUT file destination
@@ -281,8 +568,9 @@ class DetectorSimulator:
         exeFile = f"{outputFolder}/inps/{energy}/{runname}.sh"  # Path where the input file needs to be written
 
         # Checks if the file already exist, in case so it returns None
-        if os.path.isfile(CorsikaFile):
-            return None, CorsikaFile
+        existingFile = self.existingOutput(CorsikaFile)
+        if existingFile:
+            return None, existingFile
 
         # this function makes the data, temp, logs, inps directory
         self.make_folders(outputFolder, energy)
@@ -314,14 +602,14 @@ class DetectorSimulator:
             --seed {self.seed * nproc + procnum} \
             --LegacyOverSampling \
             --UseGSLRNG \
-            --outputfile {tempFile} > {logsFile}.out 2> {logsFile}.err \
+            --outputfile {tempFile} \
             "
         #  --outputfile {tempFile} \
         # --summaryfile bgsummary.xml \
         # --no-RunCorsika \
         # 500
         # moves the file to its final location once everything is done
-        cmdMoveFile = f"mv {tempFile} {CorsikaFile}"
+        cmdMoveFile = self.moveCommand(tempFile, CorsikaFile)
 
         # writes the sh file and makes it executable
         self.writeSHexeFile(
@@ -329,6 +617,7 @@ class DetectorSimulator:
             cmdPython,
             cmdOptions,
             cmdMoveFile,
+            logsFile=logsFile,
         )
 
         return exeFile, CorsikaFile
@@ -368,17 +657,18 @@ class DetectorSimulator:
         outputFolder += f"/Polyplopia_{self.detector}_corsika_icetop.{self.MCdataset}/"
 
         polyplopiaDataFile = (
-            f"{outputFolder}/data/{energy}/{runname}.i3.bz2"  # Path to File name
+            f"{outputFolder}/data/{energy}/{runname}{self.extension('polyplopia')}"  # Path to File name
         )
-        tempFile = f"{outputFolder}/temp/{energy}/{runname}.i3.bz2"  # Path to the temp file name
+        tempFile = f"{self.tempFolder(outputFolder)}/temp/{energy}/{runname}{self.extension('polyplopia')}"  # Path to the temp file name
         logsFile = (
             f"{outputFolder}/logs/{energy}/{runname}"  # ERR and OUT file destination
         )
         exeFile = f"{outputFolder}/inps/{energy}/{runname}.sh"  # Path where the input file needs to be written
 
         # Checks if the file already exist, in case so it returns None
-        if os.path.isfile(polyplopiaDataFile):
-            return None, polyplopiaDataFile
+        existingFile = self.existingOutput(polyplopiaDataFile)
+        if existingFile:
+            return None, existingFile
 
         # this function makes the data, temp, logs, inps directory
         self.make_folders(outputFolder, energy)
@@ -394,16 +684,18 @@ class DetectorSimulator:
             --TimeWindow {TimeWindow} \
             --log-level {log_level} \
             --infile {inputFile} \
-            --outfile {tempFile} > {logsFile}.out 2> {logsFile}.err \
+            --outfile {tempFile} \
             "
         if extraOptions:
             cmdOptions += extraOptions
 
         # moves the file to its final location once everything is done
-        cmdMoveFile = f"mv {tempFile} {polyplopiaDataFile}"
+        cmdMoveFile = self.moveCommand(tempFile, polyplopiaDataFile)
 
         # writes the sh file and makes it executable
-        self.writeSHexeFile(exeFile, cmdPython, cmdOptions, cmdMoveFile)
+        self.writeSHexeFile(
+            exeFile, cmdPython, cmdOptions, cmdMoveFile, logsFile=logsFile
+        )
 
         return exeFile, polyplopiaDataFile
 
@@ -450,10 +742,10 @@ class DetectorSimulator:
         outputFolder += f"/CLS_{self.detector}_corsika_icetop.{self.MCdataset}/"
 
         CLSdataFile = (
-            f"{outputFolder}/data/{energy}/{runname}.i3.bz2"  # Path and File name
+            f"{outputFolder}/data/{energy}/{runname}{self.extension('clsim')}"  # Path and File name
         )
         tempFile = (
-            f"{outputFolder}/temp/{energy}/{runname}.i3.bz2"  # Path and File name
+            f"{self.tempFolder(outputFolder)}/temp/{energy}/{runname}{self.extension('clsim')}"  # Path and File name
         )
         logsFile = (
             f"{outputFolder}/logs/{energy}/{runname}"  # ERR and OUT file destination
@@ -461,8 +753,9 @@ class DetectorSimulator:
         exeFile = f"{outputFolder}/inps/{energy}/{runname}.sh"  # Path where the input file needs to be written
 
         # Checks if the file already exist, in case so it returns None
-        if os.path.isfile(CLSdataFile):
-            return None, CLSdataFile
+        existingFile = self.existingOutput(CLSdataFile)
+        if existingFile:
+            return None, existingFile
 
         self.make_folders(outputFolder, energy)
 
@@ -480,7 +773,7 @@ class DetectorSimulator:
             --efficiency {efficiency} \
             --procnum {procnum} \
             --inputfilelist {inputFile} \
-            --outputfile {tempFile} > {logsFile}.out 2> {logsFile}.err \
+            --outputfile {tempFile} \
             "
         # --runmphitfilter \
         # --PropagateMuons \
@@ -491,9 +784,11 @@ class DetectorSimulator:
         if extraOptions:
             cmdOptions += extraOptions
 
-        cmdMoveFile = f"mv {tempFile} {CLSdataFile}"
+        cmdMoveFile = self.moveCommand(tempFile, CLSdataFile)
 
-        self.writeSHexeFile(exeFile, cmdPython, cmdOptions, cmdMoveFile)
+        self.writeSHexeFile(
+            exeFile, cmdPython, cmdOptions, cmdMoveFile, logsFile=logsFile
+        )
 
         return exeFile, CLSdataFile
 
@@ -537,10 +832,10 @@ class DetectorSimulator:
         outputFolder += f"/Detector_{self.detector}_corsika_icetop.{self.MCdataset}/"
 
         DETdataFile = (
-            f"{outputFolder}/data/{energy}/{runname}.i3.bz2"  # Path and File name
+            f"{outputFolder}/data/{energy}/{runname}{self.extension('detector')}"  # Path and File name
         )
         tempFile = (
-            f"{outputFolder}/temp/{energy}/{runname}.i3.bz2"  # Path and File name
+            f"{self.tempFolder(outputFolder)}/temp/{energy}/{runname}{self.extension('detector')}"  # Path and File name
         )
         logsFile = (
             f"{outputFolder}/logs/{energy}/{runname}"  # ERR and OUT file destination
@@ -548,8 +843,9 @@ class DetectorSimulator:
         exeFile = f"{outputFolder}/inps/{energy}/{runname}.sh"  # Path where the input file needs to be written
 
         # Checks if the file already exist, in case so it returns None
-        if os.path.isfile(DETdataFile):
-            return None, DETdataFile
+        existingFile = self.existingOutput(DETdataFile)
+        if existingFile:
+            return None, existingFile
 
         self.make_folders(outputFolder, energy)
 
@@ -569,7 +865,7 @@ class DetectorSimulator:
             --RunID {runID} \
             --procnum {procnum} \
             --inputfile {inputFile} \
-            --outputfile {tempFile} > {logsFile}.out 2> {logsFile}.err \
+            --outputfile {tempFile} \
             "
         if not doFiltering:
             cmdOptions += "--no-FilterTrigger "
@@ -580,9 +876,11 @@ class DetectorSimulator:
         if extraOptions:
             cmdOptions += extraOptions
 
-        cmdMoveFile = f"mv {tempFile} {DETdataFile}"
+        cmdMoveFile = self.moveCommand(tempFile, DETdataFile)
 
-        self.writeSHexeFile(exeFile, cmdPython, cmdOptions, cmdMoveFile)
+        self.writeSHexeFile(
+            exeFile, cmdPython, cmdOptions, cmdMoveFile, logsFile=logsFile
+        )
 
         # Execute DET via submitter
         return exeFile, DETdataFile
@@ -614,10 +912,10 @@ class DetectorSimulator:
         outputFolder += f"/Level1_{self.detector}_corsika_icetop.{self.MCdataset}/"
 
         LV1dataFile = (
-            f"{outputFolder}/data/{energy}/{runname}.i3.bz2"  # Path and File name
+            f"{outputFolder}/data/{energy}/{runname}{self.extension('lv1')}"  # Path and File name
         )
         tempFile = (
-            f"{outputFolder}/temp/{energy}/{runname}.i3.bz2"  # Path and File name
+            f"{self.tempFolder(outputFolder)}/temp/{energy}/{runname}{self.extension('lv1')}"  # Path and File name
         )
         logsFile = (
             f"{outputFolder}/logs/{energy}/{runname}"  # ERR and OUT file destination
@@ -626,8 +924,9 @@ class DetectorSimulator:
 
         # Checks if the file already exist, if so it there is no need to redo it.
         # It will return None and the file, which will be used as input for the next process
-        if os.path.isfile(LV1dataFile):
-            return None, LV1dataFile
+        existingFile = self.existingOutput(LV1dataFile)
+        if existingFile:
+            return None, existingFile
 
         self.make_folders(outputFolder, energy)
 
@@ -639,7 +938,7 @@ class DetectorSimulator:
             --MinBiasPrescale {MiniBiasPrescale} \
             -g {self.GCD} \
             -i {DETFile} \
-            -o {tempFile} > {logsFile}.out 2> {logsFile}.err \
+            -o {tempFile} \
             "
 
         if self.NumbFrames:
@@ -648,9 +947,11 @@ class DetectorSimulator:
         if extraOptions:
             cmdOptions += extraOptions
 
-        cmdMoveFile = f"mv {tempFile} {LV1dataFile}"
+        cmdMoveFile = self.moveCommand(tempFile, LV1dataFile)
 
-        self.writeSHexeFile(exeFile, cmdPython, cmdOptions, cmdMoveFile)
+        self.writeSHexeFile(
+            exeFile, cmdPython, cmdOptions, cmdMoveFile, logsFile=logsFile
+        )
 
         # Execute LV1 via submitter
         return exeFile, LV1dataFile
@@ -681,10 +982,10 @@ class DetectorSimulator:
         outputFolder += f"/Level2_{self.detector}_corsika_icetop.{self.MCdataset}/"
 
         LV2dataFile = (
-            f"{outputFolder}/data/{energy}/{runname}.i3.bz2"  # Path and File name
+            f"{outputFolder}/data/{energy}/{runname}{self.extension('lv2')}"  # Path and File name
         )
         tempFile = (
-            f"{outputFolder}/temp/{energy}/{runname}.i3.bz2"  # Path and File name
+            f"{self.tempFolder(outputFolder)}/temp/{energy}/{runname}{self.extension('lv2')}"  # Path and File name
         )
         logsFile = (
             f"{outputFolder}/logs/{energy}/{runname}"  # ERR and OUT file destination
@@ -693,8 +994,9 @@ class DetectorSimulator:
 
         # Checks if the file already exist, if so it there is no need to redo it.
         # It will return None and the file, which will be used as input for the next process
-        if os.path.isfile(LV2dataFile):
-            return None, LV2dataFile
+        existingFile = self.existingOutput(LV2dataFile)
+        if existingFile:
+            return None, existingFile
 
         self.make_folders(outputFolder, energy)
         cmdPython = f"{self.pythonPath} {self.i3build}/filterscripts/resources/scripts/offlineL2/process.py "
@@ -704,7 +1006,7 @@ class DetectorSimulator:
             -g {self.GCD} \
             -s \
             -i {LV1File} \
-            -o {tempFile} > {logsFile}.out 2> {logsFile}.err \
+            -o {tempFile} \
             "
         # --simulation \???
 
@@ -714,9 +1016,11 @@ class DetectorSimulator:
         if extraOptions:
             cmdOptions += extraOptions
 
-        cmdMoveFile = f"mv {tempFile} {LV2dataFile}"
+        cmdMoveFile = self.moveCommand(tempFile, LV2dataFile)
 
-        self.writeSHexeFile(exeFile, cmdPython, cmdOptions, cmdMoveFile)
+        self.writeSHexeFile(
+            exeFile, cmdPython, cmdOptions, cmdMoveFile, logsFile=logsFile
+        )
 
         # Execute LV2 via submitter
         return exeFile, LV2dataFile
@@ -754,10 +1058,10 @@ class DetectorSimulator:
         outputFolder += f"/Level3_Lv3_{self.detector}_{self.dataset}_Run/"
 
         LV3dataFile = (
-            f"{outputFolder}/data/{energy}/{runname}.i3.bz2"  # Path and File name
+            f"{outputFolder}/data/{energy}/{runname}{self.extension('lv3')}"  # Path and File name
         )
         tempFile = (
-            f"{outputFolder}/temp/{energy}/{runname}.i3.bz2"  # Path and File name
+            f"{self.tempFolder(outputFolder)}/temp/{energy}/{runname}{self.extension('lv3')}"  # Path and File name
         )
         logsFile = (
             f"{outputFolder}/logs/{energy}/{runname}"  # ERR and OUT file destination
@@ -766,8 +1070,9 @@ class DetectorSimulator:
 
         # Checks if the file already exist, if so it there is no need to redo it.
         # It will return None and the file, which will be used as input for the next process
-        if os.path.isfile(LV3dataFile):
-            return None, LV3dataFile
+        existingFile = self.existingOutput(LV3dataFile)
+        if existingFile:
+            return None, existingFile
 
         self.make_folders(outputFolder, energy)
 
@@ -781,7 +1086,7 @@ class DetectorSimulator:
             --print-usage \
             --dataset {self.dataset} \
             --run {runID} \
-            -o {tempFile} > {logsFile}.out 2> {logsFile}.err \
+            -o {tempFile} \
             {self.GCD} {LV2File} \
             "
         # --domeff {domeff} \ #TODO Why no domeff?
@@ -796,9 +1101,11 @@ class DetectorSimulator:
         if extraOptions:
             cmdOptions += extraOptions
 
-        cmdMoveFile = f"mv {tempFile} {LV3dataFile}"
+        cmdMoveFile = self.moveCommand(tempFile, LV3dataFile)
 
-        self.writeSHexeFile(exeFile, cmdPython, cmdOptions, cmdMoveFile)
+        self.writeSHexeFile(
+            exeFile, cmdPython, cmdOptions, cmdMoveFile, logsFile=logsFile
+        )
 
         # Execute LV3 via submitter
         return exeFile, LV3dataFile
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+This class can be used to classify why a job failed from its exit code and the tail of its log files.
+Transient failures (e.g. an LSDF/Lustre hiccup) can be retried automatically,
+permanent ones (e.g. a missing input or a crash of the simulation) are written to a dead-letter list,
+which can be checked once the submission is over.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import json
+import os
+import re
+import signal
+import time
+
+
+class FailureClassifier:
+    """
+    Classification of the failed jobs.
+        filesystem:   I/O errors of the shared filesystem (stale handles, disconnected mounts, timeouts)
+        oom:          the job was killed because it ran out of memory
+        missingInput: an input file (e.g. the corsika file or the GCD) does not exist
+        crash:        the simulation itself failed (segmentation fault, abort, python exception)
+        unknown:      none of the above
+
+    Parameters:
+        retryClasses: the classes that are retried (default filesystem)
+        tailBytes: the number of bytes read from the end of every log file (default 65536)
+    """
+
+    classes = ["filesystem", "oom", "missingInput", "crash", "unknown"]
+    # The patterns are checked in this order, the first class that matches is taken
+    patterns = [
+        (
+            "oom",
+            re.compile(
+                rb"MemoryError|std::bad_alloc|Out of memory|oom-kill|Cannot allocate memory",
+                re.IGNORECASE,
+            ),
+        ),
+        (
+            "filesystem",
+            re.compile(
+                rb"Input/output error|Stale file handle|Transport endpoint is not connected"
+                rb"|Resource temporarily unavailable|Connection timed out|Communication error on send"
+                rb"|Remote I/O error|No space left on device|Disk quota exceeded|Too many open files",
+                re.IGNORECASE,
+            ),
+        ),
+        (
+            "missingInput",
+            re.compile(
+                rb"No such file or directory|FileNotFoundError|does not exist|cannot open file",
+                re.IGNORECASE,
+            ),
+        ),
+        (
+            "crash",
+            re.compile(
+                rb"Segmentation fault|Traceback \(most recent call last\)|Aborted|core dumped"
+                rb"|Floating point exception|FATAL|ERROR",
+            ),
+        ),
+    ]
+
+    def __init__(self, retryClasses=["filesystem"], tailBytes=65536):
+        for failureClass in retryClasses:
+            if failureClass not in self.classes:
+                raise ValueError(
+                    f"Unknown failure class {failureClass}, use one of {self.classes}"
+                )
+        self.retryClasses = set(retryClasses)
+        self.tailBytes = tailBytes
+
+    def readTail(self, logFile):
+        """
+        Returns the last tailBytes of the log file (empty if it does not exist)
+        """
+        try:
+            with open(logFile, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - self.tailBytes))
+                return f.read()
+        except OSError:
+            return b""
+
+    def classify(self, returncode, logFiles):
+        """
+        Returns the class of the failure.
+
+        Parameters:
+            returncode: the exit code of the job (negative if it was killed by a signal)
+            logFiles: the log files whose tails are searched (e.g. the .err and .out files of the job)
+        """
+        tails = [self.readTail(logFile) for logFile in logFiles]
+        for failureClass, pattern in self.patterns:
+            if any(pattern.search(tail) for tail in tails):
+                return failureClass
+        # SIGKILL without any message is usually the OOM killer, the shell reports it as 128 + 9
+        if returncode in (-signal.SIGKILL, 128 + signal.SIGKILL):
+            return "oom"
+        if returncode in (-signal.SIGSEGV, 128 + signal.SIGSEGV):
+            return "crash"
+        return "unknown"
+
+    def isTransient(self, failureClass):
+        """
+        Checks if the failures of the class are retried
+        """
+        return failureClass in self.retryClasses
+
+    @staticmethod
+    def lastLine(logFiles):
+        """
+        Returns the last non-empty line of the first log file that has one, as a short reason of the failure
+        """
+        for logFile in logFiles:
+            try:
+                with open(logFile, "rb") as f:
+                    f.seek(0, os.SEEK_END)
+                    f.seek(max(0, f.tell() - 4096))
+                    lines = [line for line in f.read().splitlines() if line.strip()]
+            except OSError:
+                continue
+            if lines:
+                return lines[-1].decode(errors="replace").strip()
+        return ""
+
+    @staticmethod
+    def addDeadLetter(deadLetterFile, key, returncode, failureClass, reason):
+        """
+        Appends a permanently failed job to the dead-letter list (one json object per line)
+        """
+        with open(deadLetterFile, "a") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "key": key,
+                        "exitCode": returncode,
+                        "failureClass": failureClass,
+                        "reason": reason,
+                        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    }
+                )
+                + "\n"
+            )
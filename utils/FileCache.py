@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+This class can be used to keep node-local copies of the read-only inputs shared by all jobs
+(e.g. the GCD file and a few photon tables), which are otherwise read by every job from CVMFS or LSDF.
+Of a directory only the given files are cached (e.g. the splines used by the scripts, not the whole photon-tables tree).
+The first job of the node fills the cache, all others (also of later campaigns) use the local copy.
+
+The cache is content addressed:
+    objects/<sha256>            the content of every file, stored once
+    views/<sha256>/...          the source as the scripts expect it (same file names),
+                                made of hard links to the objects
+    index.json                  the sources, their views and when they were last used
+A source is copied again only if its size or modification time changed.
+Every copy is verified: the sha256 of the source (computed while copying) must match the one of the copy.
+When the cache is larger than its maximum size, the views least recently used are removed (LRU)
+together with the objects that are not used by any other view.
+All processes of the node share the cache, the index and the copies are protected by a lock (flock).
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import time
+
+
+class FileCache:
+    """
+    Node-local content-addressed cache of read-only files and directories.
+
+    Parameters:
+        cacheDir: the node-local directory of the cache (e.g. /dev/shm/cache or $TMPDIR/cache)
+        maxBytes: the maximum size of the cache in bytes. Larger sources are not cached (default 20 GB)
+        keepSeconds: views used more recently are never removed, thus the files of running jobs stay (default 1 day)
+    """
+
+    def __init__(self, cacheDir, maxBytes=20 * 1024**3, keepSeconds=86400):
+        self.cacheDir = os.path.abspath(cacheDir)
+        self.maxBytes = maxBytes
+        self.keepSeconds = keepSeconds
+        self.objectDir = f"{self.cacheDir}/objects"
+        self.viewDir = f"{self.cacheDir}/views"
+        self.indexFile = f"{self.cacheDir}/index.json"
+        pathlib.Path(self.objectDir).mkdir(parents=True, exist_ok=True)
+        pathlib.Path(self.viewDir).mkdir(parents=True, exist_ok=True)
+
+    @contextlib.contextmanager
+    def locked(self):
+        """
+        Holds the lock of the cache (shared by all processes of the node) and yields its index,
+        which is written back once the block is over
+        """
+        with open(f"{self.cacheDir}/.lock", "w") as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            index = {"sources": {}, "views": {}}
+            if os.path.isfile(self.indexFile):
+                with open(self.indexFile) as f:
+                    index = json.load(f)
+            yield index
+            with open(f"{self.indexFile}.tmp", "w") as f:
+                json.dump(index, f, indent=1)
+            os.replace(f"{self.indexFile}.tmp", self.indexFile)
+
+    @staticmethod
+    def listFiles(source, relativePaths=None):
+        """
+        Returns the (relative path, size, modification time) of every file of the source,
+        a single entry with the file name if the source is a file.
+        If relativePaths is given, only these files of the source directory are returned (the others are not listed)
+        """
+        if os.path.isfile(source):
+            st = os.stat(source)
+            return [(os.path.basename(source), st.st_size, st.st_mtime)]
+        files = []
+        if relativePaths is not None:
+            for relativePath in relativePaths:
+                st = os.stat(os.path.join(source, relativePath))
+                files.append((os.path.normpath(relativePath), st.st_size, st.st_mtime))
+            return sorted(files)
+        for root, _, fileNames in os.walk(source, followlinks=True):
+            for fileName in fileNames:
+                path = os.path.join(root, fileName)
+                st = os.stat(path)
+                files.append((os.path.relpath(path, source), st.st_size, st.st_mtime))
+        return sorted(files)
+
+    def get(self, source, relativePaths=None):
+        """
+        Returns the path of the cached copy of the source (file or directory), filling the cache if needed.
+        The source itself is returned if it does not exist, if one of the relativePaths does not exist
+        or if it is larger than the cache.
+        The trailing slash of a directory is kept, since the scripts may append the file names to it.
+
+        Parameters:
+            source: the file or directory to be cached
+            relativePaths: the files of the source directory to be cached, the view only holds them
+                           (default None, all files of the directory)
+        """
+        trailingSlash = "/" if source.endswith("/") else ""
+        source = os.path.abspath(source)
+        if not os.path.exists(source):
+            return source + trailingSlash
+        try:
+            files = self.listFiles(source, relativePaths)
+        except FileNotFoundError as error:
+            print(f"{source} is not cached: {error}")
+            return source + trailingSlash
+        size = sum(fileSize for _, fileSize, _ in files)
+        if size > self.maxBytes:
+            print(f"{source} ({size / 1024**3:.1f} GB) is larger than the cache, it is not cached")
+            return source + trailingSlash
+        signature = hashlib.sha256(json.dumps(files).encode()).hexdigest()
+
+        # The same directory with other files is another source of the cache
+        sourceKey = source
+        if (relativePaths is not None) and os.path.isdir(source):
+            sourceKey += ":" + ",".join(relativePath for relativePath, _, _ in files)
+
+        with self.locked() as index:
+            entry = index["sources"].get(sourceKey)
+            if (
+                (entry is not None)
+                and (entry["signature"] == signature)
+                and os.path.isdir(f"{self.viewDir}/{entry['view']}")
+            ):
+                view = entry["view"]
+            else:
+                print(f"Caching {source} in {self.cacheDir}")
+                self.evict(index, size)
+                view = self.fill(source, files)
+                index["views"][view] = {"size": size}
+                index["sources"][sourceKey] = {"signature": signature, "view": view}
+            index["views"][view]["lastUsed"] = time.time()
+
+        if os.path.isfile(source):
+            return f"{self.viewDir}/{view}/{os.path.basename(source)}"
+        return f"{self.viewDir}/{view}{trailingSlash}"
+
+    def fill(self, source, files):
+        """
+        Copies the files of the source into the objects (the ones already there are not copied again)
+        and links them in its view.
+
+        Returns:
+            view: the name of the view, the sha256 of the relative paths and digests of its files
+        """
+        isFile = os.path.isfile(source)
+        manifest = []
+        for relativePath, _, _ in files:
+            path = source if isFile else os.path.join(source, relativePath)
+            manifest.append((relativePath, self.storeObject(path)))
+        view = hashlib.sha256(json.dumps(manifest).encode()).hexdigest()
+
+        viewPath = f"{self.viewDir}/{view}"
+        if not os.path.isdir(viewPath):
+            tempView = f"{viewPath}.tmp{os.getpid()}"
+            for relativePath, digest in manifest:
+                linkPath = f"{tempView}/{relativePath}"
+                pathlib.Path(os.path.dirname(linkPath)).mkdir(parents=True, exist_ok=True)
+                os.link(f"{self.objectDir}/{digest}", linkPath)
+            os.rename(tempView, viewPath)
+        return view
+
+    def storeObject(self, path):
+        """
+        Copies the file into the objects while computing its sha256,
+        the copy is verified by computing the sha256 of the copy again.
+
+        Returns:
+            digest: the sha256 of the file
+        """
+        tempObject = f"{self.objectDir}/tmp{os.getpid()}"
+        sourceHash = hashlib.sha256()
+        with open(path, "rb") as src, open(tempObject, "wb") as dst:
+            for block in iter(lambda: src.read(1024**2), b""):
+                sourceHash.update(block)
+                dst.write(block)
+        digest = sourceHash.hexdigest()
+        if self.checksum(tempObject) != digest:
+            os.remove(tempObject)
+            raise OSError(f"The copy of {path} in the cache does not match its checksum")
+
+        objectPath = f"{self.objectDir}/{digest}"
+        if os.path.isfile(objectPath):
+            # Same content already cached (e.g. from another source)
+            os.remove(tempObject)
+        else:
+            os.chmod(tempObject, 0o444)
+            os.rename(tempObject, objectPath)
+        return digest
+
+    @staticmethod
+    def checksum(path):
+        """
+        Returns the sha256 of the file
+        """
+        fileHash = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024**2), b""):
+                fileHash.update(block)
+        return fileHash.hexdigest()
+
+    def evict(self, index, neededBytes):
+        """
+        Removes the views least recently used (not used within keepSeconds)
+        until neededBytes fit in the cache, then the objects not linked by any view anymore.
+        """
+        usedBytes = sum(view["size"] for view in index["views"].values())
+        for view, entry in sorted(
+            index["views"].items(), key=lambda item: item[1].get("lastUsed", 0)
+        ):
+            if usedBytes + neededBytes <= self.maxBytes:
+                break
+            if time.time() - entry.get("lastUsed", 0) < self.keepSeconds:
+                continue
+            print(f"Removing the view {view} from the cache")
+            shutil.rmtree(f"{self.viewDir}/{view}", ignore_errors=True)
+            del index["views"][view]
+            usedBytes -= entry["size"]
+            for source in [
+                source
+                for source, sourceEntry in index["sources"].items()
+                if sourceEntry["view"] == view
+            ]:
+                del index["sources"][source]
+
+        for objectName in os.listdir(self.objectDir):
+            objectPath = f"{self.objectDir}/{objectName}"
+            if objectName.startswith("tmp"):
+                continue
+            if os.stat(objectPath).st_nlink == 1:
+                os.remove(objectPath)
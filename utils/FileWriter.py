@@ -7,6 +7,8 @@ This class can be used to create and write a Corsika inp file and create "data",
 """
 import pathlib
 
+from utils.OutputIndex import OutputIndex
+
 
 class FileWriter:
     """
@@ -23,6 +25,9 @@ class FileWriter:
                  'end': 359.99000000},  # Upper limit of azimuth (do not change unless you know what you are doing)
         zenith ={'start': 0.00000000,   # Lower limit of zenith (do not change unless you know what you are doing)
                  'end': 65.0000000},    # Upper limit of zenith (do not change unless you know what you are doing)
+        showersPerRun=1,                # Number of showers simulated by a single Corsika run (NSHOW)
+        scratchDir=None,                # Node-local directory where Corsika writes its output ($TMPDIR, /dev/shm).
+                                        # If None the temp folder of the simulations directory is used
     """
 
     def __init__(
@@ -41,19 +46,27 @@ class FileWriter:
             "start": 0.00000000,  # Lower limit of zenith (do not change unless you know what you are doing)
             "end": 65.0000000,  # Upper limit of zenith (do not change unless you know what you are doing)
         },
+        showersPerRun=1,  # Number of showers simulated by a single Corsika run (NSHOW)
+        scratchDir=None,  # Node-local directory where Corsika writes its output ($TMPDIR, /dev/shm)
     ):
         self.dataset = dataset
         self.username = username
         self.primary = primary
         self.directories = {"sim": dirSimulations}
         self.primIdDict = primIdDict
+        # The index of the existing output files, shared with the SimulationMaker
+        self.outputIndex = OutputIndex()
 
         self.azimuth = azimuth
         self.zenith = zenith
+        self.showersPerRun = showersPerRun
+        self.scratchDir = scratchDir
 
     def makeFolders(self, log10_E1):
         """
-        Creates "data", "temp", "log", "inp" folders and energy subfolder
+        Creates "data", "temp", "log", "inp" folders and energy subfolder.
+        The "work" folder is where Corsika writes its output (DIRECT),
+        it is the temp folder in the scratch directory if given, otherwise the temp folder itself.
 
         Parameters:
             log10_E1: the log10 of the Energy value for the subfolder creation
@@ -64,12 +77,43 @@ class FileWriter:
             pathlib.Path(f"{self.directories[folder]}/{log10_E1}").mkdir(
                 parents=True, exist_ok=True
             )
+        self.directories["work"] = self.directories["temp"]
+        if self.scratchDir:
+            self.directories["work"] = f"{self.scratchDir}/temp/"
+            pathlib.Path(f"{self.directories['work']}/{log10_E1}").mkdir(
+                parents=True, exist_ok=True
+            )
         return
 
+    def isSimulated(self, runNumber, log10_E1):
+        """
+        Checks if the simulation is already in the data folder.
+        Each data folder is scanned only once (see OutputIndex)
+        """
+        return self.outputIndex.contains(
+            f"{self.directories['data']}/{log10_E1}/", f"DAT{runNumber}"
+        )
+
     def writeFile(self, runNumber, log10_E1, log10_E2):
         """
         Creates and writes a Corsika inp file that can be used as Corsika input
         """
+        sim = f"SIM{runNumber}"
+        # This is the inp file, which gets written into the folder
+        inp_name = f"{self.directories['inp']}/{log10_E1}/{sim}.inp"
+
+        # Opening and writing in the file
+        with open(inp_name, "w") as file:
+            file.write(self.makeCard(runNumber, log10_E1, log10_E2))
+
+    def makeCard(self, runNumber, log10_E1, log10_E2):
+        """
+        Creates the text of a Corsika inp file (the steering card).
+        It can be written into the inp file or given directly to the stdin of Corsika.
+        A run simulates showersPerRun showers, numbered with EVTNR 1, 2, ... showersPerRun
+        in the DAT file of the run. Since the runNumbers of two runs differ by at least showersPerRun,
+        the seeds of the runs stay unique.
+        """
         en1 = 10**log10_E1  # Lower limit of energy in GeV
         en2 = 10**log10_E2  # Upper limit of energy in GeV
 
@@ -82,49 +126,43 @@ class FileWriter:
             (runNumber + self.primIdDict[self.primary] * 1_000_000) % 900_000_001
         )
 
-        sim = f"SIM{runNumber}"
-        # This is the inp file, which gets written into the folder
-        inp_name = f"{self.directories['inp']}/{log10_E1}/{sim}.inp"
-
         seed1 = seedValue  # int(np.random.normal(mu, sigma))#random chosen)  #changed on 28 Jan 2020 according to IC std
         seed2 = seed1 + 1
         seed3 = seed1 + 2
 
-        # Opening and writing in the file
-        with open(inp_name, "w") as file:
-            ####### Things that go into the input files for corsika #######
-            file.write(
-                ""
-                + f"RUNNR   {runNumber}\n"  # Unique run number in the file name of corsika
-                + f"EVTNR   1\n"
-                + f"SEED    {seed1}    0    0\n"  #
-                + f"SEED    {seed2}    0    0\n"  #
-                + f"SEED    {seed3}    0    0\n"  #
-                + f"NSHOW   1\n"
-                + f"ERANGE  {en1:.11E}    {en2:.11E}\n"  # in GeV
-                + f"ESLOPE  -1.0\n"
-                + f"PRMPAR  {self.primary}\n"
-                + f"THETAP  {self.zenith['start']}    {self.zenith['end']}\n"  #
-                + f"PHIP    {self.azimuth['start']} {self.azimuth['end']}\n"  #
-                + f"ECUTS   0.0500 0.0500 0.0100 0.0020\n"
-                + f"ELMFLG  F    T\n"  # Disable NKG since it gets deactivated anyway when CURVED is selected at corsika setup
-                + f"OBSLEV  2840.E2\n"  # changed from 2837 m to 2840 m on 26 Nov 2019
-                + f"ECTMAP  100\n"
-                + f"SIBYLL  T    0\n"  # Keep this only if we are running sibyll
-                + f"SIBSIG  T\n"  # Keep this only if we are running sibyll
-                + f"SIBCHM  T\n"  # Enable charm production with Sibyll
-                + f"ARRANG  -120.7\n"  # Rotates the output from corika to IC coordinates # changed Nov 26 2019
-                + f"HADFLG  0    1    0    1    0    2\n"
-                + f"STEPFC  1.0\n"
-                + f"DEBUG   F    6    F    1000000\n"
-                + f"MUMULT  T\n"
-                + f"MUADDI  T\n"
-                + f"MAXPRT  0\n"
-                + f"MAGNET  16.75       -51.96\n"  # changed on Nov 26 2019
-                + f"LONGI   T   10.     T       T\n"
-                + f"RADNKG  2.E5\n"
-                + f"ATMOD   33\n"  # real atmosphere (April avg. is used here)
-                + f"DIRECT  {self.directories['temp']}/{log10_E1}/\n"
-                + f"USER    {self.username}\n"
-                + f"EXIT\n"
-            )
+        ####### Things that go into the input files for corsika #######
+        return (
+            ""
+            + f"RUNNR   {runNumber}\n"  # Unique run number in the file name of corsika
+            + f"EVTNR   1\n"
+            + f"SEED    {seed1}    0    0\n"  #
+            + f"SEED    {seed2}    0    0\n"  #
+            + f"SEED    {seed3}    0    0\n"  #
+            + f"NSHOW   {self.showersPerRun}\n"
+            + f"ERANGE  {en1:.11E}    {en2:.11E}\n"  # in GeV
+            + f"ESLOPE  -1.0\n"
+            + f"PRMPAR  {self.primary}\n"
+            + f"THETAP  {self.zenith['start']}    {self.zenith['end']}\n"  #
+            + f"PHIP    {self.azimuth['start']} {self.azimuth['end']}\n"  #
+            + f"ECUTS   0.0500 0.0500 0.0100 0.0020\n"
+            + f"ELMFLG  F    T\n"  # Disable NKG since it gets deactivated anyway when CURVED is selected at corsika setup
+            + f"OBSLEV  2840.E2\n"  # changed from 2837 m to 2840 m on 26 Nov 2019
+            + f"ECTMAP  100\n"
+            + f"SIBYLL  T    0\n"  # Keep this only if we are running sibyll
+            + f"SIBSIG  T\n"  # Keep this only if we are running sibyll
+            + f"SIBCHM  T\n"  # Enable charm production with Sibyll
+            + f"ARRANG  -120.7\n"  # Rotates the output from corika to IC coordinates # changed Nov 26 2019
+            + f"HADFLG  0    1    0    1    0    2\n"
+            + f"STEPFC  1.0\n"
+            + f"DEBUG   F    6    F    1000000\n"
+            + f"MUMULT  T\n"
+            + f"MUADDI  T\n"
+            + f"MAXPRT  0\n"
+            + f"MAGNET  16.75       -51.96\n"  # changed on Nov 26 2019
+            + f"LONGI   T   10.     T       T\n"
+            + f"RADNKG  2.E5\n"
+            + f"ATMOD   33\n"  # real atmosphere (April avg. is used here)
+            + f"DIRECT  {self.directories['work']}/{log10_E1}/\n"
+            + f"USER    {self.username}\n"
+            + f"EXIT\n"
+        )
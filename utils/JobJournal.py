@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+"""
+This class can be used to keep a journal of all jobs (planned, running, stagingout, done, failed, interrupted, timedout)
+in a local SQLite database, together with their exit code, timings and output file.
+A resubmitted job can then resume from the journal instead of scanning the shared filesystem.
+The filesystem is only used to verify that the output of a done job still exists.
+The wall time, CPU time and peak memory of every completed job are recorded together with
+its stage, energy bin, primary, number of samples and detector (see RuntimePredictor).
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import os
+import pathlib
+import sqlite3
+import time
+
+
+class JobJournal:
+    """
+    Journal of the jobs stored in a SQLite database in WAL mode.
+    The states of all jobs are read once at the start and kept in memory.
+    Journals written before the accounting columns existed are extended when opened.
+
+    Parameters:
+        journalFile: the SQLite file. It should be on a local disk (not on LSDF/Lustre)
+        verify: if True, a done job is only considered done if its output file exists
+    """
+
+    # The attributes of the job (given to markPlanned) and its accounting (given to markCompleted)
+    accountingColumns = {
+        "stage": "TEXT",
+        "energy": "REAL",
+        "primary_": "INTEGER",
+        "numbSamples": "INTEGER",
+        "detector": "TEXT",
+        "wallTime": "REAL",  # seconds
+        "cpuTime": "REAL",  # seconds, user + system
+        "maxRss": "REAL",  # MB
+        "failureClass": "TEXT",  # see FailureClassifier
+    }
+    attributeNames = ["stage", "energy", "primary", "numbSamples", "detector"]
+
+    def __init__(self, journalFile, verify=True):
+        self.journalFile = journalFile
+        self.verify = verify
+        pathlib.Path(os.path.dirname(os.path.abspath(journalFile))).mkdir(
+            parents=True, exist_ok=True
+        )
+        self.connection = sqlite3.connect(journalFile)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "key TEXT PRIMARY KEY, "
+            "state TEXT, "
+            "outputFile TEXT, "
+            "exitCode INTEGER, "
+            "plannedTime REAL, "
+            "startTime REAL, "
+            "endTime REAL, "
+            "attempts INTEGER DEFAULT 0)"
+        )
+        columns = {
+            column[1] for column in self.connection.execute("PRAGMA table_info(jobs)")
+        }
+        for column, columnType in self.accountingColumns.items():
+            if column not in columns:
+                self.connection.execute(
+                    f"ALTER TABLE jobs ADD COLUMN {column} {columnType}"
+                )
+        self.connection.commit()
+        # key: (state, outputFile) of all jobs in the journal
+        self.jobs = {
+            key: (state, outputFile)
+            for key, state, outputFile in self.connection.execute(
+                "SELECT key, state, outputFile FROM jobs"
+            )
+        }
+
+    def state(self, key):
+        """
+        Returns the state of the job (planned, running, stagingout, done, failed, interrupted, timedout) or None if it is not in the journal
+        """
+        return self.jobs.get(key, (None, None))[0]
+
+    def outputFile(self, key):
+        """
+        Returns the output file of the job or None if it is not known
+        """
+        return self.jobs.get(key, (None, None))[1]
+
+    def isDone(self, key):
+        """
+        Checks if the job is done. If verify is True, its output file MUST also exist
+        """
+        state, outputFile = self.jobs.get(key, (None, None))
+        if state != "done":
+            return False
+        if self.verify and outputFile and not os.path.isfile(outputFile):
+            return False
+        return True
+
+    def markPlanned(self, key, outputFile=None, attributes={}):
+        """
+        Adds the job to the journal (or resets it) with its output file.
+        The attributes (stage, energy, primary, numbSamples, detector) are used by the RuntimePredictor,
+        the ones that are not given are kept.
+        """
+        self.jobs[key] = ("planned", outputFile)
+        values = [attributes.get(name) for name in self.attributeNames]
+        self.connection.execute(
+            "INSERT INTO jobs (key, state, outputFile, plannedTime, "
+            "stage, energy, primary_, numbSamples, detector) "
+            "VALUES (?, 'planned', ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state='planned', "
+            "outputFile=COALESCE(excluded.outputFile, outputFile), plannedTime=excluded.plannedTime, "
+            "stage=COALESCE(excluded.stage, stage), energy=COALESCE(excluded.energy, energy), "
+            "primary_=COALESCE(excluded.primary_, primary_), "
+            "numbSamples=COALESCE(excluded.numbSamples, numbSamples), "
+            "detector=COALESCE(excluded.detector, detector)",
+            (key, outputFile, time.time(), *values),
+        )
+        self.connection.commit()
+
+    def markRunning(self, key):
+        """
+        Marks the job as running and counts the attempt
+        """
+        self.jobs[key] = ("running", self.outputFile(key))
+        self.connection.execute(
+            "INSERT INTO jobs (key, state, startTime, attempts) VALUES (?, 'running', ?, 1) "
+            "ON CONFLICT(key) DO UPDATE SET state='running', "
+            "startTime=excluded.startTime, endTime=NULL, attempts=attempts+1",
+            (key, time.time()),
+        )
+        self.connection.commit()
+
+    def markCompleted(self, key, exitCode, usage=None, failureClass=None, stagingOut=False):
+        """
+        Marks the job as done if the exit code is 0 and its output file exists (if known),
+        otherwise as failed.
+        usage is a dictionary with the wallTime, cpuTime (seconds) and maxRss (MB) of the job (default None, unknown)
+        failureClass is the class of the failure of a failed job (default None, not classified)
+        stagingOut is True if the output file of the job is still being moved (e.g. by the StageOut),
+        then a successful job is marked as stagingout with its accounting, without checking its output file.
+        It is not done, markDone or markFailed set its state once the move is over (default False)
+        """
+        outputFile = self.outputFile(key)
+        state = "done"
+        if exitCode != 0 or (
+            not stagingOut and outputFile and not os.path.isfile(outputFile)
+        ):
+            state = "failed"
+        elif stagingOut:
+            state = "stagingout"
+        self.jobs[key] = (state, outputFile)
+        usage = usage or {}
+        self.connection.execute(
+            "UPDATE jobs SET state=?, exitCode=?, endTime=?, "
+            "wallTime=?, cpuTime=?, maxRss=?, failureClass=? WHERE key=?",
+            (
+                state,
+                exitCode,
+                time.time(),
+                usage.get("wallTime"),
+                usage.get("cpuTime"),
+                usage.get("maxRss"),
+                failureClass,
+                key,
+            ),
+        )
+        self.connection.commit()
+        return state
+
+    def markInterrupted(self, key):
+        """
+        Marks a running job that was killed at the end of the allocation (SIGTERM) as interrupted.
+        It is not done, thus a resubmission starts it again
+        """
+        self.jobs[key] = ("interrupted", self.outputFile(key))
+        self.connection.execute(
+            "UPDATE jobs SET state='interrupted', endTime=? WHERE key=?",
+            (time.time(), key),
+        )
+        self.connection.commit()
+
+    def markTimedOut(self, key, usage=None):
+        """
+        Marks a job that was killed because it exceeded its timeout as timedout, together with its accounting.
+        It is not done, thus a resubmission starts it again
+        """
+        self.jobs[key] = ("timedout", self.outputFile(key))
+        usage = usage or {}
+        self.connection.execute(
+            "UPDATE jobs SET state='timedout', exitCode=NULL, failureClass='timeout', endTime=?, "
+            "wallTime=?, cpuTime=?, maxRss=? WHERE key=?",
+            (
+                time.time(),
+                usage.get("wallTime"),
+                usage.get("cpuTime"),
+                usage.get("maxRss"),
+                key,
+            ),
+        )
+        self.connection.commit()
+
+    def markFailed(self, key, failureClass=None):
+        """
+        Marks a job whose process succeeded as failed, e.g. because its output file could not be moved
+        to the data directory. Its exit code and accounting are kept, a resubmission starts it again
+        """
+        self.jobs[key] = ("failed", self.outputFile(key))
+        self.connection.execute(
+            "UPDATE jobs SET state='failed', failureClass=? WHERE key=?",
+            (failureClass, key),
+        )
+        self.connection.commit()
+
+    def markDone(self, key, outputFile):
+        """
+        Marks an already existing output (e.g. found on the filesystem) as done
+        """
+        self.jobs[key] = ("done", outputFile)
+        self.connection.execute(
+            "INSERT INTO jobs (key, state, outputFile) VALUES (?, 'done', ?) "
+            "ON CONFLICT(key) DO UPDATE SET state='done', outputFile=excluded.outputFile",
+            (key, outputFile),
+        )
+        self.connection.commit()
+
+    def close(self):
+        """
+        Closes the connection to the database
+        """
+        self.connection.close()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+This class can be used to decide in which order the jobs of the energy bins are given to the Submitter.
+Walking the bins in ascending order starts the slowest (highest energy) jobs at the end of the allocation,
+leaving a long tail with a single job running while the other slots are idle.
+Starting the most expensive jobs first (longest processing time first) or interleaving the bins cuts this tail.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import json
+
+
+class JobOrdering:
+    """
+    Orders the jobs of the energy bins according to the predicted cost of a single job in every bin.
+        ascending: the bins one after the other from the lowest energy (default)
+        lpt: the bins one after the other from the most expensive (longest processing time first)
+        interleave: one job of every bin in turn, from the most expensive bin to the cheapest
+
+    Parameters:
+        policy: "ascending", "lpt" or "interleave"
+        costs: Dictionary with the energy bin (log10 E/GeV) as key and the cost of a single job as value
+               (e.g. seconds measured in a previous production). Bins not in it use the cost model
+        costExponent: the cost model of a job is 10**(costExponent * energy),
+                      1 means that the runtime is proportional to the energy (e.g. Corsika)
+    """
+
+    policies = ["ascending", "lpt", "interleave"]
+
+    def __init__(self, policy="ascending", costs={}, costExponent=1.0):
+        if policy not in self.policies:
+            raise ValueError(f"Unknown ordering {policy}, use one of {self.policies}")
+        self.policy = policy
+        self.costs = {round(float(energy), 1): cost for energy, cost in costs.items()}
+        self.costExponent = costExponent
+
+    @classmethod
+    def fromFile(cls, costFile, policy="ascending", costExponent=1.0):
+        """
+        Reads the costs from a json file like {"5.0": 120, "5.1": 150, ...}
+        """
+        with open(costFile, "r") as f:
+            costs = json.load(f)
+        return cls(policy=policy, costs=costs, costExponent=costExponent)
+
+    def cost(self, energy):
+        """
+        Returns the predicted cost of a single job in the energy bin
+        """
+        energy = round(float(energy), 1)
+        if energy in self.costs.keys():
+            return self.costs[energy]
+        return 10 ** (self.costExponent * energy)
+
+    def orderedBins(self, energies):
+        """
+        Returns the energy bins in the order in which they are started
+        """
+        if self.policy == "ascending":
+            return sorted(energies)
+        return sorted(energies, key=self.cost, reverse=True)
+
+    def order(self, binJobs):
+        """
+        Yields the jobs of all bins in the order of the policy.
+        The jobs of a bin are only taken from its generator when they are needed,
+        thus the bins can be generators that write files or check outputs lazily.
+
+        Parameters:
+            binJobs: Dictionary with the energy bin as key and an iterable of its jobs as value
+        """
+        energies = self.orderedBins(binJobs.keys())
+        if self.policy != "interleave":
+            for energy in energies:
+                yield from binJobs[energy]
+            return
+
+        iterators = [iter(binJobs[energy]) for energy in energies]
+        while iterators:
+            for iterator in list(iterators):
+                job = next(iterator, None)
+                if job is None:
+                    iterators.remove(iterator)
+                    continue
+                yield job
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+This class can be used to decide how long a single job may run before it is killed.
+A hung icetray script or a Corsika run stuck in a pathological shower would otherwise keep its slot
+until the end of the allocation.
+The timeout of a stage is either given explicitly or derived from its runtime predicted
+from the journal (see RuntimePredictor).
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+
+class JobTimeouts:
+    """
+    Timeouts of the jobs per stage.
+
+    Parameters:
+        timeouts: Dictionary with the stage as key and its timeout in seconds as value (e.g. {"clsim": 36000})
+        default: the timeout in seconds of the stages that are neither in timeouts nor predicted (default None, no limit)
+        predictor: the RuntimePredictor of the jobs (default None)
+        classify: function that returns the (stage, energy) of a job key
+        factor: the timeout of a predicted stage is factor times its predicted runtime (2 sigma) (default 3)
+        minimum: the shortest timeout in seconds derived from a prediction (default 600)
+    """
+
+    def __init__(
+        self,
+        timeouts={},
+        default=None,
+        predictor=None,
+        classify=None,
+        factor=3.0,
+        minimum=600,
+    ):
+        self.timeouts = dict(timeouts)
+        self.default = default
+        self.predictor = predictor
+        self.classify = classify
+        self.factor = factor
+        self.minimum = minimum
+
+    @staticmethod
+    def parseTimeouts(items):
+        """
+        Returns the dictionary of the timeouts given as ["stage=seconds", ...] (e.g. from the command line)
+        """
+        timeouts = {}
+        for item in items:
+            stage, _, seconds = item.partition("=")
+            timeouts[stage] = float(seconds)
+        return timeouts
+
+    def timeout(self, key):
+        """
+        Returns the timeout in seconds of the job, None if it can run without limit
+        """
+        if self.classify is None:
+            return self.default
+        stage, energy = self.classify(key)
+        if stage in self.timeouts.keys():
+            return self.timeouts[stage]
+        if self.predictor is not None:
+            predicted = self.predictor.predict(stage, energy, sigma=2)
+            if predicted is not None:
+                return max(self.minimum, self.factor * predicted)
+        return self.default
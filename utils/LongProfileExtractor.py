@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+This class can be used to convert the longitudinal profiles written by Corsika (LONGI ... T T, DAT*.long files)
+of a whole energy bin into a single memory-mappable numpy file (.npy with a structured array).
+Every shower has its particle numbers per depth step and the parameters of the Gaisser-Hillas fit,
+thus Xmax and quality studies can be done with np.load(..., mmap_mode="r") instead of parsing the text again.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import os
+import re
+import numpy as np
+
+
+class LongProfileExtractor:
+    """
+    Streaming parser of the Corsika .long files.
+    The files are read twice: the first time only the headers are counted to know the size of the output,
+    the second time the profiles are written directly into the memory-mapped output file.
+
+    Parameters:
+        maxSteps: the number of depth steps stored for every shower (default None, the largest one in the files).
+                  Showers with more steps are cut, the missing steps are filled with zeros (see nSteps)
+    """
+
+    # The columns of the particle distribution after the depth
+    species = [
+        "gammas",
+        "positrons",
+        "electrons",
+        "muPlus",
+        "muMinus",
+        "hadrons",
+        "charged",
+        "nuclei",
+        "cherenkov",
+    ]
+    distributionHeader = "LONGITUDINAL DISTRIBUTION IN"
+    # The header of a profile and the line with the names of its columns
+    headerPattern = re.compile(
+        r"LONGITUDINAL DISTRIBUTION IN\s+(\d+)[^\n]*?SHOWER\s*(\d+)[^\n]*\n[^\n]*\n"
+    )
+    parametersPattern = re.compile(r"PARAMETERS\s*=([^\n]*)")
+    chi2Pattern = re.compile(r"CHI\*\*2/DOF\s*=\s*(\S+)")
+
+    def __init__(self, maxSteps=None):
+        self.maxSteps = maxSteps
+        # The compiled patterns matching a given number of lines
+        self.linesPatterns = {}
+
+    def profileType(self, maxSteps):
+        """
+        Returns the dtype of a single shower
+        """
+        return np.dtype(
+            [
+                ("runNumber", np.int32),
+                ("showerNumber", np.int32),
+                ("nSteps", np.int32),
+                ("depth", np.float32, (maxSteps,)),  # g/cm2
+                ("particles", np.float32, (maxSteps, len(self.species))),
+                # N(T) = P1 * ((T-P2)/(P3-P2))**((P3-P2)/(P4+P5*T+P6*T**2)) * EXP((P3-T)/(P4+P5*T+P6*T**2))
+                ("ghParameters", np.float32, (6,)),
+                ("chi2", np.float32),
+            ]
+        )
+
+    @staticmethod
+    def runNumberOf(longFile):
+        """
+        Returns the run number from the name of the file (e.g. DAT500000.long), -1 if unknown
+        """
+        name = os.path.basename(longFile).partition(".")[0]
+        try:
+            return int(name.partition("DAT")[-1])
+        except ValueError:
+            return -1
+
+    def countShowers(self, longFile):
+        """
+        Returns the number of showers and the largest number of steps in the file
+        """
+        with open(longFile, "rb") as f:
+            steps = re.findall(
+                rb"%s\s+(\d+)" % self.distributionHeader.encode(), f.read()
+            )
+        return len(steps), max([int(step) for step in steps] + [0])
+
+    def parseFile(self, longFile):
+        """
+        Yields every shower of the file as
+        (showerNumber, depth, particles, ghParameters, chi2),
+        where particles has shape (steps, species).
+        The fit parameters are NaN if Corsika did not write them.
+        A truncated profile ends the file, it is not yielded.
+        The whole file is read at once and the numbers of every profile are converted by a single numpy call.
+        """
+        with open(longFile, "r", errors="replace") as f:
+            text = f.read()
+        headers = list(self.headerPattern.finditer(text))
+        for index, header in enumerate(headers):
+            nSteps = int(header.group(1))
+            showerNumber = int(header.group(2))
+            # The profile starts after the line with the names of the columns
+            table = self.linesPattern(nSteps).match(text, header.end())
+            if table is None:
+                print(f"Truncated profile of shower {showerNumber} in {longFile}")
+                return
+            values = np.fromstring(table.group(0), dtype=np.float32, sep=" ")
+            if values.size != nSteps * (len(self.species) + 1):
+                print(f"Truncated profile of shower {showerNumber} in {longFile}")
+                return
+            values = values.reshape(nSteps, len(self.species) + 1)
+
+            # The fit is written after the profile (and the energy deposit), before the next shower
+            limit = headers[index + 1].start() if index + 1 < len(headers) else len(text)
+            parameters = np.full(6, np.nan, dtype=np.float32)
+            match = self.parametersPattern.search(text, table.end(), limit)
+            if match is not None:
+                fitted = np.fromstring(match.group(1), dtype=np.float32, sep=" ")[:6]
+                parameters[: len(fitted)] = fitted
+            chi2 = np.float32(np.nan)
+            match = self.chi2Pattern.search(text, table.end(), limit)
+            if match is not None:
+                chi2 = np.float32(match.group(1))
+            yield showerNumber, values[:, 0], values[:, 1:], parameters, chi2
+
+    def linesPattern(self, nSteps):
+        """
+        Returns the pattern that matches nSteps lines
+        """
+        if nSteps not in self.linesPatterns:
+            self.linesPatterns[nSteps] = re.compile(r"(?:[^\n]*\n){%d}" % nSteps)
+        return self.linesPatterns[nSteps]
+
+    def extractBin(self, longFiles, outputFile):
+        """
+        Writes the profiles of all showers in the files into the outputFile (.npy).
+
+        Parameters:
+            longFiles: the .long files of the energy bin
+            outputFile: the numpy file, it can be read with np.load(outputFile, mmap_mode="r")
+
+        Returns:
+            the number of showers written.
+            The rows of the truncated profiles are left empty (nSteps 0) at the end of the file
+        """
+        longFiles = sorted(longFiles)
+        counts = [self.countShowers(longFile) for longFile in longFiles]
+        nShowers = sum(count for count, _ in counts)
+        maxSteps = self.maxSteps or max([steps for _, steps in counts] + [1])
+
+        tempFile = f"{outputFile}.part.npy"
+        profiles = np.lib.format.open_memmap(
+            tempFile, mode="w+", dtype=self.profileType(maxSteps), shape=(nShowers,)
+        )
+        index = 0
+        for longFile in longFiles:
+            runNumber = self.runNumberOf(longFile)
+            for showerNumber, depth, particles, parameters, chi2 in self.parseFile(
+                longFile
+            ):
+                nSteps = min(len(depth), maxSteps)
+                profile = profiles[index]
+                profile["runNumber"] = runNumber
+                profile["showerNumber"] = showerNumber
+                profile["nSteps"] = nSteps
+                profile["depth"][:nSteps] = depth[:nSteps]
+                profile["particles"][:nSteps] = particles[:nSteps]
+                profile["ghParameters"] = parameters
+                profile["chi2"] = chi2
+                index += 1
+        profiles.flush()
+        del profiles
+        os.replace(tempFile, outputFile)
+        return nShowers
+
+    def extractDirectory(self, longDirectory, outputFile):
+        """
+        Writes the profiles of all DAT*.long files in the directory (e.g. temp/5.0/) into the outputFile
+        """
+        longFiles = []
+        with os.scandir(longDirectory) as entries:
+            for entry in entries:
+                if entry.name.startswith("DAT") and entry.name.endswith(".long"):
+                    longFiles.append(entry.path)
+        return self.extractBin(longFiles, outputFile)
+
+    @staticmethod
+    def load(outputFile):
+        """
+        Returns the memory-mapped profiles of an energy bin
+        """
+        return np.load(outputFile, mmap_mode="r")
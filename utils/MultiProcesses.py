@@ -1,7 +1,7 @@
 #!/bin/env python3
 
-import time
 import multiprocessing as mp
+from multiprocessing.connection import wait
 
 
 class MultiProcesses:
@@ -9,18 +9,28 @@ class MultiProcesses:
     Classed used for calling a function multiple times in a single submission (eg. on the Horeka cluster)
     """
 
-    def __init__(self, keysGenerator, functionToRun, parallel_sim=50) -> None:
+    def __init__(
+        self, keysGenerator, functionToRun, parallel_sim=50, callbacks=[]
+    ) -> None:
         """
         Parameters:
             keysGenerator: is a function that yields the key and process string needed for the simulation
             functionToRun: is a function that holds the processes that need to be run
             parallelRunningSims: number of parallel processes that wants to be executed
             processDict: Dictionary where all the running processes are stored
+            callbacks: list of functions called as callback(key, exitcode) when a process is completed
         """
         self.keysGenerator = keysGenerator()
         self.functionToRun = functionToRun
         self.parallelRunningSims = parallel_sim
         self.processDict = {}
+        self.callbacks = list(callbacks)
+
+    def addCallback(self, callback):
+        """
+        Adds a function that is called as callback(key, exitcode) every time a process is completed
+        """
+        self.callbacks.append(callback)
 
     def startProcesses(self):
         """
@@ -62,20 +72,18 @@ class MultiProcesses:
         """
         It is a continuos check over the running simulations.
         As long as there are keys in the processDict it keeps the checking.
-        This is done by calling the singleCheck function
-        It then waits a few seconds before performing the checks again.
-        This is done to avoid overloading the CPU with useless checks
+        The parent blocks on the sentinels of the running processes,
+        thus it does not use any CPU until at least one process is completed.
+        This is done by calling the singleCheck function afterwards.
         """
         # Gets all the keys in the processDict which needs to be used in the loop
         keyToLoop = list(self.processDict.keys())
 
         # If there are processes active it keeps looping in while
         while keyToLoop:
+            # Waits until at least one of the processes is completed
+            wait([process.sentinel for process in self.processDict.values()])
             keyToLoop = self.singleCheck(keyToLoop)
-            # Waits before restarting the loop.
-            # This is done to avoid overloading the CPU with useless checks
-            sleepTime = 10
-            # time.sleep(sleepTime)
         return
 
     def singleCheck(self, keyToLoop):
@@ -90,7 +98,11 @@ class MultiProcesses:
         for key in keyToLoop:
             if not self.processDict[key].is_alive():
                 # Pops out the process that is completed
-                self.processDict.pop(key)
+                process = self.processDict.pop(key)
+                process.join()
+                for callback in self.callbacks:
+                    callback(key, process.exitcode)
+                process.close()
                 # Starts a new process since one is completed
                 self.startSingleProcess()
         # Updates the keys over which the loop has to be performed
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+This class can be used to know which output files already exist.
+Each directory is scanned only once with os.scandir and kept in memory as a set,
+which is then updated as the jobs are completed.
+This avoids listing the same directory on the shared filesystem again for every single run.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import os
+
+
+class OutputIndex:
+    """
+    Index of the file names in the output directories.
+
+    Parameters:
+        directories: Dictionary with the normalized path of a scanned directory as key
+                     and the set of file names in it as value
+    """
+
+    def __init__(self):
+        self.directories = {}
+
+    def scan(self, directory):
+        """
+        Returns the set of file names in the directory.
+        The directory is scanned only the first time, afterwards the set in memory is used.
+        A directory that does not exist is considered empty.
+        """
+        directory = os.path.normpath(directory)
+        if directory not in self.directories:
+            try:
+                with os.scandir(directory) as entries:
+                    self.directories[directory] = {
+                        entry.name for entry in entries if entry.is_file()
+                    }
+            except FileNotFoundError:
+                self.directories[directory] = set()
+        return self.directories[directory]
+
+    def contains(self, directory, name):
+        """
+        Checks if the file name exists in the directory
+        """
+        return name in self.scan(directory)
+
+    def add(self, directory, name):
+        """
+        Adds a new file to the index (e.g. once a job is completed)
+        """
+        self.scan(directory).add(name)
+
+    def discard(self, directory, name):
+        """
+        Removes a file from the index (e.g. if it was deleted)
+        """
+        self.scan(directory).discard(name)
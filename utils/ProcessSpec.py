@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+This class can be yielded by the generators instead of a process string,
+to start an executable directly (without a temporary sh file) with its input given through stdin.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+
+class ProcessSpec:
+    """
+    Describes a process that the Submitter (or AsyncSubmitter) starts directly.
+
+    Parameters:
+        args: list with the executable and its arguments
+        cwd: the directory where the process is executed (default None, the current one)
+        stdinData: the bytes written to the stdin of the process, e.g. the Corsika steering card (default None)
+        stdoutFile: file where the stdout of the process is written (default None, the log file of the Submitter)
+        finalize: function called as finalize(returncode) once the process is completed,
+                  e.g. to move the output file to the data folder (default None)
+    """
+
+    def __init__(self, args, cwd=None, stdinData=None, stdoutFile=None, finalize=None):
+        self.args = args
+        self.cwd = cwd
+        self.stdinData = stdinData
+        self.stdoutFile = stdoutFile
+        self.finalize = finalize
+
+    def split(self):
+        """
+        Returns the list of arguments, like str.split() does for a process string
+        """
+        return list(self.args)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+This class can be used to declare resource classes (cores, memory, devices such as GPUs)
+for the single stages and to limit how many stages of every class run at the same time.
+Stages that need a device get the index of a free device through the environment (e.g. CUDA_VISIBLE_DEVICES).
+The device names are just strings, thus fake devices can be used for testing on a CPU-only node.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import json
+import os
+
+
+class ResourcePool:
+    """
+    This class keeps track of the resources that are in use by the running stages.
+
+    Parameters:
+        resourceClasses: dictionary with the name of the class as key and as value a dictionary with
+                         slots: maximum number of stages of this class running at the same time
+                         cores: number of cores used by a single stage (default 1)
+                         memory: memory in GB used by a single stage (default 0)
+                         devices: list of the devices, every stage gets one of them (default no devices)
+                         deviceVariable: environment variable with the device (default CUDA_VISIBLE_DEVICES)
+        stageClasses: dictionary with the stage as key and the name of its resource class as value
+        totalCores: number of cores that can be used by all stages together
+        totalMemory: memory in GB that can be used by all stages together (default None, no limit)
+        defaultClass: the resource class of the stages not in stageClasses
+    """
+
+    def __init__(
+        self,
+        resourceClasses,
+        stageClasses={},
+        totalCores=50,
+        totalMemory=None,
+        defaultClass="cpu",
+    ):
+        self.resourceClasses = resourceClasses
+        self.stageClasses = stageClasses
+        self.totalCores = totalCores
+        self.totalMemory = totalMemory
+        self.defaultClass = defaultClass
+
+        self.usedCores = 0
+        self.usedMemory = 0
+        self.runningStages = {name: 0 for name in self.resourceClasses.keys()}
+        self.freeDevices = {
+            name: list(resourceClass.get("devices", []))
+            for name, resourceClass in self.resourceClasses.items()
+        }
+
+    @classmethod
+    def fromFile(cls, configFile, totalCores=50, totalMemory=None):
+        """
+        Reads the resource classes from a json file like:
+        {
+            "resourceClasses": {
+                "cpu": {"slots": 96, "cores": 1, "memory": 2},
+                "gpu": {"slots": 4, "cores": 1, "memory": 4, "devices": ["0", "1", "2", "3"]}
+            },
+            "stageClasses": {"clsim": "gpu"}
+        }
+        """
+        with open(configFile, "r") as f:
+            config = json.load(f)
+        return cls(
+            resourceClasses=config["resourceClasses"],
+            stageClasses=config.get("stageClasses", {}),
+            totalCores=config.get("totalCores", totalCores),
+            totalMemory=config.get("totalMemory", totalMemory),
+            defaultClass=config.get("defaultClass", "cpu"),
+        )
+
+    def classOf(self, stage):
+        """
+        Returns the name of the resource class of the stage
+        """
+        return self.stageClasses.get(stage, self.defaultClass)
+
+    def isAvailable(self, stage):
+        """
+        Checks if there are enough free resources to start the stage
+        """
+        name = self.classOf(stage)
+        resourceClass = self.resourceClasses[name]
+        if self.runningStages[name] >= resourceClass.get("slots", self.totalCores):
+            return False
+        if self.usedCores + resourceClass.get("cores", 1) > self.totalCores:
+            return False
+        if (self.totalMemory is not None) and (
+            self.usedMemory + resourceClass.get("memory", 0) > self.totalMemory
+        ):
+            return False
+        if resourceClass.get("devices") and not self.freeDevices[name]:
+            return False
+        return True
+
+    def acquire(self, stage):
+        """
+        Takes the resources for the stage. isAvailable MUST be checked before.
+
+        Returns:
+            allocation: the resource class name and the device (None if the class has no devices)
+        """
+        name = self.classOf(stage)
+        resourceClass = self.resourceClasses[name]
+        self.runningStages[name] += 1
+        self.usedCores += resourceClass.get("cores", 1)
+        self.usedMemory += resourceClass.get("memory", 0)
+        device = None
+        if resourceClass.get("devices"):
+            device = self.freeDevices[name].pop(0)
+        return (name, device)
+
+    def release(self, allocation):
+        """
+        Gives back the resources of a completed stage
+        """
+        name, device = allocation
+        resourceClass = self.resourceClasses[name]
+        self.runningStages[name] -= 1
+        self.usedCores -= resourceClass.get("cores", 1)
+        self.usedMemory -= resourceClass.get("memory", 0)
+        if device is not None:
+            self.freeDevices[name].append(device)
+
+    def environment(self, allocation):
+        """
+        Returns the environment of the process with the device variable set,
+        or None (inherit the environment) if the class has no devices
+        """
+        name, device = allocation
+        if device is None:
+            return None
+        deviceVariable = self.resourceClasses[name].get(
+            "deviceVariable", "CUDA_VISIBLE_DEVICES"
+        )
+        environment = dict(os.environ)
+        environment[deviceVariable] = str(device)
+        return environment
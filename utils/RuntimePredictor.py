@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+This class can be used to predict the runtime and the memory of a job from the accounting
+recorded in the JobJournal (wall time, CPU time and peak memory of every completed job).
+For every stage a log-linear model is fitted: log10(wallTime) = a + b * log10(E/GeV), the same for the memory.
+The predictions can be used to size the allocation in SubFile.sub and as costs of the JobOrdering.
+
+Report of a journal:
+    python3 -m utils.RuntimePredictor --journal /path/to/journal.db
+Cost file for MakeCorsikaSim.py --costFile:
+    python3 -m utils.RuntimePredictor --journal /path/to/journal.db --stage corsika --costFile costs.json --energies 5.0 5.1 5.2
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import json
+import sqlite3
+
+import numpy as np
+
+
+class RuntimePredictor:
+    """
+    Log-linear model of the wall time and the peak memory of every stage.
+
+    Parameters:
+        journalFile: the SQLite file of the JobJournal
+        filters: dictionary with the columns (primary_, numbSamples, detector) and the values the jobs MUST have
+        models: dictionary with the stage as key and its fitted parameters as value
+    """
+
+    quantities = ["wallTime", "cpuTime", "maxRss"]
+
+    def __init__(self, journalFile, filters={}):
+        self.journalFile = journalFile
+        self.filters = filters
+        self.models = {}
+        self.fit()
+
+    def readJobs(self):
+        """
+        Returns the stage, energy, wallTime, cpuTime and maxRss of the done jobs with a recorded accounting
+        """
+        query = (
+            "SELECT stage, energy, wallTime, cpuTime, maxRss FROM jobs "
+            "WHERE state='done' AND wallTime IS NOT NULL AND stage IS NOT NULL AND energy IS NOT NULL"
+        )
+        values = []
+        for column, value in self.filters.items():
+            if value is not None:
+                query += f" AND {column}=?"
+                values.append(value)
+        connection = sqlite3.connect(self.journalFile)
+        rows = connection.execute(query, values).fetchall()
+        connection.close()
+        return rows
+
+    def fit(self):
+        """
+        Fits the models of all stages found in the journal.
+        With a single energy bin (or a single job) the model is the mean, without dependence on the energy.
+        """
+        stages = {}
+        for stage, energy, wallTime, cpuTime, maxRss in self.readJobs():
+            stages.setdefault(stage, []).append(
+                (energy, wallTime, cpuTime or 0, maxRss or 0)
+            )
+
+        self.models = {}
+        for stage, rows in stages.items():
+            rows = np.array(rows, dtype=np.float64)
+            energies = rows[:, 0]
+            model = {"jobs": len(rows), "energies": sorted(set(energies.tolist()))}
+            for index, quantity in enumerate(self.quantities, start=1):
+                logValues = np.log10(np.maximum(rows[:, index], 1e-3))
+                if len(set(energies.tolist())) > 1:
+                    slope, intercept = np.polyfit(energies, logValues, 1)
+                else:
+                    slope, intercept = 0.0, float(np.mean(logValues))
+                residuals = logValues - (intercept + slope * energies)
+                model[quantity] = {
+                    "intercept": float(intercept),
+                    "slope": float(slope),
+                    "scatter": float(np.std(residuals)),
+                }
+            self.models[stage] = model
+
+    def predict(self, stage, energy, quantity="wallTime", sigma=0.0):
+        """
+        Returns the predicted value of the quantity (wallTime and cpuTime in seconds, maxRss in MB)
+        for a job of the stage in the energy bin, or None if the stage is unknown.
+
+        Parameters:
+            stage: e.g. corsika, detector, lv1
+            energy: log10 E/GeV
+            quantity: wallTime, cpuTime or maxRss
+            sigma: number of standard deviations of the scatter added as safety margin (e.g. 2 for walltime planning)
+        """
+        if stage not in self.models.keys():
+            return None
+        parameters = self.models[stage][quantity]
+        logValue = (
+            parameters["intercept"]
+            + parameters["slope"] * energy
+            + sigma * parameters["scatter"]
+        )
+        return 10**logValue
+
+    def costs(self, stage, energies):
+        """
+        Returns the predicted wall time of the stage for every energy bin, as needed by the JobOrdering
+        """
+        costs = {}
+        for energy in energies:
+            cost = self.predict(stage, round(float(energy), 1))
+            if cost is not None:
+                costs[f"{energy}"] = cost
+        return costs
+
+    def report(self, energies=[]):
+        """
+        Returns a text report with the model of every stage and its predictions for the energies
+        (default the energies found in the journal)
+        """
+        lines = []
+        for stage, model in sorted(self.models.items()):
+            wall = model["wallTime"]
+            rss = model["maxRss"]
+            lines.append(
+                f"{stage}: {model['jobs']} jobs, "
+                f"log10(wallTime/s) = {wall['intercept']:.3f} + {wall['slope']:.3f} * log10(E/GeV) "
+                f"(scatter {wall['scatter']:.3f} dex), "
+                f"log10(maxRss/MB) = {rss['intercept']:.3f} + {rss['slope']:.3f} * log10(E/GeV)"
+            )
+            lines.append(
+                f"    {'energy':>8} {'wall [s]':>12} {'wall 2sigma':>12} {'cpu [s]':>12} {'maxRss [MB]':>12}"
+            )
+            for energy in energies or model["energies"]:
+                lines.append(
+                    f"    {energy:8.1f} "
+                    f"{self.predict(stage, energy):12.1f} "
+                    f"{self.predict(stage, energy, sigma=2):12.1f} "
+                    f"{self.predict(stage, energy, 'cpuTime'):12.1f} "
+                    f"{self.predict(stage, energy, 'maxRss'):12.1f}"
+                )
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Runtime and memory model of the stages recorded in a job journal"
+    )
+    parser.add_argument(
+        "--journal", type=str, required=True, help="SQLite file of the JobJournal"
+    )
+    parser.add_argument(
+        "--energies",
+        type=float,
+        nargs="*",
+        default=[],
+        help="Energy bins of the predictions (default: the ones in the journal)",
+    )
+    parser.add_argument(
+        "--primary", type=int, default=None, help="Only jobs of this Corsika primary"
+    )
+    parser.add_argument(
+        "--detector", type=str, default=None, help="Only jobs of this detector"
+    )
+    parser.add_argument(
+        "--stage",
+        type=str,
+        default="",
+        help="Stage whose predicted wall times are written in --costFile",
+    )
+    parser.add_argument(
+        "--costFile",
+        type=str,
+        default="",
+        help="json file for the --costFile option of MakeCorsikaSim.py and MakeDetectorResponse.py",
+    )
+    args = parser.parse_args()
+
+    predictor = RuntimePredictor(
+        args.journal, filters={"primary_": args.primary, "detector": args.detector}
+    )
+    print(predictor.report(args.energies))
+    if args.costFile and args.stage:
+        energies = args.energies or predictor.models.get(args.stage, {}).get(
+            "energies", []
+        )
+        with open(args.costFile, "w") as f:
+            json.dump(predictor.costs(args.stage, energies), f, indent=4)
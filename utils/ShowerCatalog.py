@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+
+"""
+This class can be used to keep a catalog of all produced Corsika showers in a local SQLite database:
+run number, energy bin, primary, energy, zenith, azimuth, file, size and checksum.
+It also lists every file of the energy bins, also the ones that are not complete,
+thus the detector response gets the same file numbering (and seeds) as by listing the directory.
+It is updated as soon as a simulation is completed (MakeCorsikaSim.py --catalog),
+the files are validated and checksummed by a background thread and the rows are written by the main thread,
+thus the detector response can select its inputs (e.g. zenith < 30 deg in 5.5-6.0)
+without listing the directories on the shared filesystem (MakeDetectorResponse.py -catalog).
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import collections
+import os
+import pathlib
+import sqlite3
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.CorsikaReader import CorsikaReader
+
+
+class ShowerCatalog:
+    """
+    Catalog of the showers stored in a SQLite database in WAL mode, one row per shower.
+    Only the showers of complete files (see CorsikaReader.validate) are added,
+    the files table lists all files of the energy bins (valid 1, not complete 0, not a Corsika file NULL).
+    The files given to submitFile are read by background threads, their rows are written by collect()
+    (or close()) in the main thread, which is the only one using the database.
+
+    Parameters:
+        catalogFile: the SQLite file. It should be on a local disk (not on LSDF/Lustre)
+        checksum: "adler32", "crc32" or "none", the checksum computed for every file
+        maxWorkers: number of threads reading the files given to submitFile (default 1)
+    """
+
+    chunkSize = 16 * 1024 * 1024
+
+    def __init__(self, catalogFile, checksum="adler32", maxWorkers=1):
+        self.catalogFile = catalogFile
+        self.checksum = checksum
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers)
+        # The files read by the threads as (fileName, energyBin, rows, error), appended by the threads
+        self.completed = collections.deque()
+        pathlib.Path(os.path.dirname(os.path.abspath(catalogFile))).mkdir(
+            parents=True, exist_ok=True
+        )
+        self.connection = sqlite3.connect(catalogFile)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS showers ("
+            "runNumber INTEGER, "
+            "eventNumber INTEGER, "
+            "energyBin REAL, "
+            "primary_ INTEGER, "
+            "energy REAL, "
+            "zenith REAL, "
+            "azimuth REAL, "
+            "path TEXT, "
+            "name TEXT, "
+            "size INTEGER, "
+            "checksum TEXT, "
+            "PRIMARY KEY (runNumber, eventNumber))"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS showersBin ON showers (energyBin, zenith)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS showersPath ON showers (path)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "energyBin REAL, "
+            "name TEXT, "
+            "path TEXT, "
+            "valid INTEGER, "
+            "PRIMARY KEY (energyBin, name))"
+        )
+        # Catalogs written before the files table existed only know the complete files,
+        # the other ones are added by scanDirectory (MakeDetectorResponse.py -scanCatalog)
+        (numberFiles,) = self.connection.execute("SELECT COUNT(*) FROM files").fetchone()
+        if numberFiles == 0:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO files "
+                "SELECT DISTINCT energyBin, name, path, 1 FROM showers"
+            )
+        self.connection.commit()
+
+    def fileChecksum(self, fileName):
+        """
+        Returns the checksum of the file as a hex string (empty if checksum is "none")
+        """
+        if self.checksum == "none":
+            return ""
+        function = zlib.crc32 if self.checksum == "crc32" else zlib.adler32
+        value = 0 if self.checksum == "crc32" else 1
+        with open(fileName, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunkSize), b""):
+                value = function(chunk, value)
+        return f"{self.checksum}:{value:08x}"
+
+    def readFile(self, fileName, energyBin):
+        """
+        Validates the Corsika file, reads its showers and computes its checksum.
+        It does not use the database, thus it can be executed by any thread.
+
+        Parameters:
+            fileName: the Corsika file in the data directory (absolute path)
+            energyBin: the energy bin (log10 E/GeV of the lower edge, i.e. the name of the folder)
+
+        Returns:
+            the rows of the showers, None if the file is not complete
+        """
+        reader = CorsikaReader(fileName)
+        try:
+            if not reader.validate():
+                print(f"Not added to the catalog {fileName}: {reader.error}")
+                return None
+            table = reader.showerTable()
+        finally:
+            # The memory map is closed also for the files that are not complete
+            reader.close()
+
+        size = os.path.getsize(fileName)
+        checksum = self.fileChecksum(fileName)
+        name = os.path.basename(fileName)
+        return [
+            (
+                int(shower["runNumber"]),
+                int(shower["eventNumber"]),
+                round(float(energyBin), 1),
+                int(shower["particleId"]),
+                float(shower["energy"]),
+                float(np.degrees(shower["zenith"])),
+                float(np.degrees(shower["azimuth"])),
+                fileName,
+                name,
+                size,
+                checksum,
+            )
+            for shower in table
+        ]
+
+    def writeRows(self, fileName, energyBin, rows):
+        """
+        Replaces the showers known for the file with the given rows (see readFile)
+        and lists the file in its energy bin, as not complete if rows is None
+        """
+        self.connection.execute("DELETE FROM showers WHERE path=?", (fileName,))
+        if rows is not None:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO showers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            (
+                round(float(energyBin), 1),
+                os.path.basename(fileName),
+                fileName,
+                int(rows is not None),
+            ),
+        )
+        self.connection.commit()
+
+    def addFile(self, fileName, energyBin):
+        """
+        Reads the showers of the Corsika file and adds them to the catalog,
+        replacing the ones already known for the same file.
+        A file that is not complete is only listed in the files of its energy bin.
+
+        Parameters:
+            fileName: the Corsika file in the data directory
+            energyBin: the energy bin (log10 E/GeV of the lower edge, i.e. the name of the folder)
+
+        Returns:
+            the number of showers added (0 if the file is not complete)
+        """
+        fileName = os.path.abspath(fileName)
+        rows = self.readFile(fileName, energyBin)
+        self.writeRows(fileName, energyBin, rows)
+        if rows is None:
+            return 0
+        return len(rows)
+
+    def submitFile(self, fileName, energyBin):
+        """
+        Adds the Corsika file to the catalog like addFile, but it is read by a background thread,
+        thus the main loop does not wait for the validation and the checksum of the whole file.
+        Its showers are written by the next collect() (or close()).
+        """
+        fileName = os.path.abspath(fileName)
+        future = self.executor.submit(self.readFile, fileName, energyBin)
+        future.add_done_callback(
+            lambda future: self.completed.append(
+                (
+                    fileName,
+                    energyBin,
+                    None if future.exception() else future.result(),
+                    future.exception(),
+                )
+            )
+        )
+
+    def collect(self):
+        """
+        Writes the showers of the files read by the threads, it must be called by the main thread.
+
+        Returns:
+            the number of files written in the catalog
+        """
+        writtenFiles = 0
+        while self.completed:
+            fileName, energyBin, rows, error = self.completed.popleft()
+            if error is not None:
+                # e.g. the file can not be read, it is added by the next scanDirectory
+                print(f"Not added to the catalog {fileName}: {error}")
+                continue
+            self.writeRows(fileName, energyBin, rows)
+            writtenFiles += 1
+        return writtenFiles
+
+    def scanDirectory(self, directory, energies):
+        """
+        Adds the files of the energy folders which are not in the catalog yet.
+        The Corsika files (DAT without extension) are read, the other files (e.g. DAT500000.bz2) are only listed.
+        It is only needed once for the files produced before the catalog was used.
+
+        Parameters:
+            directory: the data directory with the energy folders
+            energies: the energy bins
+        """
+        known = {
+            path for (path,) in self.connection.execute("SELECT path FROM files")
+        }
+        for energy in energies:
+            energyDir = os.path.abspath(f"{directory}/{energy}/")
+            if not os.path.isdir(energyDir):
+                continue
+            with os.scandir(energyDir) as entries:
+                for entry in entries:
+                    if (entry.path in known) or not entry.is_file():
+                        continue
+                    if entry.name.startswith("DAT") and "." not in entry.name:
+                        self.addFile(entry.path, energy)
+                        continue
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO files VALUES (?, ?, ?, NULL)",
+                        (round(float(energy), 1), entry.name, entry.path),
+                    )
+        self.connection.commit()
+
+    def fileNames(self, energyBin):
+        """
+        Returns the sorted names of all files in the energy bin, also the ones that are not complete,
+        thus the same names as by listing its directory
+        """
+        return sorted(
+            name
+            for (name,) in self.connection.execute(
+                "SELECT name FROM files WHERE energyBin=?",
+                (round(float(energyBin), 1),),
+            )
+        )
+
+    def select(
+        self,
+        energyMin=None,
+        energyMax=None,
+        zenithMin=None,
+        zenithMax=None,
+        primary=None,
+    ):
+        """
+        Returns the set of file names with at least one shower that satisfies all the given conditions.
+        Conditions that are None are not used.
+
+        Parameters:
+            energyMin, energyMax: the range of the energy bins (log10 E/GeV, both included)
+            zenithMin, zenithMax: the range of the zenith in degrees (both included)
+            primary: the Corsika id of the primary (e.g. 14 proton, 5626 iron)
+        """
+        conditions = []
+        values = []
+        for column, operator, value in [
+            ("energyBin", ">=", energyMin),
+            ("energyBin", "<=", energyMax),
+            ("zenith", ">=", zenithMin),
+            ("zenith", "<=", zenithMax),
+            ("primary_", "=", primary),
+        ]:
+            if value is not None:
+                conditions.append(f"{column}{operator}?")
+                values.append(value)
+        query = "SELECT DISTINCT name FROM showers"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        return {name for (name,) in self.connection.execute(query, values)}
+
+    def close(self):
+        """
+        Waits until the submitted files are read, writes their showers and closes the connection to the database
+        """
+        self.executor.shutdown(wait=True)
+        self.collect()
+        self.connection.close()
@@ -9,14 +9,23 @@ made via the combinations of file and energies
 """
 import numpy as np
 import os
+import pathlib
+import shutil
 import stat
 
+from utils.ProcessSpec import ProcessSpec
+from utils.LongProfileExtractor import LongProfileExtractor
+from utils.JobOrdering import JobOrdering
+
 
 class SimulationMaker:
     """
     This class has to useful functions.
         generator: which yields a key and a string to submit
         makeStringToSubmit: which writes a temporary file and a string to submit
+        makeProcessSpec: which makes a ProcessSpec that starts Corsika directly with the steering card in stdin
+        processCompleted: which can be given as callback to the Submitter to update the index of the outputs
+        extractLongProfiles: which converts the .long files of every energy bin into a single numpy file
 
     Parameters:
         startNumber:    the start of the simulation (eg. integer default value 0)
@@ -26,51 +35,180 @@ class SimulationMaker:
         fW:             the file writer class. In order to use some of the functions in this class
         pathCorsika:    the path where Corsika is installed
         corsikaExe:     the name of the Corsika executable that needs to be used
+        journal:        the JobJournal, simulations that are done according to it are skipped
+                        without listing the data directory (default None)
+        launchMode:     "direct" Corsika is started directly with the steering card given through stdin,
+                        "script" a inp file and a temporary sh file are written for every simulation (default)
+        writeInp:       if True the inp files are also written in launchMode "direct" (e.g. for auditing)
+        stageOut:       the StageOut which moves the files from the scratch directory to the data directory
+                        in the background in launchMode "direct" (default None, the files are moved immediately)
+        catalog:        the ShowerCatalog where the showers of every completed simulation are added (default None).
+                        The files are read in the background, catalog.close() writes the last ones
+        ordering:       the JobOrdering of the energy bins (default None, ascending energies)
 
     """
 
-    def __init__(self, startNumber, endNumber, energies, fW, pathCorsika, corsikaExe):
+    def __init__(
+        self,
+        startNumber,
+        endNumber,
+        energies,
+        fW,
+        pathCorsika,
+        corsikaExe,
+        journal=None,
+        launchMode="script",
+        writeInp=False,
+        stageOut=None,
+        catalog=None,
+        ordering=None,
+    ):
         self.startNumber = startNumber
         self.endNumber = endNumber
         self.energies = energies
         self.fW = fW
         self.pathCorsika = pathCorsika
         self.corsikaExe = corsikaExe
+        self.journal = journal
+        self.launchMode = launchMode
+        self.writeInp = writeInp
+        self.stageOut = stageOut
+        self.catalog = catalog
+        self.ordering = ordering
+        if self.ordering is None:
+            self.ordering = JobOrdering(policy="ascending")
+        # The simulations yielded by the generator that are not completed yet
+        self.runningSims = {}
+        # Checks if a failed simulation waits to be started again, set to Submitter.isRetrying once the Submitter exists
+        self.isRetrying = lambda key: False
+
+    def processCompleted(self, key, returncode):
+        """
+        This function can be given as callback to the Submitter.
+        Once a simulation is completed its output is added to the index of the FileWriter
+        and to the catalog, if the simulation succeeded and the file was moved to the data folder.
+        A failed simulation that is started again stays running, until its retry is completed or given up.
+        """
+        if key not in self.runningSims.keys():
+            return
+        if (returncode != 0) and self.isRetrying(key):
+            return
+        log10_E, runNumber = self.runningSims.pop(key)
+        dataDir = f"{self.fW.directories['data']}/{log10_E}/"
+        if returncode == 0 and os.path.isfile(f"{dataDir}/DAT{runNumber}"):
+            self.fW.outputIndex.add(dataDir, f"DAT{runNumber}")
+            if self.catalog is not None:
+                # The file is read in the background, the showers read so far are written
+                self.catalog.submitFile(f"{dataDir}/DAT{runNumber}", log10_E)
+                self.catalog.collect()
+
+    def processInterrupted(self, key):
+        """
+        This function can be given as interrupt callback to the Submitter.
+        Once a simulation is killed (e.g. at the end of the allocation or by its timeout) its non-completed files
+        are removed from the temp (or scratch) directory, thus it can be simulated again.
+        """
+        if key not in self.runningSims.keys():
+            return
+        self.removeWorkFiles(*self.runningSims[key])
+
+    def removeWorkFiles(self, log10_E, runNumber):
+        """
+        Removes the non-completed files of a simulation from the temp (or scratch) directory
+        """
+        workDir = f"{self.fW.directories['work']}/{log10_E}/"
+        for name in [f"DAT{runNumber}", f"DAT{runNumber}.long"]:
+            try:
+                os.remove(f"{workDir}/{name}")
+            except FileNotFoundError:
+                pass
+            self.fW.outputIndex.discard(workDir, name)
 
     def generator(self):
         """
         This function generates all possible configuration of energy and file number.
         It yields the key and the String to submit
-        The yield function returns every time a different value as the for loop proceeds
+        The yield function returns every time a different value as the for loop proceeds.
+        The energy bins are walked in the order given by the JobOrdering
+        (e.g. the most expensive bins first), see binGenerator for a single bin.
         """
         # This is a loop over all energies and gives the low and high limit values.
         # Eg. 5.0 and 5.1
-        for log10_E1, log10_E2 in zip(self.energies[:-1], self.energies[1:]):
-            # Creates "data", "temp", "log", "inp" folders and energy subfolder
-            self.fW.makeFolders(log10_E1)
-
-            # It loops over all the unique numbers
-            # for procNumber, runNumber in zip(binArray[:-1], binArray[1:]):
-            for runIndex in range(self.startNumber, self.endNumber):
-                # Creates the file name for the simulation
-                # The runNumber is calculated as follows:
-                # EEiiii where EE is the energy in log10/GeV *10
-                # and iiii is the run index number.
-                runNumber = int(log10_E1 * 10 * 10_000 + runIndex)
-
-                # Check if this simulation is not in data. Thus, was already created
-                # There is thus no need to redo it
-                if f"DAT{runNumber}" not in os.listdir(
-                    f"{self.fW.directories['data']}/{log10_E1}/"
-                ):
+        binJobs = {
+            log10_E1: self.binGenerator(log10_E1, log10_E2)
+            for log10_E1, log10_E2 in zip(self.energies[:-1], self.energies[1:])
+        }
+        yield from self.ordering.order(binJobs)
+
+    def binGenerator(self, log10_E1, log10_E2):
+        """
+        This function generates the key and the String to submit of every file number in a single energy bin
+        """
+        # Creates "data", "temp", "log", "inp" folders and energy subfolder
+        self.fW.makeFolders(log10_E1)
+
+        # It loops over all the unique numbers
+        # for procNumber, runNumber in zip(binArray[:-1], binArray[1:]):
+        # A single run simulates showersPerRun showers, thus the index moves by showersPerRun
+        for runIndex in range(self.startNumber, self.endNumber, self.fW.showersPerRun):
+            # Creates the file name for the simulation
+            # The runNumber is calculated as follows:
+            # EEiiii where EE is the energy in log10/GeV *10
+            # and iiii is the run index number (of the first shower in the run).
+            runNumber = int(log10_E1 * 10 * 10_000 + runIndex)
+            # The unique key for the the Submitter is created as followed.
+            # It has not practical use, nut MUST be unique
+            key = f"{log10_E1}_{runNumber}"
+            dataFile = f"{self.fW.directories['data']}/{log10_E1}/DAT{runNumber}"
+
+            # The journal knows already which simulations are done
+            if (self.journal is not None) and self.journal.isDone(key):
+                continue
+
+            # Check if this simulation is not in data. Thus, was already created
+            # There is thus no need to redo it
+            if not self.fW.isSimulated(runNumber, log10_E1):
+                if self.launchMode == "direct":
+                    if self.writeInp:
+                        self.fW.writeFile(runNumber, log10_E1, log10_E2)
+                    # Corsika is started directly, without any inp or sh file
+                    stringToSubmit = self.makeProcessSpec(log10_E1, log10_E2, runNumber)
+                else:
                     # It writes the Corsika input file
                     self.fW.writeFile(runNumber, log10_E1, log10_E2)
-                    # The unique key for the the Submitter is created as followed.
-                    # It has not practical use, nut MUST be unique
-                    key = f"{log10_E1}_{runNumber}"
                     # It calls the function to create a sting which will be used for the job execution
                     stringToSubmit = self.makeStringToSubmit(log10_E1, runNumber)
-                    yield (key, stringToSubmit)
+                if self.journal is not None:
+                    self.journal.markPlanned(
+                        key,
+                        dataFile,
+                        {
+                            "stage": "corsika",
+                            "energy": float(log10_E1),
+                            "primary": self.fW.primary,
+                            "numbSamples": self.fW.showersPerRun,
+                        },
+                    )
+                self.runningSims[key] = (log10_E1, runNumber)
+                yield (key, stringToSubmit)
+            elif self.journal is not None:
+                self.journal.markDone(key, dataFile)
+
+    def extractLongProfiles(self):
+        """
+        Converts the longitudinal profiles (.long files in the temp directory) of every energy bin
+        into a single numpy file long/{log10_E}.npy in the simulations directory (see LongProfileExtractor).
+        """
+        extractor = LongProfileExtractor()
+        longDir = f"{self.fW.directories['sim']}/long/"
+        pathlib.Path(longDir).mkdir(parents=True, exist_ok=True)
+        for log10_E in self.energies[:-1]:
+            self.fW.makeFolders(log10_E)
+            nShowers = extractor.extractDirectory(
+                f"{self.fW.directories['temp']}/{log10_E}/",
+                f"{longDir}/{log10_E}.npy",
+            )
+            print(f"Longitudinal profiles of {nShowers} showers in {longDir}/{log10_E}.npy")
 
     def makeStringToSubmit(self, log10_E, runNumber):
         # A few paths to files are defined.
@@ -82,20 +220,29 @@ class SimulationMaker:
         )
         # The move command which moves the file from the temporary directory to the data directory
         # when the simulation is completed
-        mvCommand = f"mv {self.fW.directories['temp']}/{log10_E}/DAT{runNumber} {self.fW.directories['data']}/{log10_E}/DAT{runNumber}"
+        mvCommand = f"mv {self.fW.directories['work']}/{log10_E}/DAT{runNumber} {self.fW.directories['data']}/{log10_E}/DAT{runNumber}"
+        # The long file is kept in the temp directory, thus it is moved only from the scratch directory
+        longCommand = ""
+        if self.fW.directories["work"] != self.fW.directories["temp"]:
+            longCommand = f"mv {self.fW.directories['work']}/{log10_E}/DAT{runNumber}.long {self.fW.directories['temp']}/{log10_E}/DAT{runNumber}.long"
 
         # Makes a temp file for the execution of corsika.
         tempFile = f"{self.fW.directories['temp']}/{log10_E}/temp_{runNumber}.sh"
         with open(tempFile, "w") as f:
             f.write(r"#!/bin/sh")  # This shows that the file is an executable
             f.write(
-                f"\ncd {self.pathCorsika}"  # You must execute corsica in its folder. Otherwise returns an error
+                "\nset -e"  # Stops at the first failing command, thus a failed simulation is not moved to the data directory
+                + f"\ncd {self.pathCorsika}"  # You must execute corsica in its folder. Otherwise returns an error
                 # You must delete corsica non completed files. Otherwise returns an error and exits without executing the file
-                + f"\nrm {self.fW.directories['temp']}/{log10_E}/DAT{runNumber}"  # Removes the non-completed simulation file if already existing
-                + f"\nrm {self.fW.directories['temp']}/{log10_E}/DAT{runNumber}.long"  # Removes the non-completed long file if already existing
-                + f"\nrm {logFile}"  # Removes the non-completed log file if already existing
+                + f"\nrm -f {self.fW.directories['work']}/{log10_E}/DAT{runNumber}"  # Removes the non-completed simulation file if already existing
+                + f"\nrm -f {self.fW.directories['work']}/{log10_E}/DAT{runNumber}.long"  # Removes the non-completed long file if already existing
+                + f"\nrm -f {logFile}"  # Removes the non-completed log file if already existing
                 + f"\n{self.pathCorsika}/{self.corsikaExe} < {inpFile} > {logFile}"  # This is how you execute a corsika file
+                # If Corsika fails the end of its log is written to the stderr, thus the Submitter can classify the failure,
+                # and its non-completed files are removed
+                + f" || {{ status=$?; tail -n 50 {logFile} >&2; rm -f {self.fW.directories['work']}/{log10_E}/DAT{runNumber} {self.fW.directories['work']}/{log10_E}/DAT{runNumber}.long; exit $status; }}"
                 + f"\n{mvCommand}"  # Move the file form temp directory to the data directory
+                + f"\n{longCommand}"  # Move the long file form the scratch to the temp directory
                 + f"\nrm {tempFile}"  # It removes this temporary file since it is not needed anymore
             )
 
@@ -106,3 +253,88 @@ class SimulationMaker:
         # The stringToSubmit is basically the execution of the temporary sh file
         subString = tempFile
         return subString
+
+    def makeProcessSpec(self, log10_E1, log10_E2, runNumber):
+        """
+        Makes the ProcessSpec which starts Corsika directly in its folder
+        with the steering card given through stdin and its output written to the log file.
+        The non-completed files of a previous attempt are removed here (only if they exist)
+        and the move to the data directory is done in python once Corsika is completed successfully,
+        the files of a failed simulation are removed.
+        """
+        tempDir = f"{self.fW.directories['work']}/{log10_E1}/"
+        logDir = f"{self.fW.directories['log']}/{log10_E1}/"
+        logFile = f"{logDir}/DAT{runNumber}.log"  # log file
+
+        # You must delete corsica non completed files. Otherwise returns an error and exits without executing the file
+        for directory, name in [
+            (tempDir, f"DAT{runNumber}"),
+            (tempDir, f"DAT{runNumber}.long"),
+            (logDir, f"DAT{runNumber}.log"),
+        ]:
+            if self.fW.outputIndex.contains(directory, name):
+                try:
+                    os.remove(f"{directory}/{name}")
+                except FileNotFoundError:
+                    pass
+                self.fW.outputIndex.discard(directory, name)
+
+        def finalize(returncode):
+            if returncode != 0:
+                # A failed simulation is never moved to the data directory
+                self.removeWorkFiles(log10_E1, runNumber)
+                return
+            # Move the file form temp directory to the data directory
+            self.moveToData(log10_E1, runNumber)
+
+        return ProcessSpec(
+            args=[f"{self.pathCorsika}/{self.corsikaExe}"],
+            cwd=self.pathCorsika,  # You must execute corsica in its folder. Otherwise returns an error
+            stdinData=self.fW.makeCard(runNumber, log10_E1, log10_E2).encode(),
+            stdoutFile=logFile,
+            finalize=finalize,
+        )
+
+    def moveToData(self, log10_E, runNumber):
+        """
+        Moves the simulation file from the temp (or scratch) to the data directory if it exists
+        and adds it to the index of the outputs.
+        With a StageOut the file is moved in the background and
+        the index and the journal are updated once it arrived in the data directory.
+        """
+        tempFile = f"{self.fW.directories['work']}/{log10_E}/DAT{runNumber}"
+        dataDir = f"{self.fW.directories['data']}/{log10_E}/"
+        if self.stageOut is not None:
+            if not os.path.isfile(tempFile):
+                # Corsika did not produce the file
+                return
+
+            def stagedOut(error):
+                if error is not None:
+                    return
+                self.fW.outputIndex.add(dataDir, f"DAT{runNumber}")
+                if self.catalog is not None:
+                    self.catalog.submitFile(f"{dataDir}/DAT{runNumber}", log10_E)
+                    self.catalog.collect()
+                if self.journal is not None:
+                    self.journal.markDone(
+                        f"{log10_E}_{runNumber}", f"{dataDir}/DAT{runNumber}"
+                    )
+
+            self.stageOut.submit(tempFile, f"{dataDir}/DAT{runNumber}", stagedOut)
+            if os.path.isfile(f"{tempFile}.long"):
+                # The long file is kept in the temp directory
+                self.stageOut.submit(
+                    f"{tempFile}.long",
+                    f"{self.fW.directories['temp']}/{log10_E}/DAT{runNumber}.long",
+                )
+            return
+        try:
+            os.replace(tempFile, f"{dataDir}/DAT{runNumber}")
+        except FileNotFoundError:
+            # Corsika did not produce the file
+            return
+        except OSError:
+            # temp and data are on different filesystems
+            shutil.move(tempFile, f"{dataDir}/DAT{runNumber}")
+        self.fW.outputIndex.add(dataDir, f"DAT{runNumber}")
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+This class can be used to move the files produced in a node-local scratch directory
+($TMPDIR, /dev/shm or a local SSD) to the shared filesystem in the background.
+The moves are done by a few threads, thus the job slots do not wait for them.
+A file appears in its destination only once it is completely copied.
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import collections
+import os
+import pathlib
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StageOut:
+    """
+    Bounded asynchronous stage-out of files.
+    The callbacks of the completed moves are executed in the main thread by collect(),
+    which should be called once the file descriptor given by fileno() is readable.
+
+    Parameters:
+        maxWorkers: number of threads moving files at the same time
+        maxPending: maximum number of moves waiting or running, submit blocks once it is reached
+    """
+
+    def __init__(self, maxWorkers=4, maxPending=100):
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers)
+        self.pendingSlots = threading.BoundedSemaphore(maxPending)
+        self.pending = 0
+        # key: (source, destination) of the moves registered by the DetectorSimulator
+        self.registeredMoves = {}
+        # The completed moves as (callback, error), appended by the threads
+        self.completed = collections.deque()
+        # The threads write a byte in this pipe to wake up the main loop
+        self.wakeupRead, self.wakeupWrite = os.pipe()
+        os.set_blocking(self.wakeupRead, False)
+
+    def fileno(self):
+        """
+        Returns the file descriptor which becomes readable once a move is completed
+        """
+        return self.wakeupRead
+
+    def register(self, key, source, destination):
+        """
+        Registers a move that will be submitted later with submitRegistered (e.g. once a process is completed)
+        """
+        self.registeredMoves[key] = (source, destination)
+
+    def submitRegistered(self, key, callback=None):
+        """
+        Submits the move registered with the key.
+
+        Returns:
+            True if a move was registered with the key, False otherwise
+        """
+        if key not in self.registeredMoves.keys():
+            return False
+        source, destination = self.registeredMoves.pop(key)
+        self.submit(source, destination, callback)
+        return True
+
+    def submit(self, source, destination, callback=None):
+        """
+        Moves the source file to the destination in the background.
+        It blocks if maxPending moves are already waiting.
+
+        Parameters:
+            source: the file in the scratch directory
+            destination: the final file on the shared filesystem
+            callback: function called as callback(error) in the main thread by collect,
+                      error is None if the move succeeded
+        """
+        self.pendingSlots.acquire()
+        self.pending += 1
+        future = self.executor.submit(self.moveFile, source, destination)
+        future.add_done_callback(
+            lambda future: self.moveCompleted(future, callback)
+        )
+
+    def moveCompleted(self, future, callback):
+        """
+        Executed by the thread once the move is completed
+        """
+        self.completed.append((callback, future.exception()))
+        self.pendingSlots.release()
+        os.write(self.wakeupWrite, b"\0")
+
+    def collect(self):
+        """
+        Executes the callbacks of the completed moves in the current thread.
+
+        Returns:
+            the number of completed moves
+        """
+        try:
+            while os.read(self.wakeupRead, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        completedMoves = 0
+        while self.completed:
+            callback, error = self.completed.popleft()
+            self.pending -= 1
+            completedMoves += 1
+            if error is not None:
+                print(f"Stage-out failed: {error}")
+            if callback is not None:
+                callback(error)
+        return completedMoves
+
+    def close(self):
+        """
+        Waits until all moves are completed and executes their callbacks
+        """
+        self.executor.shutdown(wait=True)
+        self.collect()
+        os.close(self.wakeupRead)
+        os.close(self.wakeupWrite)
+
+    @staticmethod
+    def moveFile(source, destination):
+        """
+        Moves the file. If source and destination are on different filesystems,
+        the file is first copied next to the destination and then renamed,
+        thus the destination never holds a partial file.
+        """
+        pathlib.Path(os.path.dirname(destination)).mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(source, destination)
+            return
+        except OSError as error:
+            if not os.path.isfile(source):
+                raise error
+        partFile = f"{destination}.part"
+        shutil.copyfile(source, partFile)
+        os.replace(partFile, destination)
+        os.remove(source)
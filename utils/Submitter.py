@@ -2,35 +2,128 @@
 
 """
 This class can be used to spawns subprocesses for multiple instances instead of multiple job submissions.
-This takes a single CPU and actually performs a busy wait in Popen.communicate function.
+By default the completion of a subprocess is notified by the kernel (pidfd on Linux),
+so a free slot is refilled as soon as a process exits and no CPU is spent on empty checks.
+The completed processes are reaped with wait4, which also gives their CPU time and peak memory.
+Every process runs in its own session, thus on SIGTERM (e.g. sent by Slurm before the end of the allocation)
+the whole process group of every running job is stopped, the journal records them as interrupted
+and no new job is started.
+A process running longer than its timeout (see JobTimeouts) is stopped the same way,
+recorded as timed out in the journal and started again as long as its retry budget allows.
+A failed process is classified from its exit code and the tail of its log files (see FailureClassifier),
+transient failures are started again after a growing delay, the others are written to the dead-letter list.
 
 @author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
 @date: October 2022
 """
 
+import collections
+import os
+import selectors
+import signal
 import subprocess
 import time
 import pathlib
 
+from utils.ProcessSpec import ProcessSpec
+from utils.FailureClassifier import FailureClassifier
+
 
 class Submitter:
     """
     Classed used for calling multiple scripts in a single submission (eg. on the Horeka cluster)
     """
 
-    def __init__(self, MakeKeySubString, logDir, parallel_sim=50):
+    def __init__(
+        self,
+        MakeKeySubString,
+        logDir,
+        parallel_sim=50,
+        waitMode="event",
+        logMode="file",
+        journal=None,
+        callbacks=[],
+        stageOut=None,
+        walltimeGuard=None,
+        interruptCallbacks=[],
+        jobTimeouts=None,
+        maxRetries=1,
+        failureClassifier=None,
+        retryBackoff=60,
+        deadLetterFile=None,
+    ):
         """
         Parameters:
         key_processString_generator: is a function that yields the key and process string needed for the simulation
         logDir: Directory where log files are stored
         parallelRunningSims: number of parallel processes that wants to be executed
         processDict: Dictionary where all the running processes are stored
+        waitMode: "event" blocks until a process exits (pidfd, or SIGCHLD as fallback),
+                  "poll" checks all processes every 10 seconds (old behaviour)
+        logMode: "file" the process writes its stdout and stderr directly into the log files,
+                 "pipe" the output is kept in memory and written once the process is completed (old behaviour)
+        journal: the JobJournal where the start and the end of every process is recorded (default None)
+        callbacks: list of functions called as callback(key, returncode) when a process is completed
+        stageOut: the StageOut whose completed moves are collected while waiting for the processes (default None).
+                  The loop continues until all its moves are completed
+        walltimeGuard: the WalltimeGuard which decides if a new process can still be completed
+                       before the end of the allocation (default None, every process is started)
+        interruptCallbacks: list of functions called as callback(key) when a running process is killed
+                            because of SIGTERM or its timeout, or a failed process is given up (e.g. to remove its temp files)
+        jobTimeouts: the JobTimeouts which gives the timeout of every process (default None, no limit)
+        maxRetries: how many times a timed out or transiently failed process is started again (default 1)
+        failureClassifier: the FailureClassifier of the failed processes (default None, they are not retried)
+        retryBackoff: the delay in seconds before the first retry of a failed process, it doubles at every attempt (default 60)
+        deadLetterFile: the file where the processes given up are listed (default {logDir}/dead_letters.jsonl)
+        terminating: True once SIGTERM (or SIGINT) was received
         """
 
         self.key_processString_generator = MakeKeySubString()
         self.logDir = logDir
         self.parallelRunningSims = parallel_sim
         self.processDict = {}
+        self.waitMode = waitMode
+        self.logMode = logMode
+        self.journal = journal
+        self.callbacks = list(callbacks)
+        # The ProcessSpec of the processes that are started directly
+        self.specDict = {}
+        # The start time of the running processes and the resource usage of the completed ones
+        self.startTimes = {}
+        self.usageDict = {}
+        # The pidfd of every running process is registered in the selector,
+        # which becomes readable as soon as the process exits.
+        # Without pidfd (python < 3.9 or an old kernel) SIGCHLD wakes up the selector (see handleSignals)
+        self.pidfdDict = {}
+        self.selector = None
+        if self.waitMode == "event":
+            self.selector = selectors.DefaultSelector()
+        # The pipe written by the signal handlers (see signal.set_wakeup_fd)
+        self.signalRead = None
+        self.stageOut = stageOut
+        if (self.selector is not None) and (self.stageOut is not None):
+            # The StageOut wakes up the selector once a move is completed
+            self.selector.register(self.stageOut.fileno(), selectors.EVENT_READ, None)
+        self.walltimeGuard = walltimeGuard
+        self.interruptCallbacks = list(interruptCallbacks)
+        self.terminating = False
+        # True while sleeping (waitMode poll), which the signal handler has to interrupt
+        self.waiting = False
+        # Seconds the processes have to exit after SIGTERM before they are killed
+        self.killTimeout = 10
+        self.jobTimeouts = jobTimeouts
+        self.maxRetries = maxRetries
+        # The time at which every process with a timeout is stopped (SIGTERM, then SIGKILL after killTimeout)
+        self.deadlines = {}
+        self.timedOutKeys = set()
+        # The process string of every running process, the attempts of every key
+        # and the processes waiting to be started again as (time at which it can start, key, processString)
+        self.processStrings = {}
+        self.attempts = collections.Counter()
+        self.retryQueue = collections.deque()
+        self.failureClassifier = failureClassifier
+        self.retryBackoff = retryBackoff
+        self.deadLetterFile = deadLetterFile or f"{logDir}/dead_letters.jsonl"
         # Creates the log directory if it does not exist yet
         pathlib.Path(f"{self.logDir}").mkdir(parents=True, exist_ok=True)
 
@@ -40,10 +133,66 @@ class Submitter:
         It starts as many processes as chosen.
         """
         print("Start Process")
+        self.handleSignals()
         for _ in range(self.parallelRunningSims):
             self.startSingleProcess()
 
-    def startSingleProcess(self, key=None, processString=None):
+    def handleSignals(self):
+        """
+        Installs the handler of SIGTERM and SIGINT, which stops the running processes (see terminateProcesses).
+        The signal wakes up the selector through a pipe given to signal.set_wakeup_fd.
+        SIGCHLD wakes it up as well, thus a process that exits is noticed at once also without pidfd.
+        It MUST be called from the main thread.
+        """
+        signal.signal(signal.SIGTERM, self.signalReceived)
+        signal.signal(signal.SIGINT, self.signalReceived)
+        if self.selector is not None:
+            self.signalRead, signalWrite = os.pipe()
+            os.set_blocking(self.signalRead, False)
+            os.set_blocking(signalWrite, False)
+            signal.set_wakeup_fd(signalWrite)
+            self.selector.register(self.signalRead, selectors.EVENT_READ, None)
+            signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    def signalReceived(self, signum, frame):
+        """
+        Handler of SIGTERM and SIGINT. No new process is started from now on.
+        A sleep (waitMode poll) is interrupted, the selector is woken up by the wakeup pipe.
+        """
+        self.terminating = True
+        if self.waiting:
+            raise InterruptedError
+
+    def isDraining(self):
+        """
+        Checks if no new process can be started,
+        because of SIGTERM or because the allocation is about to end
+        """
+        if self.terminating:
+            return True
+        return (self.walltimeGuard is not None) and self.walltimeGuard.expired()
+
+    def nextAdmitted(self):
+        """
+        Returns the next key and processString which can be completed before the end of the allocation.
+        The processes waiting for a retry come first (once their delay is over), then the ones of the generator.
+        The others are skipped, they stay planned in the journal and are started again by the next submission.
+        Returns (None, None) if there are no more or the allocation is about to end.
+        """
+        while not self.isDraining():
+            key, processString = self.popDueRetry()
+            if key is None:
+                key, processString = next(
+                    self.key_processString_generator, (None, None)
+                )
+            if (key is None) or (self.walltimeGuard is None):
+                return key, processString
+            if self.walltimeGuard.admits(key):
+                return key, processString
+            print(f"Not enough time left in the allocation for {key}, it is skipped")
+        return None, None
+
+    def startSingleProcess(self, key=None, processString=None, env=None):
         """
         It starts a single process.
         It gets the key and the processString returned by the yield
@@ -55,21 +204,94 @@ class Submitter:
         It uses then a Popen to spawn a single process and
         adds it to the processDict.
         In case the key is not valid, it prints a message to the user.
+        env can be given to run the process with a different environment (default inherits it).
+        The processString can also be a ProcessSpec, which is started directly
+        with its working directory and stdin data.
+        No process is started after SIGTERM, the walltimeGuard is only asked for the processes of the generator.
         """
+        if self.terminating:
+            return
         if (key is None) or (processString is None):
-            key, processString = next(self.key_processString_generator, (None, None))
+            key, processString = self.nextAdmitted()
 
         if (key is not None) and (processString is not None):
             print("\n==================== New Process ====================")
-            self.processDict[key] = subprocess.Popen(
-                processString.split(),
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-            )
+            if isinstance(processString, ProcessSpec):
+                self.startSpecProcess(key, processString, env)
+            elif self.logMode == "pipe":
+                self.processDict[key] = subprocess.Popen(
+                    processString.split(),
+                    stderr=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    env=env,
+                    start_new_session=True,
+                )
+            else:
+                # The child gets its own file descriptors of the log files,
+                # thus it can never block on a full pipe and nothing is buffered in the parent
+                with open(f"{self.logDir}/output_{key}.out", "wb") as out, open(
+                    f"{self.logDir}/output_{key}.err", "wb"
+                ) as err:
+                    self.processDict[key] = subprocess.Popen(
+                        processString.split(),
+                        stderr=err,
+                        stdout=out,
+                        env=env,
+                        start_new_session=True,
+                    )
+            self.startTimes[key] = time.monotonic()
+            self.attempts[key] += 1
+            self.processStrings[key] = processString
+            timeout = None
+            if self.jobTimeouts is not None:
+                timeout = self.jobTimeouts.timeout(key)
+            if timeout is not None:
+                self.deadlines[key] = self.startTimes[key] + timeout
+            self.registerProcess(key)
+            if (self.journal is not None) and self.isJournaled(key):
+                self.journal.markRunning(key)
         # else:
         #     print("No more files in yield")
         return
 
+    def startSpecProcess(self, key, spec, env=None):
+        """
+        Starts the process described by the ProcessSpec.
+        Its stdout is written to the spec.stdoutFile (or to the log file)
+        and the spec.stdinData is written to its stdin, which is then closed.
+        The stdin data MUST be small (e.g. a steering card) since it is written before the process is checked.
+
+        Parameters:
+        key: the key of the process
+        spec: the ProcessSpec
+        env: the environment of the process (default inherits it)
+        """
+        stdoutFile = spec.stdoutFile or f"{self.logDir}/output_{key}.out"
+        with open(stdoutFile, "wb") as out, open(
+            f"{self.logDir}/output_{key}.err", "wb"
+        ) as err:
+            self.processDict[key] = subprocess.Popen(
+                spec.split(),
+                cwd=spec.cwd,
+                stdin=subprocess.PIPE if spec.stdinData is not None else None,
+                stderr=err,
+                stdout=out,
+                env=env,
+                start_new_session=True,
+            )
+        self.specDict[key] = spec
+        if spec.stdinData is not None:
+            try:
+                self.processDict[key].stdin.write(spec.stdinData)
+            except BrokenPipeError:
+                # The process exited before reading its input
+                pass
+            finally:
+                try:
+                    self.processDict[key].stdin.close()
+                except BrokenPipeError:
+                    pass
+
     def checkRunningProcesses(self):
         """
         It is a continuos check over the running simulations.
@@ -81,15 +303,347 @@ class Submitter:
         # Gets all the keys in the processDict which needs to be used in the loop
         keyToLoop = list(self.processDict.keys())
 
-        # If there are processes active it keeps looping in while
-        while keyToLoop:
-            keyToLoop = self.singleCheck()
-            # Waits before restarting the loop.
-            # This is done to avoid overloading the CPU with useless checks
-            sleepTime = 10  # seconds
-            time.sleep(sleepTime)
+        # If there are processes active (or files to stage out or retries waiting) it keeps looping in while
+        while (
+            keyToLoop
+            or self.isStagingOut()
+            or (self.retryQueue and not self.isDraining())
+        ) and not self.terminating:
+            if self.waitMode == "event":
+                # Blocks until at least one process has exited or the next timeout (or retry) is due
+                self.waitForCompletion(
+                    timeout=self.nextTimeout() if keyToLoop else 1
+                )
+                self.collectStageOut()
+                self.checkTimeouts()
+                self.startDueRetries()
+                keyToLoop = self.singleCheck()
+            else:
+                self.collectStageOut()
+                self.checkTimeouts()
+                self.startDueRetries()
+                keyToLoop = self.singleCheck()
+                # Waits before restarting the loop.
+                # This is done to avoid overloading the CPU with useless checks
+                sleepTime = 10  # seconds
+                self.waiting = True
+                try:
+                    time.sleep(sleepTime)
+                except InterruptedError:
+                    pass
+                finally:
+                    self.waiting = False
+        if self.terminating:
+            self.terminateProcesses()
         return
 
+    def nextTimeout(self):
+        """
+        Returns the seconds until the next timeout of a running process expires
+        or the next retry can be started (None if there is none)
+        """
+        times = list(self.deadlines.values())
+        times += [readyTime for readyTime, _, _ in self.retryQueue]
+        if not times:
+            return None
+        return max(0, min(times) - time.monotonic())
+
+    def popDueRetry(self):
+        """
+        Removes and returns the key and processString of the first process whose retry delay is over,
+        (None, None) if there is none
+        """
+        now = time.monotonic()
+        for index, (readyTime, key, processString) in enumerate(self.retryQueue):
+            if readyTime <= now:
+                del self.retryQueue[index]
+                return key, processString
+        return None, None
+
+    def isRetrying(self, key):
+        """
+        Checks if the process is waiting in the retry queue
+        """
+        return any(retryKey == key for _, retryKey, _ in self.retryQueue)
+
+    def startDueRetries(self):
+        """
+        Starts the retries whose delay is over in the free slots
+        (the slots of the failed processes are refilled from the generator in the meantime)
+        """
+        while (len(self.processDict) < self.parallelRunningSims) and any(
+            readyTime <= time.monotonic() for readyTime, _, _ in self.retryQueue
+        ):
+            if self.isDraining():
+                return
+            numberRunning = len(self.processDict)
+            self.startSingleProcess()
+            if len(self.processDict) == numberRunning:
+                return
+
+    def checkTimeouts(self):
+        """
+        Stops the processes running longer than their timeout.
+        Their process group (e.g. the sh file and the python script it started) gets SIGTERM,
+        SIGKILL if it is still running killTimeout seconds later.
+        Once the process is reaped it is communicated as timed out (see timedOutProcess).
+        """
+        now = time.monotonic()
+        for key, deadline in list(self.deadlines.items()):
+            if deadline > now:
+                continue
+            if key in self.timedOutKeys:
+                self.signalProcess(key, signal.SIGKILL)
+                self.deadlines.pop(key)
+                continue
+            print(f"The process {key} exceeded its timeout, it is stopped")
+            self.timedOutKeys.add(key)
+            self.signalProcess(key, signal.SIGTERM)
+            self.deadlines[key] = now + self.killTimeout
+
+    def timedOutProcess(self, key):
+        """
+        Communicates a process stopped by its timeout.
+        It is recorded as timed out in the journal, the interruptCallbacks are called
+        and it is started again if it has not used all its retries (see requeue),
+        otherwise it is given up and written to the dead-letter list.
+        Its finalize function (ProcessSpec) and the callbacks are not called.
+
+        Parameters:
+        key: the key of the process
+
+        Returns:
+        keyToLoop: The updated list of processes keys which has to be in loop
+        """
+        self.timedOutKeys.discard(key)
+        self.deadlines.pop(key, None)
+        self.processDict[key].wait()
+        self.specDict.pop(key, None)
+        processString = self.processStrings.pop(key, None)
+        self.startTimes.pop(key, None)
+        usage = self.usageDict.pop(key, None)
+        if self.journal is not None:
+            self.journal.markTimedOut(key, usage)
+        for callback in self.interruptCallbacks:
+            callback(key)
+        self.deleteSingleProcess(key)
+
+        if (self.attempts[key] <= self.maxRetries) and (processString is not None):
+            print(f"The process {key} is started again (attempt {self.attempts[key] + 1})")
+            self.requeue(key, processString)
+        else:
+            print(f"The process {key} timed out {self.attempts[key]} times, it is given up")
+            self.attempts.pop(key, None)
+            FailureClassifier.addDeadLetter(
+                self.deadLetterFile, key, None, "timeout", "exceeded its timeout"
+            )
+        self.startSingleProcess()
+        return list(self.processDict.keys())
+
+    def processFailed(self, key, returncode, processString, logFiles):
+        """
+        Classifies the failure of the process from its exit code and the tail of its log files.
+        A transient failure is started again after retryBackoff * 2**(attempt - 1) seconds,
+        as long as the process has not used all its retries.
+        Otherwise the process is given up and written to the dead-letter list.
+
+        Parameters:
+        key: the key of the process
+        returncode: its exit code
+        processString: the processString to start it again
+        logFiles: its log files
+
+        Returns:
+        failureClass: the class of the failure
+        """
+        failureClass = self.failureClassifier.classify(returncode, logFiles)
+        print(f"The process {key} failed with exit code {returncode} ({failureClass})")
+        if (
+            self.failureClassifier.isTransient(failureClass)
+            and (self.attempts[key] <= self.maxRetries)
+            and (processString is not None)
+        ):
+            delay = self.retryBackoff * 2 ** (self.attempts[key] - 1)
+            print(f"The process {key} is started again in {delay:.0f} s (attempt {self.attempts[key] + 1})")
+            self.requeue(key, processString, delay)
+            return failureClass
+        self.attempts.pop(key, None)
+        FailureClassifier.addDeadLetter(
+            self.deadLetterFile,
+            key,
+            returncode,
+            failureClass,
+            FailureClassifier.lastLine(logFiles),
+        )
+        for callback in self.interruptCallbacks:
+            callback(key)
+        return failureClass
+
+    def logFiles(self, key, spec=None):
+        """
+        Returns the log files of the process, its .err file first
+        """
+        stdoutFile = f"{self.logDir}/output_{key}.out"
+        if (spec is not None) and spec.stdoutFile:
+            stdoutFile = spec.stdoutFile
+        return [f"{self.logDir}/output_{key}.err", stdoutFile]
+
+    def requeue(self, key, processString, delay=0):
+        """
+        Puts a timed out or failed process in the queue of the processes to be started again after the delay in seconds.
+        The derived classes can requeue their own jobs instead (e.g. the DagScheduler its task)
+        """
+        self.retryQueue.append((time.monotonic() + delay, key, processString))
+
+    def terminateProcesses(self):
+        """
+        Stops all running processes after SIGTERM.
+        The process group of every process gets SIGTERM, those still running after killTimeout seconds get SIGKILL.
+        The completed ones are communicated as usual, the killed ones are recorded as interrupted in the journal
+        (thus they are started again by the next submission) and the interruptCallbacks are called.
+        """
+        print("Termination requested: the running processes are stopped")
+        for key in list(self.processDict.keys()):
+            self.signalProcess(key, signal.SIGTERM)
+        deadline = time.monotonic() + self.killTimeout
+        while time.monotonic() < deadline:
+            if all(self.reapProcess(key) for key in self.processDict.keys()):
+                break
+            time.sleep(0.1)
+
+        for key in list(self.processDict.keys()):
+            if self.processDict[key].returncode == 0:
+                # Completed before the signal
+                self.communicateSingleProcess(key)
+                continue
+            if not self.reapProcess(key):
+                self.signalProcess(key, signal.SIGKILL)
+                self.processDict[key].wait()
+            print(f"Interrupted {key}")
+            self.specDict.pop(key, None)
+            self.startTimes.pop(key, None)
+            self.usageDict.pop(key, None)
+            self.processInterrupted(key)
+            self.deleteSingleProcess(key)
+
+    def processInterrupted(self, key):
+        """
+        Records the process killed by SIGTERM as interrupted in the journal and calls the interruptCallbacks.
+        The derived classes can record the jobs of the process instead (e.g. the DagScheduler the tasks of a batch)
+
+        Parameters:
+        key: the key of the process
+        """
+        if self.journal is not None:
+            self.journal.markInterrupted(key)
+        for callback in self.interruptCallbacks:
+            callback(key)
+
+    def waitsForStageOut(self, key):
+        """
+        Checks if the output file of the completed process is still being moved,
+        then the journal records it as done only once it is moved.
+        The derived classes which move the output files themselves tell it (e.g. the DagScheduler)
+        """
+        return False
+
+    def isJournaled(self, key):
+        """
+        Checks if the process is recorded in the journal.
+        The derived classes can start processes that are not (e.g. the DagScheduler its batches)
+        """
+        return True
+
+    def signalProcess(self, key, signum):
+        """
+        Sends the signal to the process group of the process (the process and all its children)
+
+        Parameters:
+        key: the key of the process
+        signum: the signal
+        """
+        try:
+            os.killpg(self.processDict[key].pid, signum)
+        except (ProcessLookupError, PermissionError):
+            # The process group does not exist anymore
+            pass
+
+    def isStagingOut(self):
+        """
+        Checks if the StageOut has moves that are not collected yet
+        """
+        return (self.stageOut is not None) and (self.stageOut.pending > 0)
+
+    def collectStageOut(self):
+        """
+        Executes the callbacks of the moves completed by the StageOut.
+        Their callbacks may start new processes (e.g. the dependents of a task)
+        """
+        if self.stageOut is not None:
+            self.stageOut.collect()
+
+    def addCallback(self, callback):
+        """
+        Adds a function that is called as callback(key, returncode) every time a process is completed
+        """
+        self.callbacks.append(callback)
+
+    def registerProcess(self, key):
+        """
+        Registers the pidfd of the process in the selector, so that the kernel
+        wakes up waitForCompletion as soon as the process exits.
+        If pidfd is not supported (python < 3.9 or an old kernel), the SIGCHLD of the process wakes it up.
+
+        Parameters:
+        key: the key of the process to register
+        """
+        if (self.selector is None) or not hasattr(os, "pidfd_open"):
+            return
+        try:
+            pidfd = os.pidfd_open(self.processDict[key].pid)
+        except OSError:
+            # Old kernel without pidfd support
+            return
+        self.pidfdDict[key] = pidfd
+        self.selector.register(pidfd, selectors.EVENT_READ, key)
+
+    def unregisterProcess(self, key):
+        """
+        Removes the pidfd of the process from the selector and closes it
+
+        Parameters:
+        key: the key of the process to unregister
+        """
+        if key in self.pidfdDict.keys():
+            pidfd = self.pidfdDict.pop(key)
+            if self.selector is not None:
+                self.selector.unregister(pidfd)
+            os.close(pidfd)
+
+    def waitForCompletion(self, timeout=None):
+        """
+        Blocks until at least one of the running processes has exited (or the timeout expired).
+        The selector returns as soon as the pidfd of a process becomes readable
+        or a signal (SIGCHLD, SIGTERM) is written into the wakeup pipe, which is emptied here.
+
+        Parameters:
+        timeout: maximum time in seconds to wait (default None waits forever)
+
+        Returns:
+        keys: the keys of the processes that have exited (empty if unknown or timed out)
+        """
+        keys = []
+        for selKey, _ in self.selector.select(timeout):
+            if selKey.data is not None:
+                keys.append(selKey.data)
+            elif selKey.fd == self.signalRead:
+                try:
+                    while os.read(self.signalRead, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+        return keys
+
     def singleCheck(self):
         """
         Performs a single loop over all running processes and check if one is completed.
@@ -101,15 +655,51 @@ class Submitter:
         keyToLoop = list(self.processDict.keys())
         for key in keyToLoop:
             # Check if the process is completed
-            if self.processDict[key].poll() is not None:
+            if self.reapProcess(key):
                 # Communicates the process that is completed
                 keyToLoop = self.communicateSingleProcess(key)
         return keyToLoop
 
+    def reapProcess(self, key):
+        """
+        Checks if the process is completed without blocking.
+        If so, it is reaped with wait4 and its returncode is set, thus Popen does not wait for it again.
+        Its wall time, CPU time (user + system) and peak memory are stored in the usageDict.
+
+        Parameters:
+        key: the key of the process to check
+
+        Returns:
+        True if the process is completed
+        """
+        process = self.processDict[key]
+        if process.returncode is not None:
+            return True
+        try:
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        except ChildProcessError:
+            # Already reaped by someone else
+            return process.poll() is not None
+        if pid == 0:
+            return False
+        # Same returncode as Popen: negative signal number if the process was killed
+        # (os.waitstatus_to_exitcode needs python 3.9, the icetray environment is 3.7)
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+        self.usageDict[key] = {
+            "wallTime": time.monotonic() - self.startTimes.get(key, time.monotonic()),
+            "cpuTime": rusage.ru_utime + rusage.ru_stime,
+            "maxRss": rusage.ru_maxrss / 1024,  # kB on Linux
+        }
+        return True
+
     def communicateSingleProcess(self, key):
         """
         After the check if the process is completed, it communicates the output.
         Writes the process output and errors to che chosen directory
+        (in logMode "file" the process has already written them itself)
         Pops the process which is completed from the processDict and kills it.
         Starts a new single process
 
@@ -119,13 +709,43 @@ class Submitter:
         Returns:
         keyToLoop: The updated list of processes keys which has to be in loop
         """
-        out, err = self.processDict[key].communicate()
-        if out is None or err is None:
-            return list(self.processDict.keys())
-        with open(f"{self.logDir}/output_{key}.out", "w") as f:
-            f.write(str(out))
-        with open(f"{self.logDir}/output_{key}.err", "w") as f:
-            f.write(str(err))
+        if key in self.timedOutKeys:
+            return self.timedOutProcess(key)
+        self.deadlines.pop(key, None)
+        processString = self.processStrings.pop(key, None)
+        spec = self.specDict.pop(key, None)
+        if spec is not None:
+            # The process has already written its output in the log files
+            self.processDict[key].wait()
+            if spec.finalize is not None:
+                spec.finalize(self.processDict[key].returncode)
+        elif self.logMode == "pipe":
+            out, err = self.processDict[key].communicate()
+            if out is None or err is None:
+                return list(self.processDict.keys())
+            with open(f"{self.logDir}/output_{key}.out", "w") as f:
+                f.write(str(out))
+            with open(f"{self.logDir}/output_{key}.err", "w") as f:
+                f.write(str(err))
+        else:
+            self.processDict[key].wait()
+
+        self.startTimes.pop(key, None)
+        usage = self.usageDict.pop(key, None)
+        returncode = self.processDict[key].returncode
+        failureClass = None
+        if (returncode != 0) and (self.failureClassifier is not None):
+            failureClass = self.processFailed(
+                key, returncode, processString, self.logFiles(key, spec)
+            )
+        else:
+            self.attempts.pop(key, None)
+        if self.journal is not None:
+            self.journal.markCompleted(
+                key, returncode, usage, failureClass, stagingOut=self.waitsForStageOut(key)
+            )
+        for callback in self.callbacks:
+            callback(key, returncode)
 
         self.deleteSingleProcess(key)
 
@@ -142,5 +762,6 @@ class Submitter:
         Parameters:
         key: the key of the process to kill
         """
+        self.unregisterProcess(key)
         if key in self.processDict.keys():
             self.processDict.pop(key).kill()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+This class can be used to know how much time is left in the Slurm allocation
+and to decide if a job can still be completed before the end of it.
+Jobs whose predicted runtime (see RuntimePredictor) does not fit are not started,
+thus no core-hours are spent on jobs that would be killed anyway.
+
+The remaining time is read from $SLURM_JOB_END_TIME or from squeue -h -j $SLURM_JOB_ID -o %L.
+For local tests it can be given directly in the same format (e.g. "0:30:00" or "1-00:00:00").
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import os
+import subprocess
+import time
+
+
+class WalltimeGuard:
+    """
+    Admission control of the jobs according to the remaining time of the allocation.
+
+    Parameters:
+        remainingTime: the remaining time in seconds (None means no limit)
+        predictor: the RuntimePredictor of the jobs (default None, every job costs defaultCost)
+        classify: function that returns the (stage, energy) of a job key, needed by the predictor
+        margin: seconds kept free at the end of the allocation for the clean up (default 300)
+        sigma: the safety margin of the predicted runtime in standard deviations of its scatter (default 2)
+        defaultCost: the runtime in seconds of a job that cannot be predicted (default 0)
+    """
+
+    def __init__(
+        self,
+        remainingTime=None,
+        predictor=None,
+        classify=None,
+        margin=300,
+        sigma=2,
+        defaultCost=0,
+    ):
+        self.deadline = None
+        if remainingTime is not None:
+            self.deadline = time.monotonic() + remainingTime
+        self.predictor = predictor
+        self.classify = classify
+        self.margin = margin
+        self.sigma = sigma
+        self.defaultCost = defaultCost
+
+    @staticmethod
+    def parseTime(text):
+        """
+        Returns the seconds of a time in the Slurm format ([D-]HH:MM:SS, MM:SS or SS),
+        None if it is unlimited or not valid.
+        """
+        text = text.strip()
+        days = 0
+        if "-" in text:
+            day, _, text = text.partition("-")
+            days = int(day)
+        try:
+            parts = [int(part) for part in text.split(":")]
+        except ValueError:
+            # UNLIMITED, NOT_SET, INVALID
+            return None
+        seconds = 0
+        for part in parts:
+            seconds = 60 * seconds + part
+        return days * 86400 + seconds
+
+    @classmethod
+    def fromSlurm(cls, remainingTime="", **kwargs):
+        """
+        Creates the WalltimeGuard with the remaining time of the allocation.
+        remainingTime can be given in the Slurm format (e.g. for local tests),
+        otherwise it is read from $SLURM_JOB_END_TIME or squeue. Outside Slurm there is no limit.
+        """
+        if remainingTime:
+            return cls(remainingTime=cls.parseTime(remainingTime), **kwargs)
+        if os.environ.get("SLURM_JOB_END_TIME"):
+            endTime = float(os.environ["SLURM_JOB_END_TIME"])
+            return cls(remainingTime=endTime - time.time(), **kwargs)
+        if os.environ.get("SLURM_JOB_ID"):
+            try:
+                output = subprocess.run(
+                    ["squeue", "-h", "-j", os.environ["SLURM_JOB_ID"], "-o", "%L"],
+                    capture_output=True,
+                    text=True,
+                    timeout=60,
+                ).stdout
+            except (OSError, subprocess.TimeoutExpired):
+                output = ""
+            if output.strip():
+                return cls(remainingTime=cls.parseTime(output), **kwargs)
+        return cls(remainingTime=None, **kwargs)
+
+    def remaining(self):
+        """
+        Returns the seconds left in the allocation (None if there is no limit)
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def expired(self):
+        """
+        Checks if only the margin is left, thus no job can be started anymore
+        """
+        remaining = self.remaining()
+        return (remaining is not None) and (remaining <= self.margin)
+
+    def cost(self, key):
+        """
+        Returns the predicted runtime of the job in seconds
+        """
+        if (self.predictor is None) or (self.classify is None):
+            return self.defaultCost
+        stage, energy = self.classify(key)
+        cost = self.predictor.predict(stage, energy, sigma=self.sigma)
+        if cost is None:
+            return self.defaultCost
+        return cost
+
+    def admits(self, key):
+        """
+        Checks if the job can be completed before the margin at the end of the allocation
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return True
+        return remaining - self.margin >= self.cost(key)
+
+    def admitsAll(self, keys):
+        """
+        Checks if the jobs can be completed one after the other before the margin at the end of the allocation
+        (e.g. the runs of a batch)
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return True
+        return remaining - self.margin >= sum(self.cost(key) for key in keys)
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+This script keeps a warm python process with icetray already imported, which runs the stage scripts
+(e.g. detector.py, SimulationFiltering.py) on request. Every script runs in a child forked from the warm process,
+thus it starts with all modules imported and a crashing script never takes the worker down.
+The requests are sent over a local Unix socket, one json line per connection:
+    {"command": "run", "script": ..., "arguments": [...], "logsFile": ..., "cwd": ..., "environment": {...}}
+and are answered with a json line once the script is over:
+    {"exitCode": ..., "wallTime": ..., "cpuTime": ..., "maxRss": ...}
+If the connection is closed before (e.g. the job was killed by its timeout), the script is killed.
+{"command": "ping"} and {"command": "stop"} check and stop the worker.
+
+The worker is started once inside the icetray environment (see detectorResponse.sh):
+    $PYTHON utils/WarmWorker.py serve --socket $TMPDIR/warm.sock --preload icecube.icetray icecube.dataio
+and the sh files of the stages call the client with the plain python (see DetectorSimulator.writeSHexeFile):
+    python3 utils/WarmWorker.py run --socket $TMPDIR/warm.sock --logsFile logs/5.0/500001 --fallback $PYTHON -- detector.py ...
+If the worker cannot be reached, the client runs the script itself with the fallback python.
+Without --preload the worker is a plain python stand-in, which is enough to test the protocol.
+It MUST NOT import anything from this repository, since it runs with the python of icetray
+(thus it also works with python 3.7, e.g. no pidfd).
+
+@author: Federico Bontempo <federico.bontempo@kit.edu> PhD student KIT Germany
+@date: October 2022
+"""
+
+import argparse
+import importlib
+import json
+import os
+import runpy
+import selectors
+import signal
+import socket
+import sys
+import time
+import traceback
+
+
+class WarmWorker:
+    """
+    The warm worker serving the requests of a Unix socket.
+
+    Parameters:
+        socketPath: the path of the Unix socket. It should be on a local disk (e.g. $TMPDIR)
+        preload: the modules imported once before serving (e.g. icecube.icetray)
+        parentPid: the worker stops once this process is gone (default None, it runs until stopped)
+    """
+
+    # The variables of the client forwarded to the script (e.g. the GPU given by the ResourcePool)
+    forwardedVariables = ["CUDA_VISIBLE_DEVICES", "OMP_NUM_THREADS", "TMPDIR"]
+    # The exit code of the client if the worker cannot be reached and there is no fallback (EX_TEMPFAIL)
+    unavailableCode = 75
+
+    def __init__(self, socketPath, preload=[], parentPid=None):
+        self.socketPath = socketPath
+        self.preload = list(preload)
+        self.parentPid = parentPid
+        self.running = True
+        # The connection of every running script and its pid and start time
+        self.jobs = {}
+
+    ########################### Client ############################
+
+    @staticmethod
+    def sendRequest(socketPath, request, timeout=None):
+        """
+        Sends the request to the worker and returns its answer.
+        Raises OSError if the worker cannot be reached.
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(socketPath)
+            client.sendall((json.dumps(request) + "\n").encode())
+            answer = b""
+            while not answer.endswith(b"\n"):
+                chunk = client.recv(65536)
+                if not chunk:
+                    raise ConnectionError("The worker closed the connection")
+                answer += chunk
+        return json.loads(answer)
+
+    @classmethod
+    def isAvailable(cls, socketPath):
+        """
+        Checks if a worker answers on the socket
+        """
+        try:
+            return cls.sendRequest(socketPath, {"command": "ping"}, timeout=10)["status"] == "ok"
+        except (OSError, ValueError, KeyError):
+            return False
+
+    @classmethod
+    def waitAvailable(cls, socketPath, timeout=300):
+        """
+        Waits until a worker answers on the socket (e.g. while it imports icetray),
+        returns False if none does within the timeout in seconds
+        """
+        endTime = time.monotonic() + timeout
+        while not cls.isAvailable(socketPath):
+            if time.monotonic() > endTime:
+                return False
+            time.sleep(1)
+        return True
+
+    @classmethod
+    def stop(cls, socketPath):
+        """
+        Stops the worker on the socket, if there is one
+        """
+        try:
+            cls.sendRequest(socketPath, {"command": "stop"}, timeout=10)
+        except (OSError, ValueError):
+            pass
+
+    @classmethod
+    def runRemote(cls, socketPath, script, arguments, logsFile, fallback=""):
+        """
+        Runs the script in the worker and returns its exit code (128 + signal if it was killed).
+        If the worker cannot be reached, this process is replaced by the script run with the fallback python.
+        """
+        request = {
+            "command": "run",
+            "script": script,
+            "arguments": arguments,
+            "logsFile": logsFile,
+            "cwd": os.getcwd(),
+            "environment": {
+                name: os.environ[name]
+                for name in cls.forwardedVariables
+                if name in os.environ
+            },
+        }
+        try:
+            answer = cls.sendRequest(socketPath, request)
+        except (OSError, ValueError) as error:
+            if not fallback:
+                print(f"The worker on {socketPath} cannot be reached: {error}", file=sys.stderr)
+                return cls.unavailableCode
+            print(f"The worker on {socketPath} cannot be reached, the script runs on its own", file=sys.stderr)
+            cls.redirect(logsFile)
+            command = fallback.split() + [script] + arguments
+            os.execvp(command[0], command)
+        exitCode = answer["exitCode"]
+        if exitCode < 0:
+            # Killed by a signal, as reported by the shell
+            return 128 - exitCode
+        return exitCode
+
+    @staticmethod
+    def redirect(logsFile):
+        """
+        Redirects the stdout and stderr (file descriptors 1 and 2) to {logsFile}.out and {logsFile}.err
+        """
+        sys.stdout.flush()
+        sys.stderr.flush()
+        with open(f"{logsFile}.out", "wb") as out, open(f"{logsFile}.err", "wb") as err:
+            os.dup2(out.fileno(), 1)
+            os.dup2(err.fileno(), 2)
+
+    ########################### Worker ############################
+
+    def serve(self):
+        """
+        Imports the preload modules, then serves the requests until it is stopped
+        (or the parentPid is gone). The running scripts are killed when the worker stops.
+        """
+        for module in self.preload:
+            importlib.import_module(module)
+            print("Preloaded", module)
+
+        if os.path.exists(self.socketPath):
+            os.remove(self.socketPath)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.socketPath)
+        os.chmod(self.socketPath, 0o600)
+        self.listener.listen(128)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ, ("listener", None))
+        # Every signal (SIGCHLD of a completed script, SIGTERM) wakes up the selector through the pipe
+        self.wakeupRead, self.wakeupWrite = os.pipe()
+        os.set_blocking(self.wakeupRead, False)
+        os.set_blocking(self.wakeupWrite, False)
+        signal.set_wakeup_fd(self.wakeupWrite)
+        self.selector.register(self.wakeupRead, selectors.EVENT_READ, ("signal", None))
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.shutdown())
+        print("Serving on", self.socketPath, flush=True)
+
+        try:
+            while self.running:
+                for selectorKey, _ in self.selector.select(timeout=1):
+                    kind, data = selectorKey.data
+                    if kind == "listener":
+                        connection, _ = self.listener.accept()
+                        self.selector.register(connection, selectors.EVENT_READ, ("connection", [b""]))
+                    elif kind == "connection":
+                        if selectorKey.fileobj.fileno() == -1:
+                            # Already answered and closed in this loop
+                            continue
+                        self.readConnection(selectorKey.fileobj, data)
+                    else:
+                        os.read(self.wakeupRead, 4096)
+                        self.reapJobs()
+                if (self.parentPid is not None) and not self.isAlive(self.parentPid):
+                    print("The parent process is gone, the worker stops")
+                    self.running = False
+        finally:
+            for connection in list(self.jobs.keys()):
+                self.killJob(connection)
+            self.listener.close()
+            os.remove(self.socketPath)
+
+    def shutdown(self):
+        """
+        Stops the worker at the next loop
+        """
+        self.running = False
+
+    @staticmethod
+    def isAlive(pid):
+        """
+        Checks if the process exists
+        """
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def readConnection(self, connection, buffer):
+        """
+        Reads the request of the connection once its line is complete.
+        If a connection with a running script is closed, the script is killed.
+        """
+        chunk = connection.recv(65536)
+        if not chunk:
+            if connection in self.jobs.keys():
+                print("The client is gone, the script is killed")
+                self.killJob(connection)
+            self.closeConnection(connection)
+            return
+        buffer[0] += chunk
+        if b"\n" not in buffer[0]:
+            return
+        request = json.loads(buffer[0].partition(b"\n")[0])
+        command = request.get("command")
+        if command == "ping":
+            self.answer(connection, {"status": "ok"})
+        elif command == "stop":
+            self.answer(connection, {"status": "ok"})
+            self.running = False
+        elif command == "run":
+            self.startJob(connection, request)
+        else:
+            self.answer(connection, {"status": f"unknown command {command}"})
+
+    def answer(self, connection, answer):
+        """
+        Sends the answer and closes the connection
+        """
+        try:
+            connection.sendall((json.dumps(answer) + "\n").encode())
+        except OSError:
+            # The client is already gone
+            pass
+        self.closeConnection(connection)
+
+    def closeConnection(self, connection):
+        """
+        Unregisters and closes the connection
+        """
+        self.selector.unregister(connection)
+        connection.close()
+
+    def startJob(self, connection, request):
+        """
+        Forks the child which runs the script of the request.
+        Once it is over, the SIGCHLD wakes up the worker (see reapJobs).
+        """
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self.runChild(request, connection)
+        self.jobs[connection] = (pid, time.monotonic())
+        print("Started", request["script"], "pid", pid, flush=True)
+
+    def runChild(self, request, connection):
+        """
+        Runs the script as __main__ in the forked child and exits with its exit code.
+        The file descriptors of the worker are closed first. It never returns.
+        """
+        exitCode = 1
+        try:
+            # Its own process group, thus it is killed together with the processes it starts
+            os.setsid()
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            for fileobj in [self.listener, connection] + list(self.jobs.keys()):
+                fileobj.close()
+            self.selector.close()
+            os.close(self.wakeupRead)
+            os.close(self.wakeupWrite)
+            os.chdir(request["cwd"])
+            os.environ.update(request["environment"])
+            self.redirect(request["logsFile"])
+            sys.argv = [request["script"]] + request["arguments"]
+            sys.path.insert(0, os.path.dirname(os.path.abspath(request["script"])))
+            exitCode = 0
+            runpy.run_path(request["script"], run_name="__main__")
+        except SystemExit as error:
+            if isinstance(error.code, int):
+                exitCode = error.code
+            elif error.code is not None:
+                print(error.code, file=sys.stderr)
+                exitCode = 1
+        except BaseException:
+            traceback.print_exc()
+            exitCode = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exitCode)
+
+    def reapJobs(self):
+        """
+        Reaps the completed children and sends their exit code and accounting to their clients
+        """
+        for connection, (pid, startTime) in list(self.jobs.items()):
+            reapedPid, status, rusage = os.wait4(pid, os.WNOHANG)
+            if reapedPid == 0:
+                continue
+            del self.jobs[connection]
+            if os.WIFSIGNALED(status):
+                exitCode = -os.WTERMSIG(status)
+            else:
+                exitCode = os.WEXITSTATUS(status)
+            self.answer(
+                connection,
+                {
+                    "exitCode": exitCode,
+                    "wallTime": time.monotonic() - startTime,
+                    "cpuTime": rusage.ru_utime + rusage.ru_stime,
+                    "maxRss": rusage.ru_maxrss / 1024,  # kB on Linux
+                },
+            )
+
+    def killJob(self, connection):
+        """
+        Kills the process group of the script of the connection and reaps it.
+        Nobody waits for its result anymore, thus it is not given time to clean up.
+        """
+        pid, _ = self.jobs.pop(connection)
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        os.waitpid(pid, 0)
+
+
+def make_parser():
+    """
+    Makes the arguments of the worker (serve) and of the client (run, stop)
+    """
+    parser = argparse.ArgumentParser(description="Warm worker running the stage scripts")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    serve = subparsers.add_parser("serve", help="Starts the worker")
+    serve.add_argument("--socket", required=True, help="The Unix socket of the worker")
+    serve.add_argument(
+        "--preload",
+        nargs="*",
+        default=[],
+        help="The modules imported once before serving (e.g. icecube.icetray icecube.dataio) [default: none]",
+    )
+    serve.add_argument(
+        "--parentPid",
+        type=int,
+        default=None,
+        help="The worker stops once this process is gone [default: runs until stopped]",
+    )
+
+    run = subparsers.add_parser("run", help="Runs a script in the worker")
+    run.add_argument("--socket", required=True, help="The Unix socket of the worker")
+    run.add_argument("--logsFile", required=True, help="The log files of the script without extension")
+    run.add_argument(
+        "--fallback",
+        default="",
+        help="The python which runs the script if the worker cannot be reached [default: none, exit code 75]",
+    )
+    run.add_argument("script", help="The python script")
+    run.add_argument("arguments", nargs=argparse.REMAINDER, help="Its arguments")
+
+    stop = subparsers.add_parser("stop", help="Stops the worker")
+    stop.add_argument("--socket", required=True, help="The Unix socket of the worker")
+    return parser
+
+
+if __name__ == "__main__":
+    args = make_parser().parse_args()
+    if args.mode == "serve":
+        WarmWorker(args.socket, args.preload, args.parentPid).serve()
+    elif args.mode == "run":
+        arguments = args.arguments
+        if arguments[:1] == ["--"]:
+            arguments = arguments[1:]
+        sys.exit(
+            WarmWorker.runRemote(
+                args.socket, args.script, arguments, args.logsFile, args.fallback
+            )
+        )
+    else:
+        WarmWorker.stop(args.socket)